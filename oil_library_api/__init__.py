@@ -5,14 +5,65 @@ logging.basicConfig()
 
 import ujson
 from pyramid.config import Configurator
+from pyramid.tweens import INGRESS
 from pyramid.renderers import JSON as JSONRenderer
+from pyramid.settings import asbool
+from sqlalchemy.orm import configure_mappers
 from oil_library_api.common.views import cors_policy
+from oil_library_api.common.http_cache import cache_policy
+from oil_library_api.common.cache import cache_config, configure_caches
+from oil_library_api.common.compression import configure_compression
+from oil_library_api.common.plots import plot_cache
+from oil_library_api.common.db import (use_engine, use_memory_db,
+                                       file_engine)
+from oil_library_api.common.metrics import install_query_hooks
+from oil_library_api.warmup import start_warmup, seed_from_snapshot
 
 def load_cors_origins(settings, key):
     if key in settings:
         origins = settings[key].split('\n')
         cors_policy['origins'] = origins
 
+def load_cache_max_age(settings, key):
+    if key in settings:
+        cache_policy['max_age'] = int(settings[key])
+
+def load_oil_cache_config(settings, prefix):
+    config = dict(cache_config)
+
+    if prefix + 'max_size' in settings:
+        config['max_size'] = int(settings[prefix + 'max_size'])
+    if prefix + 'ttl' in settings:
+        config['ttl'] = float(settings[prefix + 'ttl'])
+
+    configure_caches(**config)
+
+def load_compression_config(settings, prefix):
+    config = {}
+
+    if prefix + 'encodings' in settings:
+        config['encodings'] = settings[prefix + 'encodings'].split()
+    if prefix + 'level' in settings:
+        config['level'] = int(settings[prefix + 'level'])
+    if prefix + 'min_size' in settings:
+        config['min_size'] = int(settings[prefix + 'min_size'])
+
+    configure_compression(**config)
+
+def load_plot_cache_dir(settings, key):
+    if key in settings:
+        plot_cache.directory = settings[key]
+
+def load_db_engine(settings, prefix):
+    if asbool(settings.get(prefix + 'enabled', False)):
+        use_memory_db(settings, prefix)
+    else:
+        use_engine(file_engine(settings, 'sqlalchemy.', 'sqlite.'))
+
+def load_library_snapshot(settings, key):
+    if settings.get(key):
+        seed_from_snapshot(settings[key])
+
 def get_json(request):
     return ujson.loads(request.text)
 
@@ -20,6 +71,11 @@ def get_json(request):
 def main(global_config, **settings):
 
     load_cors_origins(settings, 'cors_policy.origins')
+    load_cache_max_age(settings, 'cache_policy.max_age')
+    load_oil_cache_config(settings, 'oil_cache.')
+    load_compression_config(settings, 'compression.')
+    load_plot_cache_dir(settings, 'plots.cache_dir')
+    load_db_engine(settings, 'memory_db.')
 
     config = Configurator(settings=settings)
 
@@ -28,7 +84,29 @@ def main(global_config, **settings):
     config.add_renderer('json', renderer)
 
     config.include("cornice")
+
+    install_query_hooks()
+    # The metrics tween is outermost, so the request timings include
+    # compressing the response.  The session is closed after pyramid_tm
+    # has committed.
+    metrics_tween = 'oil_library_api.common.metrics.metrics_tween_factory'
+    compression_tween = ('oil_library_api.common.compression'
+                         '.compression_tween_factory')
+    config.add_tween(metrics_tween, under=INGRESS)
+    config.add_tween(compression_tween, under=metrics_tween)
+    config.add_tween('oil_library_api.common.db.session_tween_factory',
+                     under=compression_tween)
     # config.include('pyramid_mako')
     config.scan("oil_library_api.views")
-    return config.make_wsgi_app()
+
+    # Set up the relationship backrefs of the oil library models up front,
+    # rather than on the first query.
+    configure_mappers()
+
+    app = config.make_wsgi_app()
+
+    load_library_snapshot(settings, 'snapshot.file')
+    start_warmup(settings)
+
+    return app
 
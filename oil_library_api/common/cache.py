@@ -0,0 +1,177 @@
+"""
+Bounded, thread-safe caches for per-oil computations.
+
+Each cache remembers the database fingerprint its entries were computed
+from, and drops them all when it is accessed with a different one, so a
+long running worker stays correct across database rebuilds.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.orm import object_session
+
+from .db import get_db_fingerprint
+
+logger = logging.getLogger(__name__)
+
+cache_config = {'max_size': 4096, 'ttl': None}
+cache_limits = {}
+caches = OrderedDict()
+
+
+class LRUCache(object):
+    '''
+        A least-recently-used cache bounded by size, and optionally
+        by the age of its entries (ttl, in seconds).
+    '''
+    def __init__(self, name, max_size=None, ttl=None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def lookup(self, key, fingerprint):
+        '''
+            Returns a (found, value) tuple for the key.
+        '''
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+
+            if key in self._data:
+                expires, value = self._data.pop(key)
+
+                if expires is None or expires > time.time():
+                    self._data[key] = (expires, value)
+                    self.hits += 1
+                    return True, value
+
+            self.misses += 1
+            return False, None
+
+    def store(self, key, fingerprint, value):
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+
+            expires = time.time() + self.ttl if self.ttl else None
+
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+
+            while self.max_size and len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, fingerprint, compute):
+        found, value = self.lookup(key, fingerprint)
+
+        if not found:
+            logger.debug('{} cache miss.  Key: "{}"'.format(self.name, key))
+            value = compute()
+            self.store(key, fingerprint, value)
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'name': self.name,
+                    'size': len(self._data),
+                    'max_size': self.max_size,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+    def _check_fingerprint(self, fingerprint):
+        if fingerprint != self.fingerprint:
+            if self.fingerprint is not None:
+                logger.info('database changed, invalidating {} cache'
+                            .format(self.name))
+                self.invalidations += 1
+
+            self._data.clear()
+            self.fingerprint = fingerprint
+
+
+def get_cache(name, max_size=None):
+    '''
+        Returns the named cache, creating it with the configured
+        size and ttl if it doesn't yet exist.  A max_size keeps the
+        cache smaller than the configured size, for caches of large
+        values.
+    '''
+    if max_size is not None:
+        cache_limits[name] = max_size
+
+    if name not in caches:
+        caches[name] = LRUCache(name, **cache_settings(name))
+
+    return caches[name]
+
+
+def cache_settings(name):
+    config = dict(cache_config)
+    limit = cache_limits.get(name)
+
+    if limit is not None and (config['max_size'] is None or
+                              limit < config['max_size']):
+        config['max_size'] = limit
+
+    return config
+
+
+def configure_caches(max_size=None, ttl=None):
+    cache_config.update(max_size=max_size, ttl=ttl)
+
+    for c in caches.values():
+        config = cache_settings(c.name)
+
+        with c._lock:
+            c.max_size = config['max_size']
+            c.ttl = config['ttl']
+            c.clear()
+
+
+def cache_stats():
+    return [c.stats() for c in caches.values()]
+
+
+def cache_oil_arg(name):
+    '''
+        Decorator for functions taking an oil as their only argument.
+        Results are cached by the oil's adios_oil_id, and invalidated
+        when the oil's database changes.
+    '''
+    cache = get_cache(name)
+
+    def decorator(func):
+        def cached_func(oil):
+            fingerprint = get_db_fingerprint(object_session(oil))
+
+            return cache.get_or_compute(oil.adios_oil_id, fingerprint,
+                                        lambda: func(oil))
+
+        cached_func.cache = cache
+        cached_func.__name__ = func.__name__
+        cached_func.__doc__ = func.__doc__
+
+        return cached_func
+
+    return decorator
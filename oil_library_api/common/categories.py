@@ -0,0 +1,120 @@
+"""
+An in-memory index of the oil category tree.
+
+The category table is small, and only changes when the database is
+rebuilt, so we load it once per database version, along with the
+categories of every oil, and precompute the category paths.
+"""
+import re
+from collections import OrderedDict
+
+from oil_library.models import Oil, Category
+
+from .db import get_db_fingerprint
+from .cache import get_cache
+
+category_tree_cache = get_cache('category tree')
+
+product_type_regex = re.compile(r'\b(Crude-|Refined-)\b')
+
+
+class CategoryTree(object):
+    '''
+        categories: (id, parent_id, name) tuples for every category.
+        oil_categories: (adios_oil_id, category_id) tuples for every
+                        category of every oil.
+
+        A category path is the '-' separated names of a category and
+        its ancestors, starting at the root, like 'Crude-Medium'.
+    '''
+    sep = '-'
+
+    def __init__(self, categories, oil_categories):
+        categories = list(categories)
+
+        self.names = dict([(c_id, name) for c_id, _p, name in categories])
+        self.parents = dict([(c_id, p_id) for c_id, p_id, _n in categories])
+
+        self.roots = [c_id for c_id, p_id, _n in categories if p_id is None]
+        self.children = OrderedDict([(c_id, []) for c_id, _p, _n
+                                     in categories])
+        for c_id, p_id, _n in categories:
+            if p_id is not None:
+                self.children[p_id].append(c_id)
+
+        self.ancestors = dict([(c_id, self._ancestors(c_id))
+                               for c_id in self.names])
+        self.paths = dict([(c_id, self.sep.join([self.names[a] for a in anc]))
+                           for c_id, anc in self.ancestors.items()])
+
+        self.oil_categories = OrderedDict()
+        self.oils_by_path = dict([(p.lower(), OrderedDict())
+                                  for p in self.paths.values()])
+
+        for adios_oil_id, c_id in oil_categories:
+            self.oil_categories.setdefault(adios_oil_id, []).append(c_id)
+
+            # An oil in a category is also in its parent categories
+            for a in self.ancestors[c_id]:
+                self.oils_by_path[self.paths[a].lower()][adios_oil_id] = True
+
+    @classmethod
+    def from_session(cls, session):
+        categories = (session.query(Category.id, Category.parent_id,
+                                    Category.name)
+                      .order_by(Category.id))
+        oil_categories = (session.query(Oil.adios_oil_id, Category.id)
+                          .join(Oil.categories))
+
+        return cls(categories.all(), oil_categories.all())
+
+    def _ancestors(self, c_id):
+        '''
+            The category and its parents, starting from the root.
+        '''
+        res = [c_id]
+
+        while self.parents[res[-1]] is not None:
+            res.append(self.parents[res[-1]])
+
+        res.reverse()
+        return res
+
+    def category_paths(self, adios_oil_id, sep='-'):
+        c_ids = self.oil_categories.get(adios_oil_id, [])
+
+        if sep == self.sep:
+            return [self.paths[c] for c in c_ids]
+        else:
+            return [sep.join([self.names[a] for a in self.ancestors[c]])
+                    for c in c_ids]
+
+    def category_paths_str(self, adios_oil_id, sep='-'):
+        cat_str = ','.join(sorted(set(self.category_paths(adios_oil_id,
+                                                          sep))))
+        return product_type_regex.sub('', cat_str)
+
+    def product_types(self):
+        '''
+            The names of the root categories, and of their children.
+        '''
+        return dict([(self.names[r], [self.names[c]
+                                      for c in self.children[r]])
+                     for r in self.roots])
+
+    def oils_in(self, path):
+        '''
+            The adios_oil_ids of the oils in the category with the given
+            path, or any of its sub-categories.  Returns None if there is
+            no such category.
+        '''
+        oil_ids = self.oils_by_path.get(path.lower())
+
+        return list(oil_ids) if oil_ids is not None else None
+
+
+def get_category_tree(session):
+    return category_tree_cache.get_or_compute(
+        'categories', get_db_fingerprint(session),
+        lambda: CategoryTree.from_session(session)
+    )
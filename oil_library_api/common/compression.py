@@ -0,0 +1,207 @@
+"""
+Content encoding of response bodies.
+
+The pre-serialized snapshot bodies only change with the database, so
+they are compressed once, when the snapshot is built, in each of the
+configured encodings.  A request then just picks the encoding the
+client prefers, and sends those bytes as they are.
+
+Other responses that are large enough to be worth it are gzipped by a
+tween as they are sent.  Responses that already have a content encoding,
+like the streamed record lists, are left alone.
+
+Each content coding of a response is a representation of its own, with
+its own strong ETag: the ETag of the content, suffixed with the coding.
+"""
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+compression_config = {'encodings': ('gzip',),
+                      'level': 6,
+                      'min_size': 1024}
+
+compressible_types = ('text/', 'application/json', 'application/x-ndjson')
+
+
+def gzip_compress(body, level=9):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    return compressor.compress(body) + compressor.flush()
+
+
+def brotli_compress(body):
+    return brotli.compress(body, quality=9)
+
+
+def zstd_compress(body):
+    return zstandard.ZstdCompressor(level=19).compress(body)
+
+
+# The encodings we can produce, in our order of preference when the
+# client accepts several of them equally.
+encoders = OrderedDict([('br', brotli_compress if brotli else None),
+                        ('zstd', zstd_compress if zstandard else None),
+                        ('gzip', gzip_compress)])
+
+
+def available_encodings():
+    return tuple([e for e, f in encoders.items() if f is not None])
+
+
+def configure_compression(encodings=None, level=None, min_size=None):
+    '''
+        Sets the encodings the snapshot bodies are stored in, and the
+        compression level and minimum body size of the other responses.
+        Encodings whose library isn't installed are skipped.
+    '''
+    if encodings is not None:
+        compression_config['encodings'] = tuple([e for e in encoders
+                                                 if e in encodings and
+                                                 encoders[e] is not None])
+    if level is not None:
+        compression_config['level'] = level
+    if min_size is not None:
+        compression_config['min_size'] = min_size
+
+
+def encode_body(body):
+    '''
+        Returns a dict of the body in each of the configured encodings.
+        Encodings that don't make the body any smaller are left out.
+    '''
+    res = {}
+
+    for encoding in compression_config['encodings']:
+        encoded = encoders[encoding](body)
+
+        if len(encoded) < len(body):
+            res[encoding] = encoded
+
+    return res
+
+
+def parse_accept_encoding(header):
+    '''
+        Returns a dict of the content codings in an Accept-Encoding
+        header, and their quality values.
+    '''
+    res = {}
+
+    for part in (header or '').split(','):
+        params = part.strip().split(';')
+        coding = params[0].strip().lower()
+
+        if not coding:
+            continue
+
+        q = 1.0
+        for p in params[1:]:
+            name, _sep, value = p.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        res[coding] = q
+
+    return res
+
+
+def choose_encoding(request, encodings):
+    '''
+        The encoding, out of the given ones, that the client prefers, or
+        None if it doesn't accept any of them.
+    '''
+    accepted = parse_accept_encoding(request.headers.get('Accept-Encoding'))
+    best, best_q = None, 0.0
+
+    for encoding in encoders:
+        if encoding not in encodings:
+            continue
+
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+
+        if q > best_q:
+            best, best_q = encoding, q
+
+    return best
+
+
+def encoded_etag(etag, encoding):
+    '''
+        The ETag of the content's representation in the given encoding.
+    '''
+    return etag if encoding is None else '{}-{}'.format(etag, encoding)
+
+
+def set_content_encoding(response, encoding):
+    '''
+        Marks the response's body as encoded, and gives it the ETag of
+        that encoding.
+    '''
+    response.content_encoding = encoding
+
+    if response.etag:
+        response.etag = encoded_etag(response.etag, encoding)
+
+
+def set_snapshot_body(request, snapshot):
+    '''
+        Sets the body of the request's response to the snapshot's body,
+        in the encoding the client prefers.
+    '''
+    response = request.response
+    response.content_type = snapshot.content_type
+
+    encoding = choose_encoding(request, snapshot.encoded)
+
+    if encoding is not None:
+        set_content_encoding(response, encoding)
+        response.body = snapshot.encoded[encoding]
+    else:
+        response.body = snapshot.body
+
+    return response
+
+
+def is_compressible(response):
+    content_type = response.content_type or ''
+
+    return (response.content_encoding is None and
+            isinstance(response.app_iter, list) and
+            content_type.startswith(compressible_types) and
+            (response.content_length or 0) >= compression_config['min_size'])
+
+
+def compression_tween_factory(handler, registry):
+    '''
+        Gzips the responses that aren't already encoded, if the client
+        accepts it.
+    '''
+    def compression_tween(request):
+        response = handler(request)
+
+        if (is_compressible(response) and
+                choose_encoding(request, ('gzip',)) is not None):
+            response.body = gzip_compress(response.body,
+                                          compression_config['level'])
+            set_content_encoding(response, 'gzip')
+
+            vary = tuple(response.vary or ())
+            if 'Accept-Encoding' not in vary:
+                response.vary = vary + ('Accept-Encoding',)
+
+        return response
+
+    return compression_tween
@@ -0,0 +1,393 @@
+"""
+Common database helpers.
+"""
+import os
+import sys
+import atexit
+import sqlite3
+import hashlib
+import logging
+import tempfile
+
+from pyramid.settings import asbool
+from sqlalchemy import engine_from_config, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+import oil_library
+from oil_library import _get_db_session
+from oil_library.models import DBSession, Oil
+
+logger = logging.getLogger(__name__)
+
+# The engine the sessions are bound to, and the fingerprint of the data
+# in it, if it can't change (like an in-memory copy).  Without an engine,
+# the sessions are bound by the oil library itself, as in scripts that
+# don't set one up.  memory_file is the in-memory copy the engine serves,
+# which is deleted along with the engine.
+db_state = {'engine': None, 'fingerprint': None,
+            'engine_fingerprint': None, 'source': None,
+            'memory_file': None}
+
+# The defaults of the sqlalchemy. and sqlite. settings of the engine.
+# The SQLite cache size is in KiB.
+engine_defaults = {'pool_size': 8,
+                   'max_overflow': 4}
+sqlite_defaults = {'mmap_size': 256 * 1024 * 1024,
+                   'cache_size': 64 * 1024,
+                   'query_only': True}
+
+# Besides the foreign keys, the columns we look oils up by.
+indexed_columns = ('adios_oil_id', 'name')
+
+sqlite_header = b'SQLite format 3\x00'
+
+# The directories tried for the in-memory copy of the library, when
+# memory_db.directory is not set.  /dev/shm is backed by memory on Linux.
+memory_dirs = ('/dev/shm',)
+
+
+def get_session():
+    '''
+        Returns the session for the current thread, bound to the app's
+        engine if it has one.
+    '''
+    if db_state['engine'] is None:
+        return _get_db_session()
+    else:
+        return DBSession()
+
+
+def use_engine(engine, fingerprint=None, source=None, memory_file=None):
+    '''
+        Binds the sessions to the engine, closing the connections of the
+        engine it replaces.  A fingerprint is only given for an engine
+        whose data never changes, along with the file it was loaded
+        from, and the in-memory copy it serves.
+    '''
+    previous = db_state['engine']
+    previous_memory_file = db_state['memory_file']
+
+    DBSession.remove()
+    DBSession.configure(bind=engine)
+    db_state['engine'] = engine
+    db_state['fingerprint'] = fingerprint
+    db_state['engine_fingerprint'] = None
+    db_state['source'] = source
+    db_state['memory_file'] = memory_file
+
+    if previous is not None and previous is not engine:
+        previous.dispose()
+
+    if previous_memory_file != memory_file:
+        remove_file(previous_memory_file)
+
+
+def release_connections():
+    '''
+        Closes the pooled connections to the database file (or its
+        in-memory copy), so that processes forked afterwards open their
+        own.  SQLite connections must not be carried across fork().
+    '''
+    get_session().get_bind().dispose()
+
+    DBSession.remove()
+
+
+def session_tween_factory(handler, registry):
+    '''
+        Closes the request's session once its response has been built,
+        which returns its connection to the pool.
+    '''
+    def session_tween(request):
+        try:
+            return handler(request)
+        finally:
+            DBSession.remove()
+
+    return session_tween
+
+
+def file_engine(settings, prefix='sqlalchemy.', sqlite_prefix='sqlite.'):
+    '''
+        Creates the engine of the database given by the sqlalchemy.url
+        setting, which defaults to the oil library's own database file.
+        The other sqlalchemy. settings, like pool_size and max_overflow,
+        are passed on to create_engine().
+
+        SQLite connections are pooled (rather than opened per session)
+        and shared between threads, one at a time, and are set up with
+        the sqlite.mmap_size (bytes), sqlite.cache_size (KiB) and
+        sqlite.query_only settings.
+    '''
+    config = dict([(k, v) for k, v in settings.items()
+                   if k.startswith(prefix)])
+
+    if not config.get(prefix + 'url'):
+        config[prefix + 'url'] = ('sqlite:///' +
+                                  os.path.abspath(oil_library._db_file))
+
+    for k, v in engine_defaults.items():
+        config.setdefault(prefix + k, v)
+
+    kw = {}
+    is_sqlite = make_url(config[prefix + 'url']).drivername == 'sqlite'
+
+    if is_sqlite:
+        kw = {'poolclass': QueuePool,
+              'connect_args': {'check_same_thread': False}}
+
+    engine = engine_from_config(config, prefix, **kw)
+
+    if is_sqlite:
+        pragmas = sqlite_pragmas(settings, sqlite_prefix)
+        event.listen(engine, 'connect',
+                     lambda dbapi_connection, _record:
+                     set_pragmas(dbapi_connection, pragmas))
+
+    return engine
+
+
+def sqlite_pragmas(settings, prefix):
+    config = dict(sqlite_defaults)
+
+    if prefix + 'mmap_size' in settings:
+        config['mmap_size'] = int(settings[prefix + 'mmap_size'])
+    if prefix + 'cache_size' in settings:
+        config['cache_size'] = int(settings[prefix + 'cache_size'])
+    if prefix + 'query_only' in settings:
+        config['query_only'] = asbool(settings[prefix + 'query_only'])
+
+    return [('mmap_size', config['mmap_size']),
+            ('cache_size', -config['cache_size']),
+            ('query_only', 'ON' if config['query_only'] else 'OFF')]
+
+
+def set_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+
+    for name, value in pragmas:
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+    cursor.close()
+
+
+def get_db_fingerprint(session):
+    '''
+        Returns a short string that changes whenever the database behind
+        the session is rebuilt.  For a file based database this is derived
+        from the file's path, size and modification time, so it is cheap
+        enough to check on every request.  An in-memory database has the
+        fingerprint of the file it was loaded from.
+
+        The pooled connections of the app's engine keep the file they
+        were opened on, even after it has been replaced, so they are
+        closed when the fingerprint changes.  This has to be called
+        before the session is used to look anything up.
+    '''
+    bind = session.get_bind()
+
+    if bind is not db_state['engine']:
+        return url_fingerprint(bind.url)
+
+    if db_state['fingerprint'] is not None:
+        return db_state['fingerprint']
+
+    fingerprint = url_fingerprint(bind.url)
+
+    if fingerprint != db_state['engine_fingerprint']:
+        if db_state['engine_fingerprint'] is not None:
+            logger.info('the database has changed, reconnecting')
+            bind.dispose()
+
+        db_state['engine_fingerprint'] = fingerprint
+
+    return fingerprint
+
+
+def get_db_file(session):
+    '''
+        The file the data behind the session comes from, if any.
+    '''
+    bind = session.get_bind()
+
+    if bind is db_state['engine'] and db_state['source'] is not None:
+        return db_state['source']
+
+    return bind.url.database or None
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    '''
+        The SHA-1 digest of the file's content.  Unlike the fingerprint,
+        it is the same for a copy of the file, wherever it is.
+    '''
+    digest = hashlib.sha1()
+
+    with open(filename, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def url_fingerprint(url):
+    parts = [str(url)]
+
+    if url.database and os.path.exists(url.database):
+        stat = os.stat(url.database)
+        parts.extend([stat.st_size, stat.st_mtime])
+
+    key = ':'.join([str(p) for p in parts])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def is_sqlite_file(filename):
+    with open(filename, 'rb') as fd:
+        return fd.read(len(sqlite_header)) == sqlite_header
+
+
+def build_library(oillib_file, db_file):
+    '''
+        Builds the database from the OilLib flat file, unless it is
+        already newer than the file.
+    '''
+    if (os.path.exists(db_file) and
+            os.path.getmtime(db_file) >= os.path.getmtime(oillib_file)):
+        return
+
+    from oil_library.initializedb import make_db
+
+    sys.stderr.write('Building {} from {}...\n'.format(db_file, oillib_file))
+    make_db(oillib_files=[oillib_file], db_file=db_file)
+
+
+def remove_file(filename):
+    if filename and os.path.exists(filename):
+        os.remove(filename)
+
+
+def memory_dir(directory=None):
+    '''
+        The directory to keep the in-memory copy of the library in.
+        Without a memory backed directory, it is kept in the temp
+        directory, and served from the OS page cache.
+    '''
+    if directory:
+        return directory
+
+    for d in memory_dirs:
+        if os.path.isdir(d) and os.access(d, os.W_OK):
+            return d
+
+    logger.warning('no memory backed directory, keeping the in-memory '
+                   'database in {}'.format(tempfile.gettempdir()))
+
+    return tempfile.gettempdir()
+
+
+def copy_database(db_file, copy_file):
+    '''
+        Copies the database file with the SQLite backup API, which gives
+        a consistent copy even if the file is being written to.
+    '''
+    source = sqlite3.connect(db_file)
+    copy = sqlite3.connect(copy_file)
+
+    try:
+        if hasattr(source, 'backup'):
+            source.backup(copy)
+        else:
+            copy.executescript('\n'.join(source.iterdump()))
+    finally:
+        source.close()
+        copy.close()
+
+
+def create_indexes(connection):
+    '''
+        Indexes the foreign keys of the oil library tables, and the
+        columns we look oils up by.
+    '''
+    for table in Oil.metadata.sorted_tables:
+        for column in table.columns:
+            if column.foreign_keys or column.name in indexed_columns:
+                connection.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_{1}" '
+                                   'ON "{0}" ("{1}")'
+                                   .format(table.name, column.name))
+
+    connection.execute('ANALYZE')
+    connection.commit()
+
+
+def memory_engine(source, settings, directory=None):
+    '''
+        Loads the oil library into a read-only database file in a memory
+        backed directory (like /dev/shm).  The source is either a
+        database file, or an OilLib flat file, which we build a database
+        from first.
+
+        The copy is served like the database file, with the sqlite.
+        settings, so every thread gets a pooled connection of its own,
+        and forked worker processes open their own connections to the
+        same pages.  It is deleted when the process exits.
+
+        Returns the engine and the name of the copy.
+    '''
+    fd, memory_file = tempfile.mkstemp(prefix='oil_library_', suffix='.db',
+                                       dir=memory_dir(directory))
+    os.close(fd)
+    atexit.register(remove_file, memory_file)
+
+    try:
+        if is_sqlite_file(source):
+            copy_database(source, memory_file)
+        else:
+            os.remove(memory_file)
+            build_library(source, memory_file)
+
+        connection = sqlite3.connect(memory_file)
+
+        try:
+            create_indexes(connection)
+        finally:
+            connection.close()
+    except Exception:
+        remove_file(memory_file)
+        raise
+
+    logger.info('loaded the oil library from {} into {}'
+                .format(source, memory_file))
+
+    settings = dict(settings)
+    settings['sqlalchemy.url'] = 'sqlite:///' + memory_file
+    settings['sqlite.query_only'] = 'true'
+
+    return file_engine(settings, 'sqlalchemy.', 'sqlite.'), memory_file
+
+
+def default_db_file(settings, prefix='sqlalchemy.'):
+    '''
+        The database file given by the sqlalchemy.url setting, which
+        defaults to the oil library's own database file.
+    '''
+    if settings.get(prefix + 'url'):
+        return make_url(settings[prefix + 'url']).database
+
+    return os.path.abspath(oil_library._db_file)
+
+
+def use_memory_db(settings, prefix='memory_db.'):
+    '''
+        Serve from a read-only in-memory copy of the library.  The
+        memory_db.source defaults to the database the app would serve
+        otherwise, and memory_db.directory to a memory backed directory.
+    '''
+    source = settings.get(prefix + 'source') or default_db_file(settings)
+
+    engine, memory_file = memory_engine(source, settings,
+                                        settings.get(prefix + 'directory'))
+
+    use_engine(engine,
+               url_fingerprint(make_url('sqlite:///' + source)),
+               source, memory_file)
@@ -0,0 +1,139 @@
+"""
+Building the detail JSON of oils.
+
+Oil.tojson() lazily loads each relationship, and recursively includes
+the back-references of each related object, which we would then need to
+prune.  Here we eagerly load an oil and all its child collections in a
+fixed number of queries, and only build the content we return.
+"""
+from sqlalchemy.orm import (object_mapper, class_mapper,
+                            joinedload, subqueryload)
+
+from oil_library.models import Oil, ImportedRecord
+
+oil_collections = ('cuts', 'densities', 'kvis',
+                   'sara_fractions', 'sara_densities',
+                   'molecular_weights')
+
+imported_collections = ('synonyms', 'densities', 'kvis', 'dvis',
+                        'cuts', 'toxicities')
+
+
+def oil_detail_fields():
+    '''
+        The top level fields of the detail JSON of an oil.
+    '''
+    return tuple([c.key for c in class_mapper(Oil).column_attrs] +
+                 ['categories'] + list(oil_collections) +
+                 ['imported', 'estimated'])
+
+
+def oil_detail_query(session, fields=None):
+    '''
+        A query for oils that eagerly loads everything needed to build
+        their detail JSON, or the given fields of it.  Relationships are
+        named rather than referenced as attributes, since some of them
+        are backrefs that only exist once the mappers have been
+        configured.
+    '''
+    imported = joinedload('imported')
+    options = []
+
+    if fields is None or 'imported' in fields:
+        options.append(imported)
+        options.extend([imported.subqueryload(a)
+                        for a in imported_collections])
+
+    if fields is None or 'estimated' in fields:
+        options.append(joinedload('estimated'))
+
+    if fields is None or 'categories' in fields:
+        options.extend([subqueryload('categories').joinedload('parent'),
+                        subqueryload('categories').subqueryload('children')])
+
+    options.extend([subqueryload(a) for a in oil_collections
+                    if fields is None or a in fields])
+
+    return session.query(Oil).options(*options)
+
+
+def load_oil_detail(session, adios_oil_id, fields=None):
+    '''
+        Returns the detail JSON of the oil with the given adios_oil_id,
+        or the given fields of it.  Raises NoResultFound if there is no
+        such oil.
+    '''
+    oil = (oil_detail_query(session, fields).join(Oil.imported)
+           .filter(ImportedRecord.adios_oil_id == adios_oil_id).one())
+
+    return oil_detail_json(oil, fields)
+
+
+def load_oil_details(session, adios_oil_ids, fields=None):
+    '''
+        Returns a dict of the detail JSON of the oils with the given
+        adios_oil_ids, or the given fields of it, keyed by adios_oil_id.
+        Oils that aren't found are left out.  Each relationship is loaded
+        for all the oils at once, so the number of queries doesn't depend
+        on the number of oils.
+    '''
+    if not adios_oil_ids:
+        return {}
+
+    oils = (oil_detail_query(session, fields).join(Oil.imported)
+            .add_columns(ImportedRecord.adios_oil_id)
+            .filter(ImportedRecord.adios_oil_id.in_(adios_oil_ids)))
+
+    return dict([(a, oil_detail_json(o, fields)) for o, a in oils])
+
+
+def oil_detail_json(oil, fields=None):
+    res = columns_json(oil)
+
+    if fields is not None:
+        res = dict([(k, v) for k, v in res.items() if k in fields])
+
+    if fields is None or 'categories' in fields:
+        res['categories'] = [category_json(c) for c in oil.categories]
+
+    for attr in oil_collections:
+        if fields is None or attr in fields:
+            res[attr] = [columns_json(o, exclude=('oil_id',))
+                         for o in getattr(oil, attr)]
+
+    if fields is None or 'imported' in fields:
+        res['imported'] = imported_json(oil.imported)
+
+    if fields is None or 'estimated' in fields:
+        res['estimated'] = (columns_json(oil.estimated)
+                            if oil.estimated is not None else None)
+
+    return res
+
+
+def imported_json(imported):
+    if imported is None:
+        return None
+
+    res = columns_json(imported)
+
+    for attr in imported_collections:
+        res[attr] = [columns_json(o) for o in getattr(imported, attr)]
+
+    return res
+
+
+def category_json(category):
+    res = columns_json(category)
+
+    res['parent'] = (columns_json(category.parent)
+                     if category.parent is not None else None)
+    res['children'] = [columns_json(c) for c in category.children]
+
+    return res
+
+
+def columns_json(obj, exclude=()):
+    return dict([(c.key, getattr(obj, c.key))
+                 for c in object_mapper(obj).column_attrs
+                 if c.key not in exclude])
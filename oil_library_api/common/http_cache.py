@@ -0,0 +1,44 @@
+"""
+HTTP caching helpers: validators, Cache-Control and conditional GETs.
+"""
+import hashlib
+
+from pyramid.httpexceptions import HTTPNotModified
+
+from .compression import encoders, encoded_etag
+
+cache_policy = {'max_age': 0}
+
+
+def make_etag(*parts):
+    key = ':'.join([str(p) for p in parts])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional_get(request, etag, vary=('Accept-Encoding',)):
+    '''
+        Set the ETag and Cache-Control headers on the request's response.
+        If the client already holds the representation identified by
+        the etag, we raise a 304 Not Modified so the view can skip the
+        work of building the response.
+
+        The etag is that of the unencoded content.  The encoded
+        representations get their own (see encoded_etag()), and the
+        client may hold any of them.
+    '''
+    response = request.response
+
+    response.etag = etag
+    response.cache_control = ('public, max-age={}'
+                              .format(cache_policy['max_age']))
+    response.vary = vary
+
+    for encoding in (None,) + tuple(encoders):
+        held = encoded_etag(etag, encoding)
+
+        if held in request.if_none_match:
+            response.etag = held
+
+            headers = [(k, response.headers[k])
+                       for k in ('ETag', 'Cache-Control', 'Vary')]
+            raise HTTPNotModified(headers=headers)
@@ -0,0 +1,302 @@
+"""
+A compact binary snapshot of the oil library.
+
+The snapshot holds what the server otherwise computes from the database
+at startup: the searchable fields of every oil, the category tree, the
+/distinct values, and the unweathered kvis table (with the temperature
+correction constant fitted to each oil), as NumPy columns.  Strings are
+stored once, in a string table, and referred to by their index.
+
+The file is laid out so that it can be memory-mapped, which lets the
+threads of a server and its forked worker processes share the same
+pages:
+
+    magic (8 bytes)
+    header length (little-endian uint64)
+    header (JSON): the fingerprint and content digest of the database
+                   the snapshot was compiled from, small JSON payloads,
+                   and the dtype, shape and offset of each array
+    the arrays, each aligned on a 64 byte boundary
+"""
+import os
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from .viscosity import KVisTable
+from .categories import CategoryTree
+
+magic = b'OILSNAP1'
+format_version = 4
+alignment = 64
+
+# The string and float columns of the searchable fields of each oil.
+# The pour point is stored as its min and max columns.
+oil_string_fields = ('adios_oil_id', 'name', 'location', 'field_name',
+                     'product_type', 'oil_class', 'categories_str',
+                     'synonyms')
+oil_float_fields = ('api', 'viscosity', 'quality_index')
+
+class StringTable(object):
+    '''
+        Collects unique strings, and packs them into a UTF-8 blob and an
+        array of offsets.  None is stored as the index -1.
+    '''
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def add(self, s):
+        if s is None:
+            return -1
+
+        if s not in self.index:
+            self.index[s] = len(self.strings)
+            self.strings.append(s)
+
+        return self.index[s]
+
+    def arrays(self):
+        encoded = [s.encode('utf-8') for s in self.strings]
+        offsets = np.zeros((len(encoded) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+
+        return {'strings_data': np.frombuffer(b''.join(encoded) or b'\0',
+                                              dtype=np.uint8),
+                'strings_offsets': offsets}
+
+
+def float_column(values):
+    return np.array([np.nan if v is None else v for v in values],
+                    dtype=np.float64)
+
+
+def pack_library(records, categories, oil_categories, kvis_table,
+                 payloads=None, fingerprint=None, db_digest=None):
+    '''
+        Packs the library into arrays, and returns them along with the
+        header metadata.
+
+        - records: the searchable fields of the oils, in listing order.
+        - categories: (id, parent_id, name) tuples.
+        - oil_categories: (adios_oil_id, category_id) tuples.
+        - kvis_table: the KVisTable of the unweathered kvis.
+        - payloads: small JSON serializable objects to store as they are.
+    '''
+    strings = StringTable()
+    arrays = {}
+
+    oil_idx = dict([(r['adios_oil_id'], i) for i, r in enumerate(records)])
+    num_oils = len(records)
+
+    for field in oil_string_fields:
+        arrays['oil_' + field] = np.array([strings.add(r[field])
+                                           for r in records],
+                                          dtype=np.int32)
+
+    for field in oil_float_fields:
+        arrays['oil_' + field] = float_column([r[field] for r in records])
+
+    arrays['oil_pour_point_min_k'] = float_column([r['pour_point'][0]
+                                                  for r in records])
+    arrays['oil_pour_point_max_k'] = float_column([r['pour_point'][1]
+                                                  for r in records])
+
+    arrays['category_id'] = np.array([c[0] for c in categories],
+                                     dtype=np.int64)
+    arrays['category_parent_id'] = np.array([-1 if c[1] is None else c[1]
+                                             for c in categories],
+                                            dtype=np.int64)
+    arrays['category_name'] = np.array([strings.add(c[2])
+                                        for c in categories],
+                                       dtype=np.int32)
+
+    oil_categories = [(oil_idx[a], c_id) for a, c_id in oil_categories
+                      if a in oil_idx]
+    arrays['oil_category_oil_idx'] = np.array([o for o, _c
+                                               in oil_categories],
+                                              dtype=np.int64)
+    arrays['oil_category_id'] = np.array([c for _o, c in oil_categories],
+                                         dtype=np.int64)
+
+    kvis_ids = [strings.add(a) for a in kvis_table.adios_oil_ids]
+    arrays['kvis_table_adios_oil_id'] = np.array(kvis_ids, dtype=np.int32)
+    arrays['kvis_table_oil_idx'] = kvis_table.oil_idx
+    arrays['kvis_table_m_2_s'] = kvis_table.m_2_s
+    arrays['kvis_table_ref_temp_k'] = kvis_table.ref_temp_k
+    arrays['kvis_table_k_v2'] = kvis_table.k_v2
+
+    arrays.update(strings.arrays())
+
+    meta = {'format_version': format_version,
+            'fingerprint': fingerprint,
+            'db_digest': db_digest,
+            'num_oils': num_oils,
+            'payloads': payloads or {}}
+
+    return arrays, meta
+
+
+def write_library_snapshot(filename, arrays, meta):
+    '''
+        Writes the arrays and metadata to the file.  The file is written
+        to a temporary name first, so readers never see a partial file.
+    '''
+    layout = {}
+    offset = 0
+
+    for name in sorted(arrays):
+        a = np.ascontiguousarray(arrays[name])
+        arrays[name] = a
+
+        layout[name] = {'dtype': a.dtype.str,
+                        'shape': list(a.shape),
+                        'offset': offset}
+        offset += a.nbytes
+        offset += -offset % alignment
+
+    header = dict(meta, arrays=layout)
+    header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+
+    data_start = len(magic) + 8 + len(header_bytes)
+    padding = -data_start % alignment
+
+    tmp_filename = filename + '.tmp'
+
+    with open(tmp_filename, 'wb') as fd:
+        fd.write(magic)
+        fd.write(struct.pack('<Q', len(header_bytes) + padding))
+        fd.write(header_bytes)
+        fd.write(b' ' * padding)
+
+        for name in sorted(arrays):
+            a = arrays[name]
+            fd.write(a.tobytes())
+            fd.write(b'\0' * (-a.nbytes % alignment))
+
+    os.rename(tmp_filename, filename)
+
+
+class LibrarySnapshot(object):
+    '''
+        A compiled library snapshot, memory-mapped read-only.  The arrays
+        are views of the mapped file, so they are never copied into the
+        process.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as fd:
+            if fd.read(len(magic)) != magic:
+                raise ValueError('{} is not an oil library snapshot'
+                                 .format(filename))
+
+            header_len, = struct.unpack('<Q', fd.read(8))
+            header = json.loads(fd.read(header_len).decode('utf-8'))
+
+            # the mapping stays valid once the file is closed
+            self.mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if header['format_version'] != format_version:
+            raise ValueError('{}: unsupported snapshot format version {}'
+                             .format(filename, header['format_version']))
+
+        self.fingerprint = header['fingerprint']
+        self.db_digest = header['db_digest']
+        self.num_oils = header['num_oils']
+        self.payloads = header['payloads']
+
+        data_start = len(magic) + 8 + header_len
+
+        self.arrays = {}
+        for name, layout in header['arrays'].items():
+            dtype = np.dtype(str(layout['dtype']))
+            shape = tuple(layout['shape'])
+            count = int(np.prod(shape))
+
+            self.arrays[name] = (np.frombuffer(self.mapped, dtype=dtype,
+                                               count=count,
+                                               offset=(data_start +
+                                                       layout['offset']))
+                                 .reshape(shape))
+
+        self._strings = None
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @property
+    def strings(self):
+        '''
+            The decoded string table.
+        '''
+        if self._strings is None:
+            data = self['strings_data'].tobytes()
+            offsets = self['strings_offsets'].tolist()
+
+            self._strings = [data[offsets[i]:offsets[i + 1]].decode('utf-8')
+                             for i in range(len(offsets) - 1)]
+
+        return self._strings
+
+    def string_column(self, name):
+        strings = self.strings
+
+        return [strings[i] if i >= 0 else None
+                for i in self[name].tolist()]
+
+    def float_column(self, name):
+        return [None if np.isnan(v) else v for v in self[name].tolist()]
+
+    def category_tree(self):
+        categories = list(zip(self['category_id'].tolist(),
+                              [None if p < 0 else p
+                               for p in self['category_parent_id'].tolist()],
+                              self.string_column('category_name')))
+
+        adios_oil_ids = self.string_column('oil_adios_oil_id')
+        oil_categories = [(adios_oil_ids[o], c) for o, c
+                          in zip(self['oil_category_oil_idx'].tolist(),
+                                 self['oil_category_id'].tolist())]
+
+        return CategoryTree(categories, oil_categories)
+
+    def oil_list_records(self, tree=None):
+        '''
+            The searchable fields of all oils, as built by
+            build_oil_list()
+        '''
+        if tree is None:
+            tree = self.category_tree()
+
+        columns = dict([(f, self.string_column('oil_' + f))
+                        for f in oil_string_fields])
+        columns.update([(f, self.float_column('oil_' + f))
+                        for f in oil_float_fields])
+
+        pour_point = list(zip(self.float_column('oil_pour_point_min_k'),
+                              self.float_column('oil_pour_point_max_k')))
+
+        records = []
+
+        for i in range(self.num_oils):
+            r = dict([(f, columns[f][i]) for f in columns])
+            r['pour_point'] = list(pour_point[i])
+            r['categories'] = tree.category_paths(r['adios_oil_id'])
+
+            records.append(r)
+
+        return records
+
+    def kvis_table(self):
+        '''
+            The KVisTable the snapshot was compiled with.  Its arrays
+            stay memory-mapped.
+        '''
+        return KVisTable(self.string_column('kvis_table_adios_oil_id'),
+                         self['kvis_table_oil_idx'],
+                         self['kvis_table_m_2_s'],
+                         self['kvis_table_ref_temp_k'],
+                         k_v2=self['kvis_table_k_v2'])
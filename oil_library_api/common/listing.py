@@ -0,0 +1,116 @@
+"""
+An in-memory index over the searchable fields of all oils, used for
+server-side filtering, sorting and paging of the oil listing.
+"""
+
+
+class OilListIndex(object):
+    '''
+        Built from the searchable fields of all oils, as produced by
+        get_oil_searchable_fields().  The columns we filter and sort on
+        are pulled out and normalized once, when the index is built.
+    '''
+    sortable = ('adios_oil_id', 'name', 'location', 'field_name',
+                'product_type', 'oil_class', 'api', 'viscosity',
+                'quality_index')
+
+    def __init__(self, records):
+        self.records = records
+        self.by_id = dict([(r['adios_oil_id'], r) for r in records])
+
+        self._text = [' '.join([r['name'] or '', r['synonyms'] or ''])
+                      .lower()
+                      for r in records]
+        self._categories = [set([c.lower() for c in r['categories']])
+                            for r in records]
+        self._pour_point = [[p for p in r['pour_point'] if p is not None]
+                            for r in records]
+
+    def __len__(self):
+        return len(self.records)
+
+    def records_for(self, adios_oil_ids):
+        return [self.by_id[a] for a in adios_oil_ids if a in self.by_id]
+
+    def query(self, text=None, category=None,
+              api=None, viscosity=None, pour_point=None,
+              sort=None, limit=None, offset=0):
+        '''
+            Returns the total number of matching oils, and the requested
+            page of their records.
+
+            - text: a substring of the oil's name or synonyms.
+            - category: a category path, like 'Crude' or 'Crude-Medium'.
+            - api, viscosity, pour_point: (min, max) ranges.  Either end
+              may be None.  An oil matches the pour point range if any
+              part of its pour point range falls inside it.
+            - sort: the name of a sortable field, prefixed with '-' for
+              a descending sort.
+        '''
+        idx = range(len(self.records))
+
+        if text:
+            text = text.lower()
+            idx = [i for i in idx if text in self._text[i]]
+
+        if category:
+            category = category.lower()
+            prefix = category + '-'
+            idx = [i for i in idx
+                   if any([c == category or c.startswith(prefix)
+                           for c in self._categories[i]])]
+
+        if api is not None:
+            idx = [i for i in idx
+                   if in_range(self.records[i]['api'], api)]
+
+        if viscosity is not None:
+            idx = [i for i in idx
+                   if in_range(self.records[i]['viscosity'], viscosity)]
+
+        if pour_point is not None:
+            idx = [i for i in idx
+                   if overlaps_range(self._pour_point[i], pour_point)]
+
+        if sort:
+            idx = self._sorted(idx, sort)
+
+        total = len(idx)
+        end = None if limit is None else offset + limit
+
+        return total, [self.records[i] for i in idx[offset:end]]
+
+    def _sorted(self, idx, sort):
+        reverse = sort.startswith('-')
+        field = sort.lstrip('-')
+
+        if field not in self.sortable:
+            raise ValueError('cannot sort on "{}"'.format(field))
+
+        # missing values always sort last
+        present = [i for i in idx if self.records[i][field] is not None]
+        missing = [i for i in idx if self.records[i][field] is None]
+
+        present.sort(key=lambda i: self.records[i][field], reverse=reverse)
+
+        return present + missing
+
+
+def in_range(value, value_range):
+    low, high = value_range
+
+    if value is None:
+        return False
+
+    return ((low is None or value >= low) and
+            (high is None or value <= high))
+
+
+def overlaps_range(values, value_range):
+    low, high = value_range
+
+    if not values:
+        return False
+
+    return ((low is None or max(values) >= low) and
+            (high is None or min(values) <= high))
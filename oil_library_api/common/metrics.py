@@ -0,0 +1,232 @@
+"""
+Request timing, SQL query counting and cache statistics.
+
+A tween times each request, and SQLAlchemy cursor events count the
+queries (and the time spent in them) made while handling it.  The
+results are kept per route (and per view, for routes that serve several
+kinds of request), and exposed in the Prometheus text format.
+"""
+import time
+import threading
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from pyramid.settings import asbool
+
+from .cache import cache_stats
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+prefix = 'oil_library_api_'
+
+_request_local = threading.local()
+
+route_view_key = 'oil_library_api.route_view'
+
+
+class Histogram(object):
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+
+
+class Metrics(object):
+    '''
+        Per-route request and query statistics.  Queries made outside
+        of a request (at warm-up, for instance) are recorded under the
+        route 'none'.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latency = defaultdict(Histogram)
+            self.requests = defaultdict(int)
+            self.queries = defaultdict(int)
+            self.query_seconds = defaultdict(float)
+
+    def observe_request(self, route, method, status, seconds,
+                        queries, query_seconds):
+        with self._lock:
+            self.latency[(route, method)].observe(seconds)
+            self.requests[(route, method, status)] += 1
+            self.queries[route] += queries
+            self.query_seconds[route] += query_seconds
+
+    def observe_query(self, seconds):
+        with self._lock:
+            self.queries['none'] += 1
+            self.query_seconds['none'] += seconds
+
+    def exposition(self):
+        '''
+            Returns the metrics in the Prometheus text format
+        '''
+        lines = []
+
+        with self._lock:
+            name = prefix + 'request_duration_seconds'
+            lines.extend(['# HELP {} Request latency by route.'.format(name),
+                          '# TYPE {} histogram'.format(name)])
+
+            for (route, method), h in sorted(self.latency.items()):
+                labels = {'route': route, 'method': method}
+
+                for upper, count in zip(h.buckets, h.counts):
+                    lines.append(sample(name + '_bucket',
+                                        dict(labels, le=repr(upper)),
+                                        count))
+
+                lines.append(sample(name + '_bucket',
+                                    dict(labels, le='+Inf'), h.count))
+                lines.append(sample(name + '_sum', labels, h.sum))
+                lines.append(sample(name + '_count', labels, h.count))
+
+            name = prefix + 'requests_total'
+            lines.extend(['# HELP {} Requests by route and status.'
+                          .format(name),
+                          '# TYPE {} counter'.format(name)])
+            for (route, method, status), count in sorted(self.requests
+                                                         .items()):
+                lines.append(sample(name, {'route': route,
+                                           'method': method,
+                                           'status': status}, count))
+
+            name = prefix + 'db_queries_total'
+            lines.extend(['# HELP {} SQL queries by route.'.format(name),
+                          '# TYPE {} counter'.format(name)])
+            for route, count in sorted(self.queries.items()):
+                lines.append(sample(name, {'route': route}, count))
+
+            name = prefix + 'db_query_seconds_total'
+            lines.extend(['# HELP {} Time spent in SQL queries by route.'
+                          .format(name),
+                          '# TYPE {} counter'.format(name)])
+            for route, seconds in sorted(self.query_seconds.items()):
+                lines.append(sample(name, {'route': route}, seconds))
+
+        stats = cache_stats()
+
+        for stat, metric_type in (('hits', 'counter'),
+                                  ('misses', 'counter'),
+                                  ('evictions', 'counter'),
+                                  ('invalidations', 'counter'),
+                                  ('size', 'gauge')):
+            name = prefix + 'cache_' + stat
+            if metric_type == 'counter':
+                name += '_total'
+
+            lines.extend(['# HELP {} Cache {} by cache.'.format(name, stat),
+                          '# TYPE {} {}'.format(name, metric_type)])
+            for s in stats:
+                lines.append(sample(name, {'cache': s['name']}, s[stat]))
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def sample(name, labels, value):
+    label_str = ','.join(['{}="{}"'.format(k, escape_label(v))
+                          for k, v in sorted(labels.items())])
+
+    return '{}{{{}}} {}'.format(name, label_str, repr(float(value)))
+
+
+def escape_label(value):
+    return (str(value).replace('\\', r'\\')
+            .replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = time.time() - conn.info['query_start_time'].pop()
+
+    counts = getattr(_request_local, 'queries', None)
+
+    if counts is not None:
+        counts[0] += 1
+        counts[1] += elapsed
+    else:
+        metrics.observe_query(elapsed)
+
+
+def install_query_hooks():
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def set_route_view(request, view):
+    '''
+        Labels the request's metrics with the view that handled it, for
+        routes (like /oil) that serve several kinds of request.  The
+        route label becomes '<route>:<view>'.
+    '''
+    request.environ[route_view_key] = view
+
+
+def metrics_tween_factory(handler, registry):
+    '''
+        Times each request, and counts the queries made while handling
+        it.  With the metrics.server_timing setting, the timings are
+        also reported in a Server-Timing response header.
+    '''
+    server_timing = asbool(registry.settings.get('metrics.server_timing',
+                                                 False))
+
+    def metrics_tween(request):
+        _request_local.queries = counts = [0, 0.0]
+        start = time.time()
+        status = 500
+
+        try:
+            response = handler(request)
+            status = response.status_code
+        finally:
+            elapsed = time.time() - start
+            _request_local.queries = None
+
+            route = (request.matched_route.name
+                     if request.matched_route is not None
+                     else 'unmatched')
+
+            view = request.environ.get(route_view_key)
+            if view is not None:
+                route = '{}:{}'.format(route, view)
+
+            metrics.observe_request(route, request.method, status,
+                                    elapsed, counts[0], counts[1])
+
+        if server_timing:
+            response.headers['Server-Timing'] = (
+                'app;dur={:.1f}, db;dur={:.1f};desc="{} queries"'
+                .format(elapsed * 1000.0, counts[1] * 1000.0, counts[0])
+            )
+
+        return response
+
+    return metrics_tween
@@ -0,0 +1,171 @@
+"""
+Viscosity charts of the oils.
+
+The charts are drawn with the Agg backend, straight onto a Figure, so
+no display (or pyplot state) is needed, and rendered charts are kept
+in a disk cache keyed by the database fingerprint and the oil.
+"""
+import os
+import io
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from sqlalchemy import and_
+
+from oil_library.models import Oil, ImportedRecord, KVis
+
+plot_formats = {'png': 'image/png',
+                'svg': 'image/svg+xml'}
+
+# matplotlib doesn't promise to be thread safe, so the server renders
+# one chart at a time.
+render_lock = threading.Lock()
+
+valid_adios_oil_id = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# The names of the cache directories (database fingerprints), so we only
+# ever delete those.
+fingerprint_dir = re.compile(r'^[0-9a-f]{16,40}$')
+
+
+def unweathered_kvis(session, adios_oil_ids=None):
+    '''
+        The name, and the temperatures and unweathered kinematic
+        viscosities, of the given oils (or all of them), loaded with a
+        single query, as an OrderedDict keyed by adios_oil_id.
+    '''
+    query = (session.query(ImportedRecord.adios_oil_id, Oil.name,
+                           KVis.ref_temp_k, KVis.m_2_s)
+             .select_from(Oil)
+             .join(Oil.imported)
+             .outerjoin(KVis, and_(KVis.oil_id == Oil.id,
+                                   KVis.weathering <= 0.0))
+             .order_by(ImportedRecord.adios_oil_id, KVis.ref_temp_k))
+
+    if adios_oil_ids is not None:
+        query = query.filter(ImportedRecord.adios_oil_id.in_(adios_oil_ids))
+
+    res = OrderedDict()
+
+    for adios_oil_id, name, temp_k, m_2_s in query:
+        _name, temps, kvis = res.setdefault(adios_oil_id, (name, [], []))
+
+        if temp_k is not None and m_2_s is not None:
+            temps.append(temp_k)
+            kvis.append(m_2_s)
+
+    return OrderedDict([(a, (n, np.array(t), np.array(k)))
+                        for a, (n, t, k) in res.items()])
+
+
+def render_viscosity_plot(adios_oil_id, name, temps_k, kvis, fmt='png'):
+    '''
+        Draws the unweathered kinematic viscosities of an oil against
+        temperature, and returns the chart in the given format.
+    '''
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+
+    ax = fig.add_subplot(111)
+    ax.set_title(u'{} ({})'.format(name, adios_oil_id), fontsize=11)
+    ax.set_xlabel(r'Temperature ($^\circ$C)')
+    ax.set_ylabel('Unweathered Kinematic Viscosity (m$^2$/s)')
+    ax.grid(True)
+
+    if len(kvis):
+        x = np.asarray(temps_k) - 273.15
+        y = np.asarray(kvis)
+
+        xpadding = .5 if x.max() == x.min() else (x.max() - x.min()) * .3
+
+        ax.plot(x, y, 'ro')
+        ax.set_yscale('log')
+        ax.set_xlim(x.min() - xpadding, x.max() + xpadding)
+        ax.set_ylim(y.min() / 3.0, y.max() * 3.0)
+
+        # label the points on the right to their left, so the labels
+        # stay inside the chart
+        for xx, yy in zip(x, y):
+            right = xx > x.mean()
+
+            ax.annotate(u'({:.4g}$^\\circ$C, {:.3g} m$^2$/s)'.format(xx, yy),
+                        xy=(xx, yy), xytext=(-8 if right else 8, 8),
+                        textcoords='offset points',
+                        ha='right' if right else 'left', fontsize=9)
+    else:
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.text(0.5, 0.5, 'No unweathered kinematic viscosities',
+                ha='center', va='center', transform=ax.transAxes)
+
+    out = io.BytesIO()
+    fig.savefig(out, format=fmt)
+
+    return out.getvalue()
+
+
+class PlotCache(object):
+    '''
+        Rendered charts on disk, in a directory per database
+        fingerprint.  Files are written under a temporary name and then
+        renamed, so the processes sharing the directory never read a
+        partial chart.  When the first chart of a new fingerprint is
+        stored, the directories of the other fingerprints are deleted.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, fingerprint, adios_oil_id, fmt):
+        return os.path.join(self.directory, str(fingerprint),
+                            '{}.viscosity.{}'.format(adios_oil_id, fmt))
+
+    def get(self, fingerprint, adios_oil_id, fmt):
+        try:
+            with open(self.path(fingerprint, adios_oil_id, fmt), 'rb') as fd:
+                return fd.read()
+        except IOError:
+            return None
+
+    def put(self, fingerprint, adios_oil_id, fmt, content):
+        path = self.path(fingerprint, adios_oil_id, fmt)
+        directory = os.path.dirname(path)
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another process made it first
+                if not os.path.isdir(directory):
+                    raise
+            else:
+                self.remove_others(str(fingerprint))
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+
+        os.rename(tmp_path, path)
+
+    def remove_others(self, fingerprint):
+        '''
+            Deletes the charts of all fingerprints but the given one.
+        '''
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+
+            if (name != fingerprint and fingerprint_dir.match(name) and
+                    os.path.isdir(path)):
+                # another process may be deleting it too
+                shutil.rmtree(path, ignore_errors=True)
+
+
+plot_cache = PlotCache(os.path.join(tempfile.gettempdir(),
+                                    'oil_library_api_plots'))
@@ -0,0 +1,163 @@
+"""
+An in-memory full-text index of oil names, synonyms, locations and
+field names, with trigram lookups to tolerate typos.
+"""
+import re
+import bisect
+from collections import defaultdict
+
+token_regex = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    return token_regex.findall(text.lower()) if text else []
+
+
+def trigrams(token):
+    padded = '^' + token + '$'
+
+    return set([padded[i:i + 3] for i in range(len(padded) - 2)])
+
+
+def edit_distance(a, b):
+    '''
+        The optimal string alignment distance between two strings, which
+        counts insertions, deletions, substitutions and transpositions
+        of adjacent characters as one edit each.
+    '''
+    prev2 = None
+    prev = range(len(b) + 1)
+
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+
+            if (i > 1 and j > 1 and
+                    a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                row[j] = min(row[j], prev2[j - 2] + 1)
+
+        prev2, prev = prev, row
+
+    return prev[len(b)]
+
+
+class OilSearchIndex(object):
+    '''
+        Built from the searchable fields of all oils, as produced by
+        get_oil_searchable_fields().
+
+        A query token matches an indexed token exactly, as a prefix,
+        or, for tokens of at least min_fuzzy_len characters, if it is
+        within a few edits of the indexed token.  Candidates for the
+        fuzzy match are the indexed tokens sharing a trigram with the
+        query token.
+
+        A record's score for a query token is the best of its matches,
+        weighted by the field it matched in, and its total score is the
+        sum over the query tokens.
+    '''
+    field_weights = (('name', 3.0),
+                     ('synonyms', 2.0),
+                     ('field_name', 1.0),
+                     ('location', 1.0))
+
+    exact_score = 1.0
+    prefix_score = 0.8
+    fuzzy_score = 0.6
+
+    min_prefix_len = 2
+    min_fuzzy_len = 4
+
+    def __init__(self, records):
+        self.records = records
+
+        self.postings = defaultdict(dict)
+
+        for i, r in enumerate(records):
+            for field, weight in self.field_weights:
+                for token in tokenize(r[field]):
+                    if self.postings[token].get(i, 0.0) < weight:
+                        self.postings[token][i] = weight
+
+        self.tokens = sorted(self.postings.keys())
+
+        self.trigram_index = defaultdict(list)
+
+        for token in self.tokens:
+            for g in trigrams(token):
+                self.trigram_index[g].append(token)
+
+    def __len__(self):
+        return len(self.records)
+
+    def matching_tokens(self, query_token):
+        '''
+            Returns a dict of the indexed tokens matching the query token,
+            and the score of each match.
+        '''
+        res = {}
+
+        if len(query_token) >= self.min_fuzzy_len:
+            max_edits = self.max_edits(query_token)
+            candidates = set()
+
+            for g in trigrams(query_token):
+                candidates.update(self.trigram_index.get(g, ()))
+
+            for token in candidates:
+                if abs(len(token) - len(query_token)) > max_edits:
+                    continue
+
+                edits = edit_distance(query_token, token)
+
+                if edits <= max_edits:
+                    similarity = 1.0 - (float(edits) /
+                                        max(len(token), len(query_token)))
+                    res[token] = self.fuzzy_score * similarity
+
+        if len(query_token) >= self.min_prefix_len:
+            start = bisect.bisect_left(self.tokens, query_token)
+
+            for token in self.tokens[start:]:
+                if not token.startswith(query_token):
+                    break
+
+                res[token] = self.prefix_score
+
+        if query_token in self.postings:
+            res[query_token] = self.exact_score
+
+        return res
+
+    def max_edits(self, query_token):
+        return 1 if len(query_token) < 6 else 2
+
+    def search(self, text, limit=20):
+        '''
+            Returns (score, record) tuples for the best matches of the
+            text, best first.  Records matching more of the query tokens
+            always rank above records matching fewer of them.
+        '''
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+
+        for query_token in set(tokenize(text)):
+            best = {}
+
+            for token, score in self.matching_tokens(query_token).items():
+                for i, weight in self.postings[token].items():
+                    if best.get(i, 0.0) < score * weight:
+                        best[i] = score * weight
+
+            for i, score in best.items():
+                scores[i] += score
+                matched[i] += 1
+
+        ranked = sorted(scores.keys(),
+                        key=lambda i: (-matched[i], -scores[i],
+                                       self.records[i]['name']))
+
+        return [(scores[i], self.records[i]) for i in ranked[:limit]]
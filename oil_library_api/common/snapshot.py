@@ -0,0 +1,92 @@
+"""
+Pre-serialized snapshots of payloads that only change when the
+oil library database is rebuilt.
+"""
+import hashlib
+import logging
+import threading
+
+import ujson
+
+from .db import get_db_fingerprint
+from .compression import encode_body
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot(object):
+    '''
+        The content of a payload, serialized once, along with the
+        fingerprint of the database it was built from and a hash of
+        the serialized bytes, and the bytes compressed in each of the
+        configured content encodings.  If an indexer function is given, it is
+        used to build an index over the content.
+    '''
+    content_type = 'application/json'
+
+    def __init__(self, fingerprint, content, indexer=None):
+        self.fingerprint = fingerprint
+        self.content = content
+        self.index = indexer(content) if indexer is not None else None
+
+        body = ujson.dumps(content)
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        self.body = body
+        self.encoded = encode_body(body)
+        self.version = hashlib.sha1(body).hexdigest()
+
+
+class SnapshotCache(object):
+    '''
+        Holds the current snapshot of a payload, and rebuilds it using
+        the builder function whenever the database fingerprint changes,
+        or after it has been explicitly invalidated.
+    '''
+    def __init__(self, name, builder, indexer=None):
+        self.name = name
+        self.builder = builder
+        self.indexer = indexer
+
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self, session):
+        fingerprint = get_db_fingerprint(session)
+
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.fingerprint != fingerprint:
+            with self._lock:
+                snapshot = self._snapshot
+
+                if snapshot is None or snapshot.fingerprint != fingerprint:
+                    logger.info('building {} snapshot.  Fingerprint: "{}"'
+                                .format(self.name, fingerprint))
+                    snapshot = Snapshot(fingerprint, self.builder(session),
+                                        indexer=self.indexer)
+                    self._snapshot = snapshot
+
+        return snapshot
+
+    def peek(self, fingerprint):
+        '''
+            Returns the current snapshot if it is up to date, without
+            building it.
+        '''
+        snapshot = self._snapshot
+
+        if snapshot is not None and snapshot.fingerprint == fingerprint:
+            return snapshot
+
+    def seed(self, fingerprint, content):
+        '''
+            Installs a snapshot of content that was built elsewhere, like
+            in a compiled library snapshot file.
+        '''
+        with self._lock:
+            self._snapshot = Snapshot(fingerprint, content,
+                                      indexer=self.indexer)
+
+    def invalidate(self):
+        self._snapshot = None
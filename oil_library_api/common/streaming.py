@@ -0,0 +1,80 @@
+"""
+Streaming response bodies.
+
+Rather than serializing a whole list of records (and compressing the
+result) before sending the first byte, we encode and compress them a
+chunk at a time as the response is being sent.
+"""
+import zlib
+
+import ujson
+
+from .compression import (compression_config, choose_encoding,
+                          set_content_encoding)
+
+ndjson_content_type = 'application/x-ndjson'
+
+
+def ndjson_chunks(records, chunk_size=64):
+    '''
+        Yield the records as newline delimited JSON, chunk_size records
+        at a time.
+    '''
+    lines = []
+
+    for r in records:
+        lines.append(ujson.dumps(r))
+
+        if len(lines) >= chunk_size:
+            yield encode_lines(lines)
+            lines = []
+
+    if lines:
+        yield encode_lines(lines)
+
+
+def encode_lines(lines):
+    text = '\n'.join(lines) + '\n'
+
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+def gzip_chunks(chunks, compress_level=None):
+    '''
+        Gzip a stream of chunks incrementally.  Each chunk is flushed
+        through the compressor, so the client can start decoding the
+        records before the last one has been encoded.  The level
+        defaults to the compression.level setting.
+    '''
+    if compress_level is None:
+        compress_level = compression_config['level']
+
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        data = (compressor.compress(chunk) +
+                compressor.flush(zlib.Z_SYNC_FLUSH))
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+def stream_records(request, records):
+    '''
+        Set up the request's response to stream the records as newline
+        delimited JSON, gzipped if the client accepts it.
+    '''
+    response = request.response
+    response.content_type = ndjson_content_type
+
+    chunks = ndjson_chunks(records)
+
+    if choose_encoding(request, ('gzip',)) is not None:
+        set_content_encoding(response, 'gzip')
+        chunks = gzip_chunks(chunks)
+
+    response.app_iter = chunks
+
+    return response
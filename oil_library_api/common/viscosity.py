@@ -0,0 +1,144 @@
+"""
+Batched kinematic viscosity computations over the whole oil library.
+
+Building an OilProps object per oil just to evaluate its viscosity is
+too slow to do for every oil on request.  Here the unweathered kvis
+measurements of every oil are packed into arrays once per database
+version, and the temperature correction is evaluated for all oils at
+once.
+"""
+import numpy as np
+from scipy.optimize import curve_fit
+
+from oil_library.models import Oil, KVis
+
+from .db import get_db_fingerprint
+from .cache import get_cache
+
+# The constant of the exponential temperature correction that OilProps
+# falls back on for oils with less than two measurements.  For the
+# others, it is fitted to the measurements (see fit_k_v2()).
+default_k_v2 = 2100.0
+
+kvis_tables = get_cache('kvis table')
+
+
+class KVisTable(object):
+    '''
+        The unweathered kvis measurements of all oils, packed into
+        flat arrays.  oil_idx holds the index into adios_oil_ids of the
+        oil each measurement belongs to, and measurements are grouped
+        by oil.  k_v2 holds the temperature correction constant of each
+        oil, which is fitted to its measurements unless it is given.
+    '''
+    def __init__(self, adios_oil_ids, oil_idx, m_2_s, ref_temp_k,
+                 k_v2=None):
+        self.adios_oil_ids = adios_oil_ids
+        self.oil_idx = np.asarray(oil_idx, dtype=np.int64)
+        self.m_2_s = np.asarray(m_2_s, dtype=np.float64)
+        self.ref_temp_k = np.asarray(ref_temp_k, dtype=np.float64)
+
+        if k_v2 is not None:
+            self.k_v2 = np.asarray(k_v2, dtype=np.float64)
+            return
+
+        self.k_v2 = np.empty((len(adios_oil_ids),))
+        self.k_v2.fill(default_k_v2)
+
+        counts = np.bincount(self.oil_idx, minlength=len(adios_oil_ids))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        for i in np.nonzero(counts >= 2)[0]:
+            measured = slice(starts[i], starts[i] + counts[i])
+            self.k_v2[i] = fit_k_v2(self.ref_temp_k[measured],
+                                    self.m_2_s[measured])
+
+    @classmethod
+    def from_session(cls, session):
+        '''
+            Like get_oil_viscosity(), we only compute a viscosity for
+            oils with a non-negative API and some kvis measurements.
+        '''
+        adios_oil_ids = [r[0] for r in (session.query(Oil.adios_oil_id)
+                                        .order_by(Oil.id))]
+        idx = dict([(a, i) for i, a in enumerate(adios_oil_ids)])
+
+        rows = (session.query(Oil.adios_oil_id, KVis.m_2_s, KVis.ref_temp_k)
+                .join(Oil.kvis)
+                .filter(Oil.api >= 0)
+                .filter(KVis.weathering == 0.0)
+                .order_by(Oil.id, KVis.id)
+                .all())
+
+        return cls(adios_oil_ids,
+                   [idx[r[0]] for r in rows],
+                   [r[1] for r in rows],
+                   [r[2] for r in rows])
+
+    def kvis_at_temp(self, temp_k):
+        '''
+            Returns an array with the kinematic viscosity (m^2/s) of each
+            oil at the given temperature, or NaN for oils that have no
+            measurements.
+
+            As in OilProps, we take the measurement with the reference
+            temperature closest to temp_k, and correct it to temp_k using
+
+                v = v_ref * exp(k_v2 / temp_k - k_v2 / t_ref)
+
+            with the k_v2 of the oil.
+        '''
+        res = np.empty((len(self.adios_oil_ids),))
+        res.fill(np.nan)
+
+        if len(self.oil_idx) == 0:
+            return res
+
+        # sort the measurements by oil, then by their distance from the
+        # requested temperature.  The sort is stable, so ties go to the
+        # first measurement, like np.argmin() would.
+        dist = np.abs(self.ref_temp_k - temp_k)
+        order = np.lexsort((dist, self.oil_idx))
+
+        sorted_idx = self.oil_idx[order]
+        first = np.ones(sorted_idx.shape, dtype=bool)
+        first[1:] = sorted_idx[1:] != sorted_idx[:-1]
+        closest = order[first]
+
+        v_ref = self.m_2_s[closest]
+        t_ref = self.ref_temp_k[closest]
+        k_v2 = self.k_v2[self.oil_idx[closest]]
+
+        res[self.oil_idx[closest]] = v_ref * np.exp(k_v2 / temp_k -
+                                                    k_v2 / t_ref)
+
+        return res
+
+
+def vis_exp_func(temp_k, a, k_v2):
+    return a * np.exp(k_v2 / temp_k)
+
+
+def fit_k_v2(ref_temp_k, m_2_s):
+    '''
+        Fits the temperature correction constant to an oil's (two or
+        more) measurements by least squares, the same way as
+        OilProps.determine_k_v2(): starting from a range of guesses
+        until the fit converges, and falling back on default_k_v2.
+    '''
+    for k in np.logspace(3.6, 1.0, num=50):
+        try:
+            a_coeff = m_2_s[0] * np.exp(-k / ref_temp_k[0])
+            params, _pcov = curve_fit(vis_exp_func, ref_temp_k, m_2_s,
+                                      p0=(a_coeff, k), maxfev=2000)
+            return params[1]
+        except (ValueError, RuntimeError):
+            continue
+
+    return default_k_v2
+
+
+def get_kvis_table(session):
+    return kvis_tables.get_or_compute('unweathered',
+                                      get_db_fingerprint(session),
+                                      lambda: KVisTable.from_session(session))
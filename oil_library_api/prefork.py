@@ -0,0 +1,208 @@
+"""
+A pre-forking server runner.
+
+The app is loaded, and its caches and indexes warmed up, in the parent
+process, which then forks worker processes that each serve the app with
+waitress from a shared listening socket.  The workers share the warm
+caches with the parent copy-on-write, and since each worker has its own
+interpreter, the CPU bound work of the requests is spread over all the
+cores instead of being serialized by the GIL.
+
+Use it as the server of a pserve config file:
+
+    [server:main]
+    use = egg:oil_library_api#prefork
+    host = 0.0.0.0
+    port = 9898
+    workers = 4
+    threads = 4
+"""
+import os
+import gc
+import time
+import errno
+import signal
+import socket
+import logging
+import multiprocessing
+
+import waitress
+
+from .common.db import release_connections
+from .warmup import warmup_state
+
+logger = logging.getLogger(__name__)
+
+
+class PreforkServer(object):
+    '''
+        Forks the workers, and replaces any that exit until the server
+        is stopped with SIGTERM or SIGINT.
+    '''
+    restart_delay = 1.0
+
+    def __init__(self, app, sock, workers, threads, **kw):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.kw = kw
+
+        self.children = set()
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+
+        if pid == 0:
+            self.run_worker()
+
+        self.children.add(pid)
+        logger.info('started worker {}'.format(pid))
+
+    def run_worker(self):
+        status = 0
+
+        try:
+            # the parent stops the workers
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            waitress.serve(self.app, sockets=[self.sock],
+                           threads=self.threads, **self.kw)
+        except Exception:
+            logger.exception('worker {} failed'.format(os.getpid()))
+            status = 1
+        finally:
+            os._exit(status)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for _i in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            self.children.discard(pid)
+
+            if not self.stopping:
+                logger.warning('worker {} exited with status {}.  '
+                               'Restarting it.'.format(pid, status))
+                time.sleep(self.restart_delay)
+                self.spawn()
+
+        self.sock.close()
+        logger.info('all workers stopped')
+
+
+def wait_for_warmup(poll_interval=0.1):
+    while warmup_state.in_progress:
+        time.sleep(poll_interval)
+
+    if warmup_state.status == 'failed':
+        logger.warning('warm-up failed: {}.  Workers will fill their '
+                       'caches on demand.'.format(warmup_state.error))
+
+
+def listen(host, port, backlog=1024):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+
+    return sock
+
+
+def serve(app, global_conf=None, host='0.0.0.0', port=9898,
+          workers=None, threads=4, **kw):
+    '''
+        Paste server runner.  workers defaults to the number of CPUs.
+        Any other settings are passed on to waitress.
+    '''
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('the prefork server needs os.fork()')
+
+    workers = int(workers) if workers else multiprocessing.cpu_count()
+    sock = listen(host, int(port))
+
+    # Everything the workers share has to be in place before they fork.
+    wait_for_warmup()
+    release_connections()
+
+    # Keep the cyclic garbage collector from touching (and so copying)
+    # the pages of the objects built at startup.
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    logger.info('serving on http://{}:{} with {} workers of {} threads'
+                .format(host, port, workers, threads))
+
+    PreforkServer(app, sock, workers, int(threads), **kw).run()
+
+
+def free_port(host='127.0.0.1'):
+    sock = socket.socket()
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+
+def start_prefork(app, workers, threads=4, host='127.0.0.1', timeout=10.0):
+    '''
+        Serves the app with the prefork server, in a child process, and
+        returns the process and the base url once it is listening.  This
+        is for the benchmark and the tests.  Raises a RuntimeError (and
+        stops the process) if the server is not listening within the
+        timeout, or exits before.
+    '''
+    port = free_port(host)
+    process = multiprocessing.Process(target=serve, args=(app,),
+                                      kwargs={'host': host,
+                                              'port': port,
+                                              'workers': workers,
+                                              'threads': threads})
+    process.start()
+
+    deadline = time.time() + timeout
+    listening = False
+
+    while not listening and process.is_alive() and time.time() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            listening = True
+        except socket.error:
+            time.sleep(0.1)
+
+    if not listening or not process.is_alive():
+        stop_prefork(process)
+
+        raise RuntimeError('the prefork server did not start listening on '
+                           '{}:{} (exit code {})'
+                           .format(host, port, process.exitcode))
+
+    return process, 'http://{}:{}'.format(host, port)
+
+
+def stop_prefork(process):
+    process.terminate()
+    process.join(10)
@@ -0,0 +1,354 @@
+"""
+A rule-based data quality audit of the imported oil records.
+
+The records are split into shards of consecutive ids, and each shard is
+audited by a pool of worker processes.  A worker loads the columns of
+its shard's records and measurements into NumPy arrays, and evaluates
+every rule over them at once.
+
+A rule is a function registered with the audit_rule decorator.  It is
+given an AuditBatch, and returns the batch indexes of the records that
+violate it, once per offending measurement:
+
+    @audit_rule('negative_api', 'The API gravity is negative')
+    def negative_api(batch):
+        return np.nonzero(batch.records['api'] < 0)[0]
+
+The audit writes a summary of the violations of each rule, and a file
+listing the violations of each oil.
+"""
+import os
+import sys
+import json
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from oil_library.models import ImportedRecord, Density, KVis, DVis, Cut
+
+from oil_library_api.common.db import get_session
+from .workers import get_processes, chunked, worker_results
+
+# The record columns, and the measurement tables and their columns, that
+# the rules are evaluated over.
+record_columns = ('adios_oil_id', 'oil_name',
+                  'pour_point_min_k', 'pour_point_max_k')
+record_string_columns = ('adios_oil_id', 'oil_name')
+
+audit_tables = (('densities', Density, ('kg_m_3', 'ref_temp_k',
+                                        'weathering')),
+                ('kvis', KVis, ('m_2_s', 'ref_temp_k', 'weathering')),
+                ('dvis', DVis, ('kg_ms', 'ref_temp_k', 'weathering')),
+                ('cuts', Cut, ('vapor_temp_k', 'liquid_temp_k',
+                               'fraction')))
+
+audit_rules = OrderedDict()
+
+
+def audit_rule(name, description):
+    '''
+        Registers the decorated function as an audit rule.
+    '''
+    def register(func):
+        audit_rules[name] = (description, func)
+        return func
+
+    return register
+
+
+class AuditBatch(object):
+    '''
+        The columns of a shard of imported records, and of their
+        measurements.  Each measurement table has a 'rec' column with
+        the index of its record in the batch, and its rows are sorted by
+        record.
+    '''
+    def __init__(self, records, tables):
+        self.records = records
+        self.tables = tables
+
+    @classmethod
+    def load(cls, session, first_id, last_id):
+        rows = (session.query(ImportedRecord.id,
+                              *[getattr(ImportedRecord, c)
+                                for c in record_columns])
+                .filter(ImportedRecord.id.between(first_id, last_id))
+                .order_by(ImportedRecord.id)
+                .all())
+
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        records = {'id': ids}
+
+        for i, c in enumerate(record_columns, 1):
+            values = [r[i] for r in rows]
+
+            if c in record_string_columns:
+                records[c] = values
+            else:
+                records[c] = np.array(values, dtype=np.float64)
+
+        tables = {}
+
+        for name, model, columns in audit_tables:
+            rows = (session.query(model.imported_record_id,
+                                  *[getattr(model, c) for c in columns])
+                    .filter(model.imported_record_id.between(first_id,
+                                                             last_id))
+                    .order_by(model.imported_record_id, model.id)
+                    .all())
+
+            data = (np.array(rows, dtype=np.float64)
+                    .reshape((len(rows), len(columns) + 1)))
+
+            record_ids = data[:, 0].astype(np.int64)
+            rec = np.searchsorted(ids, record_ids)
+            known = ids[np.minimum(rec, len(ids) - 1)] == record_ids
+
+            table = {'rec': rec[known]}
+            for i, c in enumerate(columns, 1):
+                table[c] = data[known, i]
+
+            tables[name] = table
+
+        return cls(records, tables)
+
+    def __len__(self):
+        return len(self.records['id'])
+
+
+def match_rows(a_keys, b_keys):
+    '''
+        For each row of the b key columns, the index of the first row of
+        the a key columns with the same values, or -1.  Rows with a NaN
+        key never match.
+    '''
+    num_b = len(b_keys[0])
+    res = np.full(num_b, -1, dtype=np.int64)
+
+    if not len(a_keys[0]) or not num_b:
+        return res
+
+    a = np.column_stack(a_keys)
+    b = np.column_stack(b_keys)
+
+    keys, inverse = np.unique(np.vstack([a, b]), axis=0, return_inverse=True)
+    a_ids, b_ids = inverse[:len(a)], inverse[len(a):]
+
+    first = np.full(len(keys), -1, dtype=np.int64)
+    first[a_ids[::-1]] = np.arange(len(a))[::-1]
+
+    res[:] = first[b_ids]
+
+    return res
+
+
+def sorted_pairs(table, *keys):
+    '''
+        Sorts the table by record and the given columns, and returns the
+        sort order, and a mask of the rows that follow a row of the same
+        record (and of the same value of any leading key but the last).
+    '''
+    order = np.lexsort([table[k] for k in reversed(keys)] + [table['rec']])
+
+    same = table['rec'][order][1:] == table['rec'][order][:-1]
+    for k in keys[:-1]:
+        same &= table[k][order][1:] == table[k][order][:-1]
+
+    return order, same
+
+
+# Thermal expansion coefficient used to bring densities to another
+# temperature, as in the ADIOS oil properties.
+density_k_rho = 0.0008
+
+# The largest relative difference between the density implied by a pair
+# of kinematic and dynamic viscosities, and the measured density.
+viscosity_density_tolerance = 0.1
+
+# Plausible densities of oils, for when there is no measured density.
+density_range = (500.0, 1500.0)
+
+
+@audit_rule('density_not_decreasing',
+            'A density does not decrease with temperature')
+def density_not_decreasing(batch):
+    d = batch.tables['densities']
+    order, same = sorted_pairs(d, 'weathering', 'ref_temp_k')
+
+    temp, rho = d['ref_temp_k'][order], d['kg_m_3'][order]
+
+    with np.errstate(invalid='ignore'):
+        bad = same & (temp[1:] > temp[:-1]) & (rho[1:] >= rho[:-1])
+
+    return d['rec'][order][1:][bad]
+
+
+@audit_rule('viscosities_inconsistent',
+            'The dynamic and kinematic viscosities at a temperature imply '
+            'a density that does not match the measured one')
+def viscosities_inconsistent(batch):
+    kvis, dvis = batch.tables['kvis'], batch.tables['dvis']
+    d = batch.tables['densities']
+
+    m = match_rows((kvis['rec'], kvis['weathering'], kvis['ref_temp_k']),
+                   (dvis['rec'], dvis['weathering'], dvis['ref_temp_k']))
+    matched = m >= 0
+
+    rec = dvis['rec'][matched]
+    temp = dvis['ref_temp_k'][matched]
+    weathering = dvis['weathering'][matched]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        implied = dvis['kg_ms'][matched] / kvis['m_2_s'][m[matched]]
+
+    # the density of the same weathering at the lowest temperature
+    order = np.lexsort((d['ref_temp_k'], d['weathering'], d['rec']))
+    idx = match_rows((d['rec'][order], d['weathering'][order]),
+                     (rec, weathering))
+    has_density = idx >= 0
+
+    rho0 = np.full(len(rec), np.nan)
+    temp0 = np.full(len(rec), np.nan)
+    rho0[has_density] = d['kg_m_3'][order][idx[has_density]]
+    temp0[has_density] = d['ref_temp_k'][order][idx[has_density]]
+    expected = rho0 * (1.0 - density_k_rho * (temp - temp0))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bad = np.where(has_density,
+                       np.abs(implied - expected) / expected >
+                       viscosity_density_tolerance,
+                       (implied < density_range[0]) |
+                       (implied > density_range[1]))
+
+    return rec[bad]
+
+
+@audit_rule('cut_fractions_invalid',
+            'A cumulative distillation fraction is outside [0, 1], or '
+            'decreases with vapor temperature')
+def cut_fractions_invalid(batch):
+    cuts = batch.tables['cuts']
+    order, same = sorted_pairs(cuts, 'vapor_temp_k')
+
+    fraction = cuts['fraction'][order]
+    rec = cuts['rec'][order]
+
+    with np.errstate(invalid='ignore'):
+        out_of_range = (fraction < 0.0) | (fraction > 1.0)
+        decreasing = same & (fraction[1:] < fraction[:-1])
+
+    return np.concatenate([rec[out_of_range], rec[1:][decreasing]])
+
+
+@audit_rule('missing_pour_point', 'The pour point is missing')
+def missing_pour_point(batch):
+    r = batch.records
+
+    return np.nonzero(np.isnan(r['pour_point_min_k']) &
+                      np.isnan(r['pour_point_max_k']))[0]
+
+
+def audit_shard(args):
+    '''
+        Audits the records with ids in the given range, and returns the
+        number of records, and the violations of each record that has
+        any.  This runs in the worker processes.
+    '''
+    first_id, last_id, rule_names = args
+
+    session = get_session()
+    batch = AuditBatch.load(session, first_id, last_id)
+    session.close()
+
+    counts = OrderedDict()
+
+    for name in rule_names:
+        _description, rule = audit_rules[name]
+        rec = np.asarray(rule(batch), dtype=np.int64)
+
+        counts[name] = np.bincount(rec, minlength=len(batch))
+
+    violations = []
+
+    for i in range(len(batch)):
+        found = [(name, int(c[i])) for name, c in counts.items() if c[i]]
+
+        if found:
+            violations.append({'adios_oil_id':
+                               batch.records['adios_oil_id'][i],
+                               'oil_name': batch.records['oil_name'][i],
+                               'violations': [{'rule': name, 'count': c}
+                                              for name, c in found]})
+
+    return len(batch), violations
+
+
+def run_audit(settings):
+    '''
+        Audits the imported records, and writes the summary and the
+        violations of each oil to the output directory.  Returns the
+        summary.
+
+        settings:
+        - output_dir: where the files are written.
+        - rules: space separated names of the rules to evaluate.
+                 Defaults to all of them.
+        - shard_size: the number of records audited at a time.
+        - processes: see workers.py.
+    '''
+    output_dir = settings.get('output_dir', 'oil_library_audit')
+    rule_names = settings.get('rules', ' '.join(audit_rules)).split()
+    shard_size = int(settings.get('shard_size', 500))
+    processes = get_processes(settings)
+
+    unknown = set(rule_names) - set(audit_rules)
+    if unknown:
+        raise ValueError('unknown audit rules: {}'
+                         .format(', '.join(sorted(unknown))))
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    session = get_session()
+    ids = [i for i, in session.query(ImportedRecord.id)
+           .order_by(ImportedRecord.id)]
+    session.close()
+
+    shards = [(s[0], s[-1], rule_names) for s in chunked(ids, shard_size)]
+    start = time.time()
+
+    rule_counts = OrderedDict([(name, {'description': audit_rules[name][0],
+                                       'records': 0,
+                                       'violations': 0})
+                               for name in rule_names])
+    num_records = 0
+    num_failed = 0
+
+    violations_file = os.path.join(output_dir, 'violations.ndjson')
+
+    with worker_results(audit_shard, shards, processes) as results:
+        with open(violations_file, 'w') as fd:
+            for count, violations in results:
+                num_records += count
+                num_failed += len(violations)
+
+                for v in violations:
+                    for r in v['violations']:
+                        rule_counts[r['rule']]['records'] += 1
+                        rule_counts[r['rule']]['violations'] += r['count']
+
+                    fd.write(json.dumps(v, sort_keys=True) + '\n')
+
+                sys.stderr.write('audited {}/{} records\n'
+                                 .format(num_records, len(ids)))
+
+    summary = {'records': num_records,
+               'records_with_violations': num_failed,
+               'rules': rule_counts,
+               'seconds': round(time.time() - start, 3)}
+
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as fd:
+        fd.write(json.dumps(summary, indent=2, sort_keys=True) + '\n')
+
+    return summary
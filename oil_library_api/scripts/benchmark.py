@@ -0,0 +1,418 @@
+"""
+Benchmarks for the hot paths of the API.
+
+We build (or reuse) an oil library database from the OilLib flat file,
+and time requests to /oil, /oil/{adios_oil_id} and /distinct made
+directly against the WSGI app:
+
+- cold: the first request after the caches have been emptied.
+- warm: repeated requests, one at a time.
+- concurrent: the same requests, made by several client threads.
+
+With prefork_workers set, the oil detail requests are also made over
+HTTP to the prefork server, with one worker and then with that many, to
+measure how the throughput scales with the workers.
+
+The results, including the number of SQL queries per request and the
+peak memory of the process, are written as JSON.  If a baseline
+results file exists, the run fails when it regresses past it.
+"""
+import os
+import sys
+import json
+import time
+import Queue
+import urllib2
+import platform
+import resource
+import threading
+
+from webob import Request
+
+from pyramid.paster import (get_appsettings,
+                            setup_logging)
+from pyramid.settings import asbool
+
+from pyramid.scripts.common import parse_vars
+
+from oil_library_api import main as make_app
+from oil_library_api.common.db import build_library
+from oil_library_api.common.cache import caches
+from oil_library_api.common.metrics import metrics
+from oil_library_api.prefork import start_prefork, stop_prefork
+from oil_library_api.views.oil import oil_list_snapshot
+from oil_library_api.views.distinct import distinct_snapshot
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+default_oillib = os.path.join(here, '..', '..', 'data', 'OilLib')
+
+# (name, route, path).  The detail path is filled in with each of the
+# sampled oil ids in turn.
+endpoints = (('oil list', 'oil:list', '/oil'),
+             ('oil detail', 'oil:detail', '/oil/{}'),
+             ('distinct', 'distinct', '/distinct'))
+
+# The measurements we compare against the baseline.  For each one,
+# whether higher values are better, and the tolerance.  A tolerance of
+# None means we use the one given in the settings.
+checks = (('cold', 'p50_ms', False, None),
+          ('warm', 'p50_ms', False, None),
+          ('warm', 'p95_ms', False, None),
+          ('warm', 'queries_per_request', False, 0.0),
+          ('concurrent', 'p95_ms', False, None),
+          ('concurrent', 'throughput_rps', True, None))
+
+# The clients of the prefork runs.
+prefork_clients = 16
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: {0} <config_uri> [var=value]\n'
+          '(example: "{0} development.ini clients=8 prefork_workers=4 '
+          'output=results.json baseline=baseline.json")'.format(cmd))
+    sys.exit(1)
+
+
+def use_library(settings, db_file):
+    '''
+        Points the app's engine (or its in-memory copy) at the database
+        file, through the settings the app is created with.
+    '''
+    db_file = os.path.abspath(db_file)
+
+    settings['sqlalchemy.url'] = 'sqlite:///' + db_file
+    settings['memory_db.source'] = db_file
+
+
+def reset_caches():
+    for cache in caches.values():
+        cache.clear()
+
+    oil_list_snapshot.invalidate()
+    distinct_snapshot.invalidate()
+
+
+def peak_memory_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on linux, bytes on OS X
+    if sys.platform == 'darwin':
+        rss /= 1024.0
+
+    return round(rss / 1024.0, 1)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+
+    idx = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[idx]
+
+
+def request_path(app, path):
+    '''
+        Returns the latency of the request in seconds, and whether it
+        succeeded.
+    '''
+    start = time.time()
+    response = Request.blank(path).get_response(app)
+    elapsed = time.time() - start
+
+    return elapsed, response.status_code == 200
+
+
+def request_url(base_url, path):
+    '''
+        Like request_path(), over HTTP.
+    '''
+    start = time.time()
+
+    try:
+        urllib2.urlopen(base_url + path, timeout=30).read()
+        ok = True
+    except urllib2.URLError:
+        ok = False
+
+    return time.time() - start, ok
+
+
+def time_requests(app, paths, clients=1, request=request_path):
+    '''
+        Makes the requests using the given number of client threads,
+        and returns their latencies and errors, and the total elapsed
+        time.  The app is passed on to the request function, along with
+        each path.
+    '''
+    work = Queue.Queue()
+    for p in paths:
+        work.put(p)
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            try:
+                path = work.get_nowait()
+            except Queue.Empty:
+                return
+
+            elapsed, ok = request(app, path)
+
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    start = time.time()
+
+    threads = [threading.Thread(target=client) for _i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return latencies, errors[0], time.time() - start
+
+
+def summarize(latencies, errors, elapsed, queries):
+    latencies = sorted(latencies)
+    ms = [l * 1000.0 for l in latencies]
+    count = len(ms)
+
+    return {'requests': count,
+            'errors': errors,
+            'mean_ms': round(sum(ms) / count, 3) if count else None,
+            'p50_ms': round(percentile(ms, 0.50), 3) if count else None,
+            'p95_ms': round(percentile(ms, 0.95), 3) if count else None,
+            'p99_ms': round(percentile(ms, 0.99), 3) if count else None,
+            'max_ms': round(ms[-1], 3) if count else None,
+            'throughput_rps': (round(count / elapsed, 1)
+                               if elapsed > 0 else None),
+            'queries_per_request': (round(float(queries) / count, 2)
+                                    if count else None)}
+
+
+def run_phase(app, route, paths, clients=1):
+    metrics.reset()
+
+    latencies, errors, elapsed = time_requests(app, paths, clients)
+
+    return summarize(latencies, errors, elapsed, metrics.queries[route])
+
+
+def run_cold(app, route, paths):
+    '''
+        Times the first request to each of the paths, emptying the
+        caches before each one.
+    '''
+    latencies, errors, queries = [], 0, 0
+
+    for p in paths:
+        reset_caches()
+        metrics.reset()
+
+        elapsed, ok = request_path(app, p)
+
+        latencies.append(elapsed)
+        errors += 0 if ok else 1
+        queries += metrics.queries[route]
+
+    return summarize(latencies, errors, sum(latencies), queries)
+
+
+def run_prefork(app, paths, workers, clients=prefork_clients):
+    '''
+        Times the requests over HTTP to the prefork server with one
+        worker, and with the given number of workers.  The scaling is
+        the ratio of their throughputs.
+    '''
+    results = {}
+
+    for w in sorted(set([1, workers])):
+        process, url = start_prefork(app, w)
+
+        try:
+            # let every worker fill its caches first
+            time_requests(url, paths, clients, request_url)
+
+            latencies, errors, elapsed = time_requests(url, paths, clients,
+                                                       request_url)
+        finally:
+            stop_prefork(process)
+
+        results[str(w)] = summarize(latencies, errors, elapsed, 0)
+
+    rps = [results[str(w)]['throughput_rps'] for w in (1, workers)]
+
+    return {'workers': results,
+            'clients': clients,
+            'scaling': round(rps[1] / rps[0], 2) if rps[0] else None}
+
+
+def sample_oil_ids(app, count):
+    response = Request.blank('/oil').get_response(app)
+
+    return [r['adios_oil_id'] for r in json.loads(response.body)[:count]]
+
+
+def run_benchmark(app, requests=200, clients=8, cold_runs=3,
+                  detail_oils=50, prefork_workers=0):
+    '''
+        Runs the benchmark against the app, and returns the results.
+    '''
+    oil_ids = sample_oil_ids(app, detail_oils)
+    results = {}
+
+    for name, route, path in endpoints:
+        if '{}' in path:
+            paths = [path.format(i) for i in oil_ids]
+            cold_paths = paths[:cold_runs]
+        else:
+            paths = [path]
+            cold_paths = paths * cold_runs
+
+        repeated = (paths * (requests // len(paths) + 1))[:requests]
+
+        res = {'cold': run_cold(app, route, cold_paths)}
+
+        # fill the caches before the warm runs
+        time_requests(app, paths)
+
+        res['warm'] = run_phase(app, route, repeated)
+        res['concurrent'] = run_phase(app, route, repeated, clients)
+        res['concurrent']['clients'] = clients
+
+        results[name] = res
+
+    res = {'endpoints': results,
+           'oils_sampled': len(oil_ids),
+           'peak_memory_mb': peak_memory_mb()}
+
+    if prefork_workers:
+        paths = ['/oil/{}'.format(i) for i in oil_ids]
+        repeated = (paths * (requests // len(paths) + 1))[:requests]
+
+        res['prefork'] = run_prefork(app, repeated, prefork_workers)
+
+    return res
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    '''
+        Returns a list of the measurements that regressed past the
+        baseline by more than the tolerance (a fraction of the baseline
+        value).  Peak memory is held to the same tolerance.
+    '''
+    regressions = []
+
+    def check(label, value, base, higher_is_better, tol):
+        if value is None or base is None:
+            return
+
+        if higher_is_better:
+            regressed = value < base * (1.0 - tol)
+        else:
+            regressed = value > base * (1.0 + tol)
+
+        if regressed:
+            regressions.append({'measurement': label,
+                                'baseline': base,
+                                'value': value})
+
+    for name, res in results['endpoints'].items():
+        base_res = baseline.get('endpoints', {}).get(name)
+        if base_res is None:
+            continue
+
+        for phase, key, higher_is_better, tol in checks:
+            check('{} {} {}'.format(name, phase, key),
+                  res[phase][key], base_res.get(phase, {}).get(key),
+                  higher_is_better, tolerance if tol is None else tol)
+
+    check('peak_memory_mb', results['peak_memory_mb'],
+          baseline.get('peak_memory_mb'), False, tolerance)
+
+    check('prefork scaling', results.get('prefork', {}).get('scaling'),
+          baseline.get('prefork', {}).get('scaling'), True, tolerance)
+
+    return regressions
+
+
+def benchmark(settings):
+    oillib_file = settings.get('oillib', default_oillib)
+    db_file = settings.get('db_file', 'oil_library_benchmark.db')
+
+    build_library(oillib_file, db_file)
+    use_library(settings, db_file)
+
+    settings['warmup.enabled'] = 'false'
+
+    start = time.time()
+    app = make_app(None, **settings)
+    startup_seconds = time.time() - start
+
+    results = run_benchmark(app,
+                            requests=int(settings.get('requests', 200)),
+                            clients=int(settings.get('clients', 8)),
+                            cold_runs=int(settings.get('cold_runs', 3)),
+                            detail_oils=int(settings.get('detail_oils', 50)),
+                            prefork_workers=int(settings.get('prefork_workers',
+                                                             0)))
+
+    results.update({'startup_seconds': round(startup_seconds, 3),
+                    'db_file': os.path.abspath(db_file),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')})
+
+    baseline_file = settings.get('baseline')
+    tolerance = float(settings.get('tolerance', 0.25))
+    regressions = []
+
+    if baseline_file and asbool(settings.get('update_baseline', False)):
+        write_json(results, baseline_file)
+    elif baseline_file and os.path.exists(baseline_file):
+        with open(baseline_file) as fd:
+            regressions = compare_to_baseline(results, json.load(fd),
+                                              tolerance)
+
+    results['regressions'] = regressions
+
+    write_json(results, settings.get('output'))
+
+    for r in regressions:
+        sys.stderr.write('REGRESSION: {measurement}: {value} '
+                         '(baseline {baseline})\n'.format(**r))
+
+    return 1 if regressions else 0
+
+
+def write_json(results, filename=None):
+    text = json.dumps(results, indent=2, sort_keys=True)
+
+    if filename:
+        with open(filename, 'w') as fd:
+            fd.write(text + '\n')
+    else:
+        print text
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri,
+                               name='oil_library_api',
+                               options=options)
+    settings.update(options)
+
+    sys.exit(benchmark(settings))
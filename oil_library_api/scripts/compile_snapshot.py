@@ -0,0 +1,94 @@
+"""
+Compiles the oil library into a binary snapshot that the API can start
+from (see the snapshot.file setting).
+"""
+import os
+import sys
+import time
+import transaction
+
+from pyramid.paster import (get_appsettings,
+                            setup_logging)
+
+from pyramid.scripts.common import parse_vars
+
+from oil_library_api import load_db_engine
+from oil_library_api.common.db import (get_session, get_db_fingerprint,
+                                       get_db_file, file_digest)
+from oil_library_api.common.categories import get_category_tree
+from oil_library_api.common.viscosity import get_kvis_table
+from oil_library_api.common.library_snapshot import (pack_library,
+                                                     write_library_snapshot)
+from oil_library_api.views.oil import build_oil_list
+from oil_library_api.views.distinct import distinct_snapshot
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: {0} <config_uri> output=<snapshot file> [var=value]\n'
+          '(example: "{0} development.ini output=oil_library.snapshot")'
+          .format(cmd))
+    sys.exit(1)
+
+
+def compile_library_snapshot(session, filename):
+    tree = get_category_tree(session)
+
+    categories = [(c_id, tree.parents[c_id], tree.names[c_id])
+                  for c_id in tree.children]
+    oil_categories = [(a, c_id) for a, c_ids in tree.oil_categories.items()
+                      for c_id in c_ids]
+
+    db_file = get_db_file(session)
+
+    arrays, meta = pack_library(
+        build_oil_list(session), categories, oil_categories,
+        get_kvis_table(session),
+        payloads={'distinct': distinct_snapshot.get(session).content},
+        fingerprint=get_db_fingerprint(session),
+        db_digest=(file_digest(db_file)
+                   if db_file and os.path.exists(db_file) else None)
+    )
+
+    write_library_snapshot(filename, arrays, meta)
+
+    return meta
+
+
+def compile_snapshot(settings):
+    if 'output' not in settings:
+        raise ValueError('output setting is required.')
+
+    load_db_engine(settings, 'memory_db.')
+
+    with transaction.manager:
+        session = get_session()
+
+        sys.stderr.write('Compiling the oil library snapshot...\n')
+        start = time.time()
+
+        meta = compile_library_snapshot(session, settings['output'])
+
+        print ('wrote {} oils to {} in {:.2f}s'
+               .format(meta['num_oils'], settings['output'],
+                       time.time() - start))
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri,
+                               name='oil_library_api',
+                               options=options)
+    settings.update(options)
+
+    try:
+        compile_snapshot(settings)
+    except:
+        print "{0} FAILED\n".format(compile_snapshot)
+        raise
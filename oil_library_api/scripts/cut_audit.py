@@ -0,0 +1,159 @@
+"""
+Statistics of the distillation cuts of the oils.
+
+The cuts table is loaded with a single query into NumPy columns, and
+each cut is numbered by its position among the cuts of its oil.  The
+statistics of each cut index are then computed over the columns with
+vectorized grouping, rather than by walking the cuts of every oil.
+"""
+import numpy as np
+
+from oil_library.models import Oil, Cut
+
+cut_fields = ('liquid_temp_k', 'vapor_temp_k', 'fraction')
+
+percentiles = (5, 25, 50, 75, 95)
+
+
+def load_cuts(session):
+    '''
+        Returns the number of cuts of each oil, and a dict of the oil
+        index, cut index and field columns of all the cuts.
+    '''
+    oil_ids = np.array([i for i, in session.query(Oil.id).order_by(Oil.id)],
+                       dtype=np.int64)
+
+    rows = (session.query(Cut.oil_id, Cut.liquid_temp_k, Cut.vapor_temp_k,
+                          Cut.fraction)
+            .join(Oil, Cut.oil_id == Oil.id)
+            .order_by(Cut.oil_id, Cut.id)
+            .all())
+
+    columns = np.array(rows, dtype=np.float64).reshape((len(rows), 4))
+
+    oil_idx = np.searchsorted(oil_ids, columns[:, 0].astype(np.int64))
+    starts = np.searchsorted(oil_idx, np.arange(len(oil_ids)))
+
+    cuts = {'oil_idx': oil_idx,
+            'cut_idx': np.arange(len(oil_idx)) - starts[oil_idx]}
+    for i, f in enumerate(cut_fields, 1):
+        cuts[f] = columns[:, i]
+
+    num_cuts = np.bincount(oil_idx, minlength=len(oil_ids))
+
+    return num_cuts, cuts
+
+
+def round_list(values, decimals=6):
+    return [None if np.isnan(v) else round(v, decimals)
+            for v in np.asarray(values, dtype=np.float64).tolist()]
+
+
+def grouped_percentiles(sorted_values, counts, q):
+    '''
+        The q percentiles of each run of the sorted values, given the
+        length of each run, interpolated linearly between the closest
+        ranks like np.percentile().  Empty runs get NaN.
+    '''
+    pcts = np.full((len(counts), len(q)), np.nan)
+    counted = counts > 0
+
+    if not counted.any():
+        return pcts
+
+    n = counts[counted][:, np.newaxis]
+    starts = (np.cumsum(counts) - counts)[counted][:, np.newaxis]
+
+    rank = (n - 1) * (np.asarray(q, dtype=np.float64) / 100.0)
+    lower = np.floor(rank).astype(np.int64)
+    upper = np.minimum(lower + 1, n - 1)
+
+    below = sorted_values[starts + lower]
+    above = sorted_values[starts + upper]
+
+    pcts[counted] = below + (above - below) * (rank - lower)
+
+    return pcts
+
+
+def field_stats(cut_idx, values, num_indexes, bins=10):
+    '''
+        The count, min, max, mean, percentiles and histogram of the
+        values at each cut index.  Missing (NaN) values are left out.
+    '''
+    valid = ~np.isnan(values)
+    cut_idx, values = cut_idx[valid], values[valid]
+
+    counts = np.bincount(cut_idx, minlength=num_indexes)
+    sums = np.bincount(cut_idx, weights=values,
+                       minlength=num_indexes).astype(np.float64)
+
+    mins = np.full(num_indexes, np.nan)
+    maxs = np.full(num_indexes, np.nan)
+    np.fmin.at(mins, cut_idx, values)
+    np.fmax.at(maxs, cut_idx, values)
+
+    # without values, bincount() gives integers, and the mean is None
+    means = np.full(num_indexes, np.nan)
+    counted = counts > 0
+    means[counted] = sums[counted] / counts[counted].astype(np.float64)
+
+    # sort by index, then value, so each index's values are a sorted run
+    order = np.lexsort((values, cut_idx))
+    pcts = grouped_percentiles(values[order], counts, percentiles)
+
+    if len(values):
+        low, high = values.min(), values.max()
+    else:
+        low, high = 0.0, 1.0
+
+    # widen a single value into a bin range, like np.histogram() does
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+
+    edges = np.linspace(low, high, bins + 1)
+
+    if num_indexes:
+        histograms, _i, _v = np.histogram2d(cut_idx, values,
+                                            bins=[np.arange(num_indexes + 1),
+                                                  edges])
+    else:
+        histograms = np.zeros((0, bins))
+
+    by_cut_index = []
+
+    for i in range(num_indexes):
+        by_cut_index.append({'cut_index': i,
+                             'count': int(counts[i]),
+                             'min': round_list([mins[i]])[0],
+                             'max': round_list([maxs[i]])[0],
+                             'mean': round_list([means[i]])[0],
+                             'percentiles': round_list(pcts[i]),
+                             'histogram': histograms[i].astype(int).tolist()})
+
+    return {'bin_edges': round_list(edges),
+            'by_cut_index': by_cut_index}
+
+
+def cut_statistics(session, bins=10):
+    '''
+        Returns the report of the statistics of the distillation cuts.
+    '''
+    num_cuts, cuts = load_cuts(session)
+    num_indexes = int(num_cuts.max()) if len(num_cuts) else 0
+
+    if len(num_cuts):
+        cuts_per_oil = {'min': int(num_cuts.min()),
+                        'max': int(num_cuts.max()),
+                        'mean': round(float(num_cuts.mean()), 6),
+                        'histogram': np.bincount(num_cuts).tolist()}
+    else:
+        cuts_per_oil = None
+
+    return {'oils': len(num_cuts),
+            'cuts': len(cuts['cut_idx']),
+            'cuts_per_oil': cuts_per_oil,
+            'percentiles': list(percentiles),
+            'fields': dict([(f, field_stats(cuts['cut_idx'], cuts[f],
+                                            num_indexes, bins))
+                            for f in cut_fields])}
@@ -0,0 +1,272 @@
+"""
+Bulk export of the oil library.
+
+The oils are loaded in chunks, with all their relationships eagerly
+loaded, and each chunk is serialized by a pool of worker processes.  The
+parent process writes the serialized chunks, in order, to the output
+files as they come in:
+
+- oils.ndjson: the detail record of each oil, one per line, as returned
+               by /oil/{adios_oil_id}
+- <table>.csv: one file for the oils' own columns, and one for each of
+               their measurement tables (densities, kvis, cuts...), with
+               a row per measurement keyed by adios_oil_id.
+- oils.npz: the same tables as NumPy columns, named <table>.<column>
+
+The files are written to temporary names, and only renamed when the
+export has finished, so a failed run never leaves partial files behind.
+"""
+import os
+import csv
+import sys
+import time
+from collections import OrderedDict
+
+import ujson
+import numpy as np
+
+from sqlalchemy.orm import class_mapper
+
+from oil_library.models import Oil
+
+from oil_library_api.common.db import get_session
+from oil_library_api.common.detail import (oil_collections,
+                                           oil_detail_query,
+                                           oil_detail_json)
+from .workers import get_processes, chunked, worker_results
+
+export_formats = ('ndjson', 'csv', 'npz')
+
+# Keys that only link the database rows together.
+internal_columns = ('id', 'oil_id', 'imported_record_id', 'estimated_id')
+
+
+def export_tables():
+    '''
+        The columns of each exported table.  The oils table holds the
+        oils' own columns, and each measurement table is keyed by the
+        adios_oil_id of its oil.
+    '''
+    tables = OrderedDict()
+
+    tables['oils'] = [c.key for c in class_mapper(Oil).column_attrs
+                      if c.key not in internal_columns]
+
+    for attr in oil_collections:
+        mapper = class_mapper(Oil).relationships[attr].mapper
+
+        tables[attr] = ['adios_oil_id'] + [c.key for c in mapper.column_attrs
+                                           if c.key not in internal_columns]
+
+    return tables
+
+
+def table_rows(oil_json, tables):
+    '''
+        Flattens the detail JSON of an oil into a row of each table.
+    '''
+    rows = dict([(t, []) for t in tables])
+    adios_oil_id = oil_json['adios_oil_id']
+
+    rows['oils'].append([oil_json.get(c) for c in tables['oils']])
+
+    for attr in oil_collections:
+        for m in oil_json[attr]:
+            m = dict(m, adios_oil_id=adios_oil_id)
+            rows[attr].append([m.get(c) for c in tables[attr]])
+
+    return rows
+
+
+def export_chunk(oil_ids):
+    '''
+        Loads the oils with the given ids, and returns their NDJSON lines
+        and table rows.  This runs in the worker processes.
+    '''
+    session = get_session()
+    tables = export_tables()
+
+    oils = (oil_detail_query(session)
+            .filter(Oil.id.in_(oil_ids))
+            .order_by(Oil.id))
+
+    lines = []
+    rows = dict([(t, []) for t in tables])
+
+    for o in oils:
+        oil_json = oil_detail_json(o)
+
+        lines.append(ujson.dumps(oil_json))
+
+        for t, r in table_rows(oil_json, tables).items():
+            rows[t].extend(r)
+
+    session.close()
+
+    text = '\n'.join(lines) + '\n' if lines else ''
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+
+    return {'count': len(lines), 'ndjson': text, 'rows': rows}
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, float):
+        return repr(value)
+    else:
+        return value
+
+
+def column_array(values):
+    '''
+        A NumPy column of the values.  Numbers are stored as floats, with
+        NaN for missing values, and anything else as unicode strings, with
+        missing values as empty strings.
+    '''
+    if all([v is None or isinstance(v, (int, long, float))
+            for v in values]):
+        return np.array([np.nan if v is None else v for v in values],
+                        dtype=np.float64)
+    else:
+        return np.array([u'' if v is None else unicode(v) for v in values],
+                        dtype=np.unicode_)
+
+
+class ExportWriter(object):
+    '''
+        Writes the serialized chunks to the output files of each format.
+    '''
+    def __init__(self, output_dir, formats, tables):
+        unknown = set(formats) - set(export_formats)
+        if unknown:
+            raise ValueError('unknown export formats: {}'
+                             .format(', '.join(sorted(unknown))))
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        self.output_dir = output_dir
+        self.formats = formats
+        self.tables = tables
+
+        self.files = OrderedDict()
+        self.csv_writers = {}
+        self.columns = dict([(t, []) for t in tables])
+
+        if 'ndjson' in formats:
+            self.ndjson = self.open('oils.ndjson')
+
+        if 'csv' in formats:
+            for t, columns in tables.items():
+                self.csv_writers[t] = csv.writer(self.open(t + '.csv'))
+                self.csv_writers[t].writerow(columns)
+
+    def path(self, filename):
+        return os.path.join(self.output_dir, filename)
+
+    def open(self, filename):
+        fd = open(self.path(filename) + '.tmp', 'wb')
+        self.files[filename] = fd
+
+        return fd
+
+    def write(self, chunk):
+        if 'ndjson' in self.formats:
+            self.ndjson.write(chunk['ndjson'])
+
+        for t, rows in chunk['rows'].items():
+            if 'csv' in self.formats:
+                self.csv_writers[t].writerows([[csv_value(v) for v in r]
+                                               for r in rows])
+            if 'npz' in self.formats:
+                self.columns[t].extend(rows)
+
+    def write_npz(self):
+        arrays = {}
+
+        for t, columns in self.tables.items():
+            rows = self.columns[t]
+
+            for i, c in enumerate(columns):
+                arrays['{}.{}'.format(t, c)] = column_array([r[i]
+                                                             for r in rows])
+
+        np.savez_compressed(self.open('oils.npz'), **arrays)
+
+    def close(self):
+        '''
+            Finishes the files, and moves them into place.  Returns their
+            paths.
+        '''
+        if 'npz' in self.formats:
+            self.write_npz()
+
+        paths = []
+
+        for filename, fd in self.files.items():
+            fd.close()
+            os.rename(self.path(filename) + '.tmp', self.path(filename))
+            paths.append(self.path(filename))
+
+        return paths
+
+    def abort(self):
+        for filename, fd in self.files.items():
+            fd.close()
+            os.remove(self.path(filename) + '.tmp')
+
+
+def report_progress(done, total, start):
+    elapsed = time.time() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+
+    sys.stderr.write('exported {}/{} oils ({:.0f}%) in {:.1f}s, '
+                     '{:.0f} oils/s\n'
+                     .format(done, total,
+                             100.0 * done / total if total else 100.0,
+                             elapsed, rate))
+
+
+def export_library(settings):
+    '''
+        Exports the oil library to the files of the given formats.
+
+        settings:
+        - output_dir: where the files are written.
+        - formats: space separated formats.  Defaults to all of them.
+        - chunk_size: the number of oils loaded and serialized at a time.
+        - processes: see workers.py.
+    '''
+    output_dir = settings.get('output_dir', 'oil_library_export')
+    formats = settings.get('formats', ' '.join(export_formats)).split()
+    chunk_size = int(settings.get('chunk_size', 100))
+    processes = get_processes(settings)
+
+    tables = export_tables()
+    writer = ExportWriter(output_dir, formats, tables)
+
+    session = get_session()
+    oil_ids = [i for i, in session.query(Oil.id).order_by(Oil.id)]
+    session.close()
+
+    total = len(oil_ids)
+    start = time.time()
+    done = 0
+
+    try:
+        with worker_results(export_chunk, chunked(oil_ids, chunk_size),
+                            processes) as results:
+            for chunk in results:
+                writer.write(chunk)
+
+                done += chunk['count']
+                report_progress(done, total, start)
+    except:
+        writer.abort()
+        raise
+
+    return writer.close()
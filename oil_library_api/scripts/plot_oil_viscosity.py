@@ -1,103 +1,101 @@
 #!/usr/bin/env python
+"""
+Renders the viscosity charts of oils into an output directory.
 
+The unweathered kinematic viscosities of the oils are loaded with a
+single query, and the charts are rendered headless (with the Agg
+backend) by a pool of worker processes.
+"""
 import sys
 import os
+import time
 import transaction
 
-import numpy as np
-
-from matplotlib import pyplot as plt
-
-from sqlalchemy.orm.exc import NoResultFound
-
 from pyramid.paster import (get_appsettings,
                             setup_logging)
 
 from pyramid.scripts.common import parse_vars
 
-from oil_library import _get_db_session
-from oil_library.models import Oil, ImportedRecord
-from oil_library.oil_props import OilProps
+from oil_library_api.common.db import get_session
+from oil_library_api.common.plots import (plot_formats, unweathered_kvis,
+                                          render_viscosity_plot)
+from oil_library_api.scripts.workers import get_processes, worker_results
 
 
 def usage(argv):
     cmd = os.path.basename(argv[0])
-    print('usage: {0} <config_uri> <adios oil id>\n'
-          '(example: "{0} development.ini adios_id=AD00047")'.format(cmd))
+    print('usage: {0} <config_uri> [var=value]\n'
+          '(example: "{0} development.ini adios_ids=AD00047,AD00009 '
+          'output_dir=plots")'.format(cmd))
     sys.exit(1)
 
 
+def plot_one(args):
+    '''
+        Renders the chart of one oil to a file, and returns its path.
+        This runs in the worker processes.
+    '''
+    output_dir, fmt, adios_oil_id, (name, temps_k, kvis) = args
+
+    path = os.path.join(output_dir,
+                        '{}.viscosity.{}'.format(adios_oil_id, fmt))
+
+    with open(path, 'wb') as fd:
+        fd.write(render_viscosity_plot(adios_oil_id, name, temps_k, kvis,
+                                       fmt))
+
+    return path
+
+
 def plot_oil_viscosities(settings):
+    '''
+        settings:
+        - adios_ids: comma separated ids of the oils to plot.  Defaults
+                     to all of the oils.  adios_id is also accepted.
+        - output_dir: where the charts are written.
+        - format: png or svg.
+        - processes: see workers.py.
+    '''
+    output_dir = settings.get('output_dir', 'viscosity_plots')
+    fmt = settings.get('format', 'png')
+    processes = get_processes(settings)
+
+    if fmt not in plot_formats:
+        raise ValueError('format must be one of: {}'
+                         .format(', '.join(sorted(plot_formats))))
+
+    adios_ids = settings.get('adios_ids', settings.get('adios_id'))
+    if adios_ids:
+        adios_ids = [a.strip() for a in adios_ids.split(',') if a.strip()]
+
     with transaction.manager:
-        # -- Our loading routine --
-        session = _get_db_session()
-
-        if 'adios_id' not in settings:
-            raise ValueError('adios_id setting is required.')
-        adios_id = settings['adios_id']
-
-        print 'our session: %s' % (session)
-        try:
-            oilobj = (session.query(Oil).join(ImportedRecord)
-                      .filter(ImportedRecord.adios_oil_id == adios_id)
-                      .one())
-        except NoResultFound:
-            raise NoResultFound('No Oil was found matching adios_id {0}'
-                                .format(adios_id))
-
-        if oilobj:
-            print 'Our oil object: %s' % (oilobj)
-
-            oil_props = OilProps(oilobj)
-            print '\nOilProps:', oil_props
-            print oil_props.kvis_at_temp()
-
-            print '\nOur viscosities:'
-            print [v for v in oilobj.kvis]
-
-            print '\nOur unweathered viscosities (m^2/s, Kdegrees):'
-            vis = [v for v in oilobj.kvis if v.weathering <= 0.0]
-            print vis
-            for i in [(v.m_2_s, v.ref_temp_k, v.weathering)
-                      for v in vis]:
-                print i
-
-            x = np.array([v.ref_temp_k for v in vis]) - 273.15
-            y = np.array([v.m_2_s for v in vis])
-            xmin = x.min()
-            xmax = x.max()
-            xpadding = .5 if xmax == xmin else (xmax - xmin) * .3
-            ymin = y.min()
-            ymax = y.max()
-            ypadding = (ymax / 2) if ymax == ymin else (ymax - ymin) * .3
-            plt.plot(x, y, 'ro')
-            plt.xlabel(r'Temperature ($^\circ$C)')
-            plt.ylabel('Unweathered Kinematic Viscosity (m$^2$/s)')
-            plt.yscale('log', subsy=[2, 3, 4, 5, 6, 7, 8, 9])
-            plt.grid(True)
-            plt.axis([xmin - xpadding, xmax + xpadding, 0, ymax + ypadding])
-
-            # now we add the annotations
-            for xx, yy in np.vstack((x, y)).transpose():
-                print (xx, yy)
-                if xx > x.mean():
-                    xalign = -xpadding / 3
-                else:
-                    xalign = xpadding / 3
-                yalign = ypadding / 3
-
-                plt.annotate('(%s$^\circ$C, %s m$^2$/s)' % (xx, yy),
-                             xy=(xx + (xalign / 10),
-                                 yy + (yalign / 10)),
-                             xytext=(xx + xalign, yy + yalign),
-                             arrowprops=dict(facecolor='black',
-                                             shrink=0.01),
-                             fontsize=9)
-            plt.show()
+        session = get_session()
+        data = unweathered_kvis(session, adios_ids or None)
+
+    if adios_ids:
+        missing = [a for a in adios_ids if a not in data]
+        if missing:
+            raise ValueError('No Oil was found matching adios_id {0}'
+                             .format(', '.join(missing)))
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    work = [(output_dir, fmt, a, d) for a, d in data.items()]
+    start = time.time()
+
+    with worker_results(plot_one, work, processes if len(work) > 1 else 1,
+                        ordered=False, chunksize=8) as paths:
+        for i, path in enumerate(paths, 1):
+            sys.stderr.write('plotted {}/{}: {}\n'
+                             .format(i, len(work), path))
+
+    print ('wrote {} charts to {} in {:.2f}s'
+           .format(len(work), output_dir, time.time() - start))
 
 
 def main(argv=sys.argv, proc=plot_oil_viscosities):
-    if len(argv) < 3:
+    if len(argv) < 2:
         usage(argv)
 
     config_uri = argv[1]
@@ -107,6 +105,7 @@ def main(argv=sys.argv, proc=plot_oil_viscosities):
     settings = get_appsettings(config_uri,
                                name='oil_library_api',
                                options=options)
+    settings.update(options)
 
     try:
         proc(settings)
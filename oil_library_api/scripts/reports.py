@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 import transaction
 
 from sqlalchemy import engine_from_config
@@ -9,10 +10,12 @@ from pyramid.paster import (get_appsettings,
 
 from pyramid.scripts.common import parse_vars
 
-from oil_library import _get_db_session
-from oil_library.models import (Base,
-                                ImportedRecord,
-                                Oil)
+from oil_library.models import Base
+
+from oil_library_api.common.db import get_session, use_engine
+from .export import export_library
+from .cut_audit import cut_statistics
+from .audit import run_audit
 
 
 def usage(argv):
@@ -24,154 +27,56 @@ def usage(argv):
 
 def initialize_sql(settings):
     engine = engine_from_config(settings, 'sqlalchemy.')
-    DBSession.configure(bind=engine)
+    use_engine(engine)
     Base.metadata.create_all(engine)
 
 
 def audit_distillation_cuts(settings):
     '''
-       Just a quick check of the data values that we loaded
-       when we initialized the database.
+       Statistics of the distillation cuts of the oils, by cut index.
+       The report is written as JSON to the output file, or printed.
+       See cut_audit.cut_statistics() for its contents.
     '''
     with transaction.manager:
-        session = _get_db_session()
-
-        sys.stderr.write('Auditing the records in database...')
-        num_cuts = []
-        liquid_temp = []
-        vapor_temp = []
-        fraction = []
-        for o in session.query(Oil):
-            num_cuts.append(len(o.cuts))
-            for i, cut in enumerate(o.cuts):
-                if len(liquid_temp) > i:
-                    if cut.liquid_temp_k:
-                        liquid_temp[i].append(cut.liquid_temp_k)
-                    if cut.vapor_temp_k:
-                        vapor_temp[i].append(cut.vapor_temp_k)
-                    if cut.fraction:
-                        fraction[i].append(cut.fraction)
-                else:
-                    liquid_temp.append([])
-                    vapor_temp.append([])
-                    fraction.append([])
-
-        print ('\nNumber of cut entries (min, max, avg): ({0}, {1}, {2})'
-               .format(min(num_cuts),
-                       max(num_cuts),
-                       float(sum(num_cuts)) / len(num_cuts))
-               )
-
-        print '\nLiquid Temperature:'
-        for i in range(len(liquid_temp)):
-            if len(liquid_temp[i]) > 0:
-                temp = liquid_temp[i]
-                avg = float(sum(temp)) / len(temp)
-                print ('\tCut #{0} (set-size, min, max, avg): '
-                       '({1}, {2}, {3}, {4})'
-                       .format(i, len(temp), min(temp), max(temp), avg))
-            else:
-                temp = liquid_temp[i]
-                print ('\tCut #{0} (set-size, min, max, avg): '
-                       '({1}, {2}, {3}, {4})'
-                       .format(i, len(temp), None, None, None))
-
-        print '\nVapor Temperature:'
-        for i in range(len(vapor_temp)):
-            print ('\tCut #{0} (set-size, min, max, avg): '
-                   '({1}, {2}, {3}, {4})'
-                   .format(i,
-                           len(vapor_temp[i]),
-                           min(vapor_temp[i]),
-                           max(vapor_temp[i]),
-                           float(sum(vapor_temp[i])) / len(vapor_temp[i]))
-                   )
-
-        print '\nFraction:'
-        for i in range(len(fraction)):
-            print ('\tCut #{0} (set-size, min, max, avg): '
-                   '({1}, {2}, {3}, {4})'
-                   .format(i,
-                           len(fraction[i]),
-                           min(fraction[i]),
-                           max(fraction[i]),
-                           float(sum(fraction[i])) / len(fraction[i]))
-                   )
-
-        print 'finished!!!'
+        session = get_session()
+
+        sys.stderr.write('Auditing the records in database...\n')
+        report = cut_statistics(session, bins=int(settings.get('bins', 10)))
+
+        text = json.dumps(report, indent=2, sort_keys=True)
+
+        if settings.get('output'):
+            with open(settings['output'], 'w') as fd:
+                fd.write(text + '\n')
+        else:
+            print text
+
+        sys.stderr.write('finished!!!\n')
 
 
 def audit_database(settings):
     '''
-       Just a quick check of the data values that we loaded
-       when we initialized the database.
+       Check the imported records against the data quality rules.
+       See audit.run_audit() for the settings.
     '''
     with transaction.manager:
-        session = _get_db_session()
-
-        sys.stderr.write('Auditing the records in database...')
-        for o in session.query(ImportedRecord):
-            if 1 and o.synonyms:
-                    print
-                    print [s.name for s in o.synonyms]
-
-            if 1 and o.densities:
-                    print
-                    print [d.kg_m_3 for d in o.densities]
-                    print [d.ref_temp_k for d in o.densities]
-                    print [d.weathering for d in o.densities]
-
-            if 1 and o.kvis:
-                    print
-                    print [k.m_2_s for k in o.kvis]
-                    print [k.ref_temp_k for k in o.kvis]
-                    print [k.weathering for k in o.kvis]
-
-            if 1 and o.dvis:
-                    print
-                    print [d.kg_ms for d in o.dvis]
-                    print [d.ref_temp_k for d in o.dvis]
-                    print [d.weathering for d in o.dvis]
-
-            if 1 and o.cuts:
-                    print
-                    print [c.vapor_temp_k for c in o.cuts]
-                    print [c.liquid_temp_k for c in o.cuts]
-                    print [c.fraction for c in o.cuts]
-
-            if 1:
-                tox = [t for t in o.toxicities if t.tox_type == 'EC']
-                if tox:
-                    print
-                    print [t.species for t in tox]
-                    print [t.after_24h for t in tox]
-                    print [t.after_48h for t in tox]
-                    print [t.after_96h for t in tox]
-
-            if 1:
-                tox = [t for t in o.toxicities if t.tox_type == 'LC']
-                if tox:
-                    print
-                    print [t.species for t in tox]
-                    print [t.after_24h for t in tox]
-                    print [t.after_48h for t in tox]
-                    print [t.after_96h for t in tox]
-
-        print 'finished!!!'
+        sys.stderr.write('Auditing the records in database...\n')
+
+        summary = run_audit(settings)
+
+        print json.dumps(summary, indent=2, sort_keys=True)
 
 
 def export_database(settings):
     '''
-       Just a quick check of the data values that we loaded
-       when we initialized the database.
+       Export the oil library to NDJSON, CSV and NPZ files.
+       See export.export_library() for the settings.
     '''
     with transaction.manager:
-        session = _get_db_session()
+        sys.stderr.write('Exporting the records in database...\n')
 
-        sys.stderr.write('Exporting the records in database...')
-        for o in session.query(Oil):
-            print o
-            print o.tojson()
+        for path in export_library(settings):
+            print 'wrote {}'.format(path)
 
 
 def export(argv=sys.argv):
@@ -197,6 +102,7 @@ def main(argv=sys.argv, proc=export_database):
     settings = get_appsettings(config_uri,
                                name='oil_library_api',
                                options=options)
+    settings.update(options)
 
     try:
         proc(settings)
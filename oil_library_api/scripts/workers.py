@@ -0,0 +1,48 @@
+"""
+Running the work of the batch scripts in a pool of worker processes.
+
+The scripts split their work into items (chunks of oils, shards of
+records, charts...) and map a function over them with worker_results().
+They all take the same processes setting: the number of worker
+processes, which defaults to the number of CPUs.  With 1, the items are
+processed in the script's own process.
+"""
+import multiprocessing
+from contextlib import contextmanager
+
+from oil_library_api.common.db import release_connections
+
+
+def get_processes(settings):
+    return int(settings.get('processes', 0) or multiprocessing.cpu_count())
+
+
+def chunked(values, chunk_size):
+    for i in range(0, len(values), chunk_size):
+        yield values[i:i + chunk_size]
+
+
+@contextmanager
+def worker_results(func, items, processes, ordered=True, chunksize=1):
+    '''
+        Yields the results of func over the items, computed by a pool of
+        worker processes (in the order of the items, unless ordered is
+        false).  The workers open their own database connections.  The
+        pool is terminated if the block raises.
+    '''
+    if processes <= 1:
+        yield (func(i) for i in items)
+        return
+
+    release_connections()
+    pool = multiprocessing.Pool(processes, initializer=release_connections)
+
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        yield imap(func, items, chunksize)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+        pool.join()
@@ -0,0 +1,149 @@
+"""
+Tests for the data quality audit
+"""
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from base import FunctionalTestBase
+
+from oil_library.models import ImportedRecord
+
+from oil_library_api.common.db import get_session
+from oil_library_api.scripts.audit import (AuditBatch, audit_rules,
+                                           audit_rule, match_rows,
+                                           run_audit)
+
+
+def make_batch(num_records, **tables):
+    columns = {'densities': ('kg_m_3', 'ref_temp_k', 'weathering'),
+               'kvis': ('m_2_s', 'ref_temp_k', 'weathering'),
+               'dvis': ('kg_ms', 'ref_temp_k', 'weathering'),
+               'cuts': ('vapor_temp_k', 'liquid_temp_k', 'fraction')}
+
+    records = {'id': np.arange(num_records),
+               'adios_oil_id': ['AD{:05d}'.format(i)
+                                for i in range(num_records)],
+               'oil_name': ['oil {}'.format(i) for i in range(num_records)],
+               'pour_point_min_k': np.full(num_records, 250.0),
+               'pour_point_max_k': np.full(num_records, 250.0)}
+
+    batch_tables = {}
+    for name, cols in columns.items():
+        rows = np.array(tables.get(name, []),
+                        dtype=np.float64).reshape((-1, len(cols) + 1))
+
+        batch_tables[name] = dict([(c, rows[:, i])
+                                   for i, c in enumerate(cols, 1)])
+        batch_tables[name]['rec'] = rows[:, 0].astype(np.int64)
+
+    return AuditBatch(records, batch_tables)
+
+
+class AuditRuleTests(TestCase):
+    def test_match_rows(self):
+        a = (np.array([0, 0, 1, 1]), np.array([280.0, 300.0, 280.0, 280.0]))
+        b = (np.array([1, 0, 2, 0]), np.array([280.0, 300.0, 280.0, np.nan]))
+
+        assert match_rows(a, b).tolist() == [2, 1, -1, -1]
+
+    def test_rules(self):
+        batch = make_batch(
+            4,
+            # oil 1's density goes up with temperature
+            densities=[(0, 900.0, 288.0, 0.0), (0, 890.0, 300.0, 0.0),
+                       (1, 900.0, 288.0, 0.0), (1, 910.0, 300.0, 0.0),
+                       (1, 800.0, 288.0, 0.1),
+                       (2, 900.0, 288.0, 0.0)],
+            # oil 2's viscosities imply a density of 2000
+            kvis=[(0, 1e-5, 288.0, 0.0), (2, 1e-5, 288.0, 0.0)],
+            dvis=[(0, 9e-3, 288.0, 0.0), (2, 2e-2, 288.0, 0.0)],
+            # oil 3's cumulative fractions go down, and past 1
+            cuts=[(0, 400.0, 380.0, 0.2), (0, 500.0, 480.0, 0.5),
+                  (3, 400.0, 380.0, 0.5), (3, 500.0, 480.0, 0.4),
+                  (3, 600.0, 580.0, 1.2)])
+
+        batch.records['pour_point_min_k'][0] = np.nan
+        batch.records['pour_point_max_k'][0] = np.nan
+
+        def violators(name):
+            return sorted(set(audit_rules[name][1](batch).tolist()))
+
+        assert violators('density_not_decreasing') == [1]
+        assert violators('viscosities_inconsistent') == [2]
+        assert violators('cut_fractions_invalid') == [3]
+        assert violators('missing_pour_point') == [0]
+
+
+class AuditTests(FunctionalTestBase):
+    def setUp(self):
+        super(AuditTests, self).setUp()
+        self.output_dir = tempfile.mkdtemp()
+
+        @audit_rule('odd_record_id', 'The record id is odd')
+        def odd_record_id(batch):
+            return np.nonzero(batch.records['id'] % 2)[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+        audit_rules.pop('odd_record_id', None)
+
+    def audit(self, processes):
+        '''
+            Runs the audit into its own directory, and returns the
+            summary (without its timing) and the violations.
+        '''
+        output_dir = os.path.join(self.output_dir, str(processes))
+
+        summary = run_audit({'output_dir': output_dir,
+                             'processes': processes, 'shard_size': 64})
+        del summary['seconds']
+
+        with open(os.path.join(output_dir, 'violations.ndjson')) as fd:
+            violations = [json.loads(l) for l in fd]
+
+        with open(os.path.join(output_dir, 'summary.json')) as fd:
+            assert json.load(fd)['records'] == summary['records']
+
+        return summary, violations
+
+    def test_run_audit(self):
+        summary, violations = self.audit(processes=1)
+
+        session = get_session()
+        records = session.query(ImportedRecord).all()
+
+        assert summary['records'] == len(records)
+
+        missing = [r.adios_oil_id for r in records
+                   if r.pour_point_min_k is None and
+                   r.pour_point_max_k is None]
+        assert (summary['rules']['missing_pour_point']['records'] ==
+                len(missing))
+        assert (summary['rules']['odd_record_id']['records'] ==
+                len([r for r in records if r.id % 2]))
+
+        assert len(violations) == summary['records_with_violations']
+        flagged = [v['adios_oil_id'] for v in violations
+                   if 'missing_pour_point' in [r['rule']
+                                               for r in v['violations']]]
+        assert sorted(flagged) == sorted(missing)
+
+    def test_run_audit_in_shards(self):
+        '''
+            The shards audited by the worker processes are merged into
+            the same results as a serial run.
+        '''
+        serial_summary, serial_violations = self.audit(processes=1)
+        summary, violations = self.audit(processes=2)
+
+        assert summary == serial_summary
+        assert violations == serial_violations
+
+    def test_run_audit_unknown_rule(self):
+        with self.assertRaises(ValueError):
+            run_audit({'output_dir': self.output_dir, 'rules': 'bogus'})
@@ -0,0 +1,85 @@
+"""
+Tests for the benchmark script
+"""
+import os
+import copy
+import shutil
+import tempfile
+
+from base import FunctionalTestBase
+
+import oil_library
+
+from oil_library_api import main
+from oil_library_api.common.db import get_session, get_db_file, use_engine
+from oil_library_api.scripts.benchmark import (run_benchmark,
+                                               compare_to_baseline,
+                                               use_library)
+
+
+class BenchmarkTests(FunctionalTestBase):
+    def test_run_benchmark(self):
+        results = run_benchmark(self.testapp.app, requests=10, clients=2,
+                                cold_runs=1, detail_oils=3)
+
+        assert set(results['endpoints'].keys()) == set(['oil list',
+                                                        'oil detail',
+                                                        'distinct'])
+
+        for res in results['endpoints'].values():
+            assert res['cold']['requests'] == 1
+            assert res['warm']['requests'] == 10
+            assert res['concurrent']['requests'] == 10
+
+            for phase in ('cold', 'warm', 'concurrent'):
+                assert res[phase]['errors'] == 0
+
+            # the warm requests are served from the caches
+            assert res['warm']['queries_per_request'] <= 1.0
+            assert res['cold']['queries_per_request'] >= 1.0
+
+        assert results['peak_memory_mb'] > 0
+
+        assert compare_to_baseline(results, results) == []
+
+        slower = copy.deepcopy(results)
+        slower['endpoints']['distinct']['warm']['p50_ms'] *= 10.0
+        slower['endpoints']['oil detail']['warm']['queries_per_request'] += 1
+
+        regressions = [r['measurement']
+                       for r in compare_to_baseline(slower, results)]
+
+        assert sorted(regressions) == ['distinct warm p50_ms',
+                                       'oil detail warm queries_per_request']
+
+    def test_prefork_scaling(self):
+        baseline = {'endpoints': {}, 'peak_memory_mb': 100.0,
+                    'prefork': {'scaling': 3.0}}
+        results = copy.deepcopy(baseline)
+
+        assert compare_to_baseline(results, baseline) == []
+
+        results['prefork']['scaling'] = 1.5
+        regressions = [r['measurement']
+                       for r in compare_to_baseline(results, baseline)]
+
+        assert regressions == ['prefork scaling']
+
+    def test_use_library(self):
+        tmp_dir = tempfile.mkdtemp()
+        db_file = os.path.join(tmp_dir, 'benchmark.db')
+        shutil.copy(oil_library._db_file, db_file)
+
+        try:
+            for memory_db in ('false', 'true'):
+                settings = self.get_settings()
+                settings['warmup.enabled'] = 'false'
+                settings['memory_db.enabled'] = memory_db
+                use_library(settings, db_file)
+
+                main(None, **settings)
+
+                assert get_db_file(get_session()) == db_file
+        finally:
+            use_engine(None)
+            shutil.rmtree(tmp_dir)
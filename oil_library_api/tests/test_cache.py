@@ -0,0 +1,45 @@
+"""
+Unit tests for the per-oil caches
+"""
+from unittest import TestCase
+
+from oil_library_api.common.cache import LRUCache
+
+
+class LRUCacheTests(TestCase):
+    def test_hit_and_miss(self):
+        cache = LRUCache('test', max_size=2)
+
+        assert cache.lookup('a', 'fp1') == (False, None)
+        assert cache.get_or_compute('a', 'fp1', lambda: 1) == 1
+        assert cache.get_or_compute('a', 'fp1', lambda: 2) == 1
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache('test', max_size=2)
+
+        cache.store('a', 'fp1', 1)
+        cache.store('b', 'fp1', 2)
+        cache.lookup('a', 'fp1')
+        cache.store('c', 'fp1', 3)
+
+        assert len(cache) == 2
+        assert cache.lookup('a', 'fp1') == (True, 1)
+        assert cache.lookup('b', 'fp1') == (False, None)
+        assert cache.stats()['evictions'] == 1
+
+    def test_ttl(self):
+        cache = LRUCache('test', ttl=-1)
+
+        cache.store('a', 'fp1', 1)
+        assert cache.lookup('a', 'fp1') == (False, None)
+
+    def test_invalidated_by_fingerprint(self):
+        cache = LRUCache('test')
+
+        cache.store('a', 'fp1', 1)
+        assert cache.lookup('a', 'fp2') == (False, None)
+        assert cache.stats()['invalidations'] == 1
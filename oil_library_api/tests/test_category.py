@@ -0,0 +1,22 @@
+"""
+Functional tests for the Category Web API
+"""
+from base import FunctionalTestBase
+
+
+class CategoryTests(FunctionalTestBase):
+    def test_get_category_oils(self):
+        crude = self.testapp.get('/category/Crude/oils').json_body
+        medium = self.testapp.get('/category/Crude-Medium/oils').json_body
+
+        assert len(crude) > 0
+        assert len(crude) >= len(medium)
+
+        for o in crude:
+            assert any([c.startswith('Crude-') for c in o['categories']])
+
+        for o in medium:
+            assert 'Crude-Medium' in o['categories']
+
+    def test_get_category_oils_invalid_path(self):
+        self.testapp.get('/category/bogus/oils', status=404)
@@ -0,0 +1,87 @@
+"""
+Tests for the distillation cut statistics
+"""
+import numpy as np
+
+from base import FunctionalTestBase
+
+from oil_library.models import Oil
+
+from oil_library_api.common.db import get_session
+from oil_library_api.scripts.cut_audit import (cut_fields, percentiles,
+                                               field_stats, cut_statistics,
+                                               grouped_percentiles)
+
+
+class CutAuditTests(FunctionalTestBase):
+    def test_cut_statistics(self):
+        session = get_session()
+        report = cut_statistics(session, bins=5)
+
+        # the same statistics, walking the cuts of each oil
+        oils = session.query(Oil).order_by(Oil.id).all()
+        num_cuts = [len(o.cuts) for o in oils]
+
+        assert report['oils'] == len(oils)
+        assert report['cuts'] == sum(num_cuts)
+        assert report['cuts_per_oil']['min'] == min(num_cuts)
+        assert report['cuts_per_oil']['max'] == max(num_cuts)
+
+        for f in cut_fields:
+            by_index = report['fields'][f]['by_cut_index']
+            assert len(by_index) == max(num_cuts)
+
+            for stats in by_index:
+                i = stats['cut_index']
+                values = [getattr(o.cuts[i], f) for o in oils
+                          if len(o.cuts) > i and
+                          getattr(o.cuts[i], f) is not None]
+
+                assert stats['count'] == len(values)
+                assert sum(stats['histogram']) == len(values)
+
+                if values:
+                    assert np.isclose(stats['min'], min(values))
+                    assert np.isclose(stats['max'], max(values))
+                    assert np.isclose(stats['mean'], np.mean(values))
+                    assert np.allclose(stats['percentiles'],
+                                       np.percentile(values, percentiles))
+
+    def test_field_stats_without_values(self):
+        stats = field_stats(np.array([0, 1], dtype=np.int64),
+                            np.array([np.nan, np.nan]), 2)
+
+        for s in stats['by_cut_index']:
+            assert s['count'] == 0
+            assert s['mean'] is None
+            assert s['min'] is None
+            assert s['max'] is None
+
+        # an empty library has no cut indexes
+        stats = field_stats(np.array([], dtype=np.int64), np.array([]), 0,
+                            bins=4)
+
+        assert stats['by_cut_index'] == []
+        assert len(stats['bin_edges']) == 5
+
+        # all the values are equal
+        stats = field_stats(np.array([0, 0, 1], dtype=np.int64),
+                            np.array([2.0, 2.0, 2.0]), 2, bins=4)
+
+        assert stats['bin_edges'][0] == 1.5
+        assert stats['bin_edges'][-1] == 2.5
+        assert [sum(s['histogram'])
+                for s in stats['by_cut_index']] == [2, 1]
+
+    def test_grouped_percentiles(self):
+        groups = [[1.0, 2.0, 4.0, 8.0], [], [3.0], [0.5, 7.0]]
+        counts = np.array([len(g) for g in groups], dtype=np.int64)
+        values = np.array(sum(groups, []))
+
+        pcts = grouped_percentiles(values, counts, percentiles)
+
+        for g, p in zip(groups, pcts):
+            if g:
+                assert np.allclose(p, np.percentile(g, percentiles))
+            else:
+                assert np.isnan(p).all()
@@ -0,0 +1,103 @@
+"""
+Functional tests for the app's database engine and sessions
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from base import FunctionalTestBase
+
+from sqlalchemy.pool import QueuePool
+
+import oil_library
+from oil_library.models import DBSession
+
+from oil_library_api.common.db import db_state, use_engine, get_session
+
+
+class DBEngineTests(FunctionalTestBase):
+    def get_settings(self):
+        settings = super(DBEngineTests, self).get_settings()
+        settings['sqlalchemy.pool_size'] = '3'
+        settings['sqlite.mmap_size'] = '1048576'
+        settings['sqlite.cache_size'] = '2048'
+
+        return settings
+
+    def tearDown(self):
+        use_engine(None)
+
+    def test_pooled_engine(self):
+        engine = db_state['engine']
+
+        assert engine is not None
+        assert get_session().get_bind() is engine
+        assert isinstance(engine.pool, QueuePool)
+        assert engine.pool.size() == 3
+
+    def test_pragmas(self):
+        session = get_session()
+
+        assert session.execute('PRAGMA query_only').scalar() == 1
+        assert session.execute('PRAGMA cache_size').scalar() == -2048
+
+        with self.assertRaises(Exception):
+            session.execute('DELETE FROM oils')
+
+    def test_session_removed(self):
+        self.testapp.get('/oil')
+
+        assert not DBSession.registry.has()
+        assert db_state['engine'].pool.checkedout() == 0
+
+
+class ReplacedDBTests(FunctionalTestBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'OilLib.db')
+        shutil.copy(oil_library._db_file, self.db_file)
+
+        super(ReplacedDBTests, self).setUp()
+
+    def get_settings(self):
+        settings = super(ReplacedDBTests, self).get_settings()
+        settings['sqlalchemy.url'] = 'sqlite:///' + self.db_file
+
+        return settings
+
+    def tearDown(self):
+        use_engine(None)
+        shutil.rmtree(self.tmp_dir)
+
+    def replace_db(self, name):
+        new_file = os.path.join(self.tmp_dir, 'new.db')
+        shutil.copy(self.db_file, new_file)
+
+        conn = sqlite3.connect(new_file)
+        conn.execute('UPDATE oils SET name = ? '
+                     'WHERE adios_oil_id = ?', (name, 'AD00009'))
+        conn.commit()
+        conn.close()
+
+        # make sure the fingerprint changes, whatever the clock
+        # resolution of the file system
+        stat = os.stat(self.db_file)
+        os.utime(new_file, (stat.st_atime, stat.st_mtime + 10))
+
+        os.rename(new_file, self.db_file)
+
+    def get_names(self):
+        detail = self.testapp.get('/oil/AD00009').json_body
+        listed = [o['name'] for o in self.testapp.get('/oil').json_body
+                  if o['adios_oil_id'] == 'AD00009']
+
+        return detail['name'], listed
+
+    def test_replaced_db(self):
+        old_name, listed = self.get_names()
+        assert listed == [old_name]
+
+        self.replace_db('REPLACED OIL')
+
+        assert self.get_names() == ('REPLACED OIL', ['REPLACED OIL'])
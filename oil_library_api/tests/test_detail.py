@@ -0,0 +1,123 @@
+"""
+Tests for building the detail JSON of oils
+"""
+from contextlib import contextmanager
+
+from base import GnomeTestCase
+
+from sqlalchemy import event
+
+from oil_library import _get_db_session
+from oil_library.models import Oil, ImportedRecord
+
+from oil_library_api.common.detail import load_oil_detail, load_oil_details
+
+
+def prune_oil_json(oil_json):
+    '''
+        What the detail of an oil used to be built with, from
+        oil.tojson(), which recursively includes a bunch of redundant
+        content that we don't want to return.
+    '''
+    for oil_attr_name in ('categories', 'cuts', 'densities', 'kvis',
+                          'sara_fractions', 'sara_densities',
+                          'molecular_weights'):
+        for oil_attr in oil_json[oil_attr_name]:
+            for attr_name in ('imported', 'oils', 'oil', 'oil_id'):
+                if attr_name in oil_attr:
+                    del oil_attr[attr_name]
+
+    del oil_json['imported']['oil']
+    del oil_json['estimated']['oil']
+
+    return oil_json
+
+
+@contextmanager
+def count_queries(session):
+    counts = [0]
+
+    def counter(*args, **kwargs):
+        counts[0] += 1
+
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', counter)
+
+    try:
+        yield counts
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
+
+
+class OilDetailTests(GnomeTestCase):
+    def setUp(self):
+        super(OilDetailTests, self).setUp()
+
+        self.session = _get_db_session()
+        self.adios_oil_ids = [a for a, in (self.session
+                                           .query(ImportedRecord.adios_oil_id)
+                                           .order_by(ImportedRecord.id))]
+
+    def tearDown(self):
+        self.session.close()
+
+    def legacy_detail(self, adios_oil_id):
+        oil = (self.session.query(Oil).join(ImportedRecord)
+               .filter(ImportedRecord.adios_oil_id == adios_oil_id).one())
+
+        return prune_oil_json(oil.tojson())
+
+    def test_matches_tojson(self):
+        covered = set()
+
+        for adios_oil_id in self.adios_oil_ids:
+            self.session.expunge_all()
+            expected = self.legacy_detail(adios_oil_id)
+
+            self.session.expunge_all()
+            assert load_oil_detail(self.session, adios_oil_id) == expected
+
+            covered.update([k for k, v in expected.items() if v])
+            covered.update(['imported.' + k
+                            for k, v in expected['imported'].items() if v])
+
+        # the fixture oils cover the categories, the imported record and
+        # all the measurement lists
+        for k in ('categories', 'cuts', 'densities', 'kvis',
+                  'sara_fractions', 'sara_densities', 'molecular_weights',
+                  'imported', 'estimated',
+                  'imported.synonyms', 'imported.densities',
+                  'imported.kvis', 'imported.dvis', 'imported.cuts',
+                  'imported.toxicities'):
+            assert k in covered, k
+
+    def test_query_count(self):
+        # eager loading: the same number of queries, however many
+        # related rows an oil has
+        counts = set()
+
+        for adios_oil_id in self.adios_oil_ids[:20]:
+            self.session.expunge_all()
+
+            with count_queries(self.session) as queries:
+                load_oil_detail(self.session, adios_oil_id)
+
+            counts.add(queries[0])
+
+        assert len(counts) == 1
+        eager = counts.pop()
+
+        # the lazy loads of tojson() take more
+        self.session.expunge_all()
+        with count_queries(self.session) as queries:
+            self.legacy_detail(self.adios_oil_ids[0])
+
+        assert queries[0] > eager
+
+        # and a batch of oils takes no more than one
+        self.session.expunge_all()
+        with count_queries(self.session) as queries:
+            details = load_oil_details(self.session, self.adios_oil_ids[:20])
+
+        assert len(details) == 20
+        assert queries[0] <= eager
@@ -0,0 +1,40 @@
+"""
+Functional tests for the Distinct Web API
+"""
+from base import FunctionalTestBase
+
+
+class DistinctTests(FunctionalTestBase):
+    def test_get_distinct(self):
+        resp = self.testapp.get('/distinct')
+        columns = dict([(r['column'], r['values']) for r in resp.json_body])
+
+        for k in ('location',
+                  'field_name',
+                  'product_type'):
+            assert k in columns
+
+        assert 'Crude' in columns['product_type']
+
+    def test_get_distinct_counts(self):
+        resp = self.testapp.get('/distinct')
+
+        for r in resp.json_body:
+            # every column has its counts keyed by value
+            assert isinstance(r['counts'], dict)
+
+            if r['column'] == 'product_type':
+                for root, children in r['values'].items():
+                    for c in children:
+                        path = '-'.join((root, c))
+                        assert r['counts'][root] >= r['counts'][path]
+            else:
+                keys = ['null' if v is None else v for v in r['values']]
+                assert sorted(r['counts'].keys()) == sorted(keys)
+
+    def test_get_distinct_not_modified(self):
+        resp = self.testapp.get('/distinct')
+        etag = resp.headers['ETag']
+
+        self.testapp.get('/distinct', headers={'If-None-Match': etag},
+                         status=304)
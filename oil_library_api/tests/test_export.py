@@ -0,0 +1,79 @@
+"""
+Tests for the bulk export of the oil library
+"""
+import os
+import csv
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+from base import FunctionalTestBase
+
+from oil_library_api.scripts.export import export_library, export_tables
+
+
+class ExportTests(FunctionalTestBase):
+    def setUp(self):
+        super(ExportTests, self).setUp()
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def export(self, **settings):
+        settings = dict(settings, output_dir=self.output_dir, chunk_size=7)
+
+        return export_library(settings)
+
+    def test_export(self):
+        paths = self.export(processes=1)
+        tables = export_tables()
+
+        assert sorted(os.path.basename(p) for p in paths) == sorted(
+            ['oils.ndjson', 'oils.npz'] + [t + '.csv' for t in tables])
+        assert not [f for f in os.listdir(self.output_dir)
+                    if f.endswith('.tmp')]
+
+        with open(os.path.join(self.output_dir, 'oils.ndjson')) as fd:
+            oils = [json.loads(l) for l in fd]
+
+        assert len(oils) == len(self.testapp.get('/oil').json_body)
+        assert oils[0] == self.testapp.get('/oil/{}'
+                                           .format(oils[0]['adios_oil_id'])
+                                           ).json_body
+
+        arrays = np.load(os.path.join(self.output_dir, 'oils.npz'))
+
+        for t, columns in tables.items():
+            with open(os.path.join(self.output_dir, t + '.csv')) as fd:
+                rows = list(csv.reader(fd))
+
+            assert rows[0] == columns
+
+            if t == 'oils':
+                assert len(rows) == len(oils) + 1
+            else:
+                assert len(rows) == sum([len(o[t]) for o in oils]) + 1
+
+            for c in columns:
+                assert len(arrays['{}.{}'.format(t, c)]) == len(rows) - 1
+
+        assert (list(arrays['oils.adios_oil_id']) ==
+                [o['adios_oil_id'] for o in oils])
+
+    def test_export_parallel(self):
+        self.export(processes=1, formats='ndjson')
+
+        with open(os.path.join(self.output_dir, 'oils.ndjson')) as fd:
+            serial = fd.read()
+
+        self.export(processes=2, formats='ndjson')
+
+        with open(os.path.join(self.output_dir, 'oils.ndjson')) as fd:
+            assert fd.read() == serial
+
+    def test_export_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self.export(formats='ndjson xls')
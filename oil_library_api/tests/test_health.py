@@ -0,0 +1,29 @@
+"""
+Functional tests for the Health Web API
+"""
+from base import FunctionalTestBase
+
+
+class ReadyTests(FunctionalTestBase):
+    def test_get_ready_without_warmup(self):
+        resp = self.testapp.get('/health/ready')
+
+        assert resp.json_body['status'] == 'ready'
+
+
+class WarmupReadyTests(FunctionalTestBase):
+    def get_settings(self):
+        settings = super(WarmupReadyTests, self).get_settings()
+        settings['warmup.enabled'] = 'true'
+        settings['warmup.details'] = 'true'
+
+        return settings
+
+    def test_get_ready_after_warmup(self):
+        resp = self.testapp.get('/health/ready')
+        res = resp.json_body
+
+        assert res['status'] == 'ready'
+        assert res['progress'] == 1.0
+        assert ([s['stage'] for s in res['completed']] == res['stages'])
+        assert 'oil details' in res['stages']
@@ -0,0 +1,154 @@
+"""
+Tests for the compiled library snapshot
+"""
+import os
+import shutil
+import sqlite3
+import logging
+import tempfile
+
+import numpy as np
+import transaction
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import webtest
+
+from base import FunctionalTestBase
+
+import oil_library
+
+from oil_library_api import main
+from oil_library_api.common.db import get_session
+from oil_library_api.common.viscosity import KVisTable
+from oil_library_api.common.library_snapshot import LibrarySnapshot
+from oil_library_api.scripts.compile_snapshot import compile_library_snapshot
+from oil_library_api.views.oil import build_oil_list, oil_list_snapshot
+from oil_library_api.warmup import seed_from_snapshot
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LibrarySnapshotTests(FunctionalTestBase):
+    def setUp(self):
+        super(LibrarySnapshotTests, self).setUp()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'oil_library.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        with transaction.manager:
+            session = get_session()
+
+            compile_library_snapshot(session, self.filename)
+            library = LibrarySnapshot(self.filename)
+
+            assert library.oil_list_records() == build_oil_list(session)
+
+            kvis = KVisTable.from_session(session)
+            expected = dict(zip(kvis.adios_oil_ids,
+                                kvis.kvis_at_temp(288.0)))
+
+            table = library.kvis_table()
+            for a, v in zip(table.adios_oil_ids, table.kvis_at_temp(288.0)):
+                assert np.isnan(v) == np.isnan(expected[a])
+                if not np.isnan(v):
+                    assert np.isclose(v, expected[a])
+
+            # the fitted constants are stored, not fitted again
+            assert np.array_equal(table.k_v2, kvis.k_v2)
+
+    def test_arrays_are_mapped(self):
+        with transaction.manager:
+            compile_library_snapshot(get_session(), self.filename)
+
+        library = LibrarySnapshot(self.filename)
+
+        for name in ('oil_api', 'kvis_table_m_2_s', 'kvis_table_k_v2'):
+            a = library[name]
+
+            # a read-only view of the mapping, not a copy of the file
+            assert not a.flags.owndata
+            assert not a.flags.writeable
+            assert a.ctypes.data % 8 == 0
+
+        assert library.kvis_table().m_2_s.base is not None
+
+    def test_start_from_snapshot(self):
+        with transaction.manager:
+            compile_library_snapshot(get_session(), self.filename)
+
+        oils = self.testapp.get('/oil').json_body
+
+        settings = self.get_settings()
+        settings['snapshot.file'] = self.filename
+        testapp = webtest.TestApp(main(None, **settings))
+
+        assert testapp.get('/oil').json_body == oils
+
+    def compile_from_copy(self, name=None):
+        '''
+            Compiles the snapshot from a copy of the database, with the
+            name of AD00009 changed if one is given.
+        '''
+        db_file = os.path.join(self.tmp_dir, 'OilLib.db')
+        shutil.copy(oil_library._db_file, db_file)
+
+        if name is not None:
+            conn = sqlite3.connect(db_file)
+            conn.execute('UPDATE oils SET name = ? WHERE adios_oil_id = ?',
+                         (name, 'AD00009'))
+            conn.commit()
+            conn.close()
+
+        engine = create_engine('sqlite:///' + db_file)
+        session = sessionmaker(bind=engine)()
+
+        try:
+            compile_library_snapshot(session, self.filename)
+        finally:
+            session.close()
+            engine.dispose()
+
+    def seed(self):
+        handler = ListHandler()
+        logger = logging.getLogger('oil_library_api.warmup')
+        logger.addHandler(handler)
+
+        try:
+            oil_list_snapshot.invalidate()
+            return seed_from_snapshot(self.filename), handler.records
+        finally:
+            logger.removeHandler(handler)
+
+    def test_snapshot_of_copy(self):
+        self.compile_from_copy()
+
+        seeded, records = self.seed()
+
+        assert seeded
+        assert not [r for r in records if r.levelno >= logging.WARNING]
+
+    def test_snapshot_of_other_db(self):
+        self.compile_from_copy('ANOTHER OIL')
+
+        seeded, records = self.seed()
+
+        assert not seeded
+        assert [r for r in records
+                if r.levelno == logging.WARNING and
+                self.filename in r.getMessage()]
+
+        oils = dict([(o['adios_oil_id'], o)
+                     for o in self.testapp.get('/oil').json_body])
+        assert oils['AD00009']['name'] != 'ANOTHER OIL'
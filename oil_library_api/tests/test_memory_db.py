@@ -0,0 +1,78 @@
+"""
+Functional tests for serving from the in-memory database
+"""
+import os
+import time
+import threading
+
+from base import FunctionalTestBase
+
+from oil_library_api.common.db import db_state, use_engine, get_session
+
+
+class MemoryDBTests(FunctionalTestBase):
+    def get_settings(self):
+        settings = super(MemoryDBTests, self).get_settings()
+        settings['memory_db.enabled'] = 'true'
+
+        return settings
+
+    def tearDown(self):
+        use_engine(None)
+
+    def test_memory_db(self):
+        assert db_state['engine'] is not None
+
+        memory_file = db_state['memory_file']
+        assert get_session().get_bind().url.database == memory_file
+        assert os.path.exists(memory_file)
+
+        oils = self.testapp.get('/oil').json_body
+        assert len(oils) > 0
+
+        adios_oil_id = oils[0]['adios_oil_id']
+        res = self.testapp.get('/oil/{0}'.format(adios_oil_id)).json_body
+        assert res['adios_oil_id'] == adios_oil_id
+
+        self.testapp.get('/distinct')
+
+    def test_read_only(self):
+        session = get_session()
+
+        with self.assertRaises(Exception):
+            session.execute('DELETE FROM oils')
+
+    def test_connection_per_thread(self):
+        engine = db_state['engine']
+        connections = []
+        counts = []
+
+        def read():
+            conn = engine.connect()
+
+            try:
+                connections.append(conn.connection.connection)
+                counts.append(conn.execute('SELECT count(*) FROM oils')
+                              .scalar())
+
+                # hold on to the connection until every thread has one
+                while len(connections) < 4:
+                    time.sleep(0.01)
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=read) for _i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(set([id(c) for c in connections])) == 4
+        assert len(set(counts)) == 1 and counts[0] > 0
+
+    def test_copy_removed(self):
+        memory_file = db_state['memory_file']
+
+        use_engine(None)
+
+        assert not os.path.exists(memory_file)
@@ -0,0 +1,69 @@
+"""
+Functional tests for the Metrics Web API
+"""
+import time
+
+from base import FunctionalTestBase
+
+from webob import Request
+
+from oil_library_api.common import compression
+from oil_library_api.common.metrics import metrics
+
+
+class MetricsTests(FunctionalTestBase):
+    def get_settings(self):
+        settings = super(MetricsTests, self).get_settings()
+        settings['metrics.server_timing'] = 'true'
+
+        return settings
+
+    def test_get_metrics(self):
+        metrics.reset()
+
+        resp = self.testapp.get('/oil/{0}'.format('AD00009'))
+        assert 'db;dur=' in resp.headers['Server-Timing']
+
+        text = self.testapp.get('/metrics').text
+
+        assert ('oil_library_api_request_duration_seconds_count'
+                '{method="GET",route="oil:detail"} 1.0') in text
+        assert 'oil_library_api_db_queries_total{route="oil:detail"}' in text
+        assert 'oil_library_api_cache_hits_total{cache="oil detail"}' in text
+
+    def test_route_views(self):
+        metrics.reset()
+
+        self.testapp.get('/oil')
+        self.testapp.get('/oil', params={'ids': 'AD00009'})
+        self.testapp.get('/oil/AD00009/properties')
+        self.testapp.get('/oil/AD00009/bogus', status=404)
+
+        text = self.testapp.get('/metrics').text
+
+        for route in ('oil:list', 'oil:batch', 'oil:properties', 'oil'):
+            assert ('oil_library_api_request_duration_seconds_count'
+                    '{{method="GET",route="{}"}} 1.0'.format(route)) in text
+
+    def test_compression_timed(self):
+        # the metrics tween is outside the compression tween, so the
+        # request time includes compressing the response
+        gzip_compress = compression.gzip_compress
+
+        def slow_gzip_compress(body, level=9):
+            time.sleep(0.1)
+            return gzip_compress(body, level)
+
+        compression.gzip_compress = slow_gzip_compress
+        try:
+            resp = (Request.blank('/oil/AD00009',
+                                  headers={'Accept-Encoding': 'gzip'})
+                    .get_response(self.testapp.app))
+        finally:
+            compression.gzip_compress = gzip_compress
+
+        assert resp.content_encoding == 'gzip'
+
+        app_ms = float(resp.headers['Server-Timing']
+                       .split('app;dur=')[1].split(',')[0])
+        assert app_ms >= 100.0
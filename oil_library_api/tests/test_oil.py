@@ -1,8 +1,21 @@
 """
 Functional tests for the Model Web API
 """
+import zlib
+import json
+
 from base import FunctionalTestBase
 
+from webob import Request
+
+from oil_library_api.common.db import get_session
+from oil_library_api.common.compression import (choose_encoding,
+                                                 configure_compression)
+from oil_library_api.common.streaming import ndjson_chunks, gzip_chunks
+from oil_library_api.views.oil import (oil_list_snapshot,
+                                       oil_list_projections,
+                                       get_oil_viscosity)
+
 from pprint import PrettyPrinter
 pp = PrettyPrinter(indent=2)
 
@@ -70,3 +83,246 @@ class OilTests(FunctionalTestBase):
                       'ref_temp_k',
                       'weathering'):
                 assert k in kvis
+
+    def test_get_oil_no_id_is_versioned(self):
+        resp = self.testapp.get('/oil')
+        version = resp.headers['X-Oil-Library-Version']
+
+        assert resp.content_type == 'application/json'
+        assert len(version) == 40
+
+        resp = self.testapp.get('/oil')
+        assert resp.headers['X-Oil-Library-Version'] == version
+
+    def test_get_oil_no_id_not_modified(self):
+        resp = self.testapp.get('/oil')
+        etag = resp.headers['ETag']
+
+        assert 'max-age' in resp.headers['Cache-Control']
+
+        resp = self.testapp.get('/oil', headers={'If-None-Match': etag},
+                                status=304)
+        assert resp.headers['ETag'] == etag
+
+    def test_get_oil_valid_id_not_modified(self):
+        resp = self.testapp.get('/oil/{0}'.format('AD00009'))
+        etag = resp.headers['ETag']
+
+        self.testapp.get('/oil/{0}'.format('AD00009'),
+                         headers={'If-None-Match': etag},
+                         status=304)
+        self.testapp.get('/oil/{0}'.format('AD00010'),
+                         headers={'If-None-Match': etag},
+                         status=200)
+
+    def test_etag_per_encoding(self):
+        for path in ('/oil', '/oil/AD00009', '/distinct'):
+            plain = Request.blank(path).get_response(self.testapp.app)
+            gzipped = Request.blank(path, headers={'Accept-Encoding': 'gzip'}
+                                    ).get_response(self.testapp.app)
+
+            assert plain.content_encoding is None
+            assert gzipped.content_encoding == 'gzip'
+            assert gzipped.etag == plain.etag + '-gzip'
+
+            # either representation is fresh
+            for etag in (plain.etag, gzipped.etag):
+                resp = self.testapp.get(path, status=304,
+                                        headers={'If-None-Match':
+                                                 '"{}"'.format(etag)})
+                assert resp.etag == etag
+
+    def test_get_oil_filtered(self):
+        resp = self.testapp.get('/oil', params={'category': 'Crude',
+                                                'api_min': 20,
+                                                'api_max': 40,
+                                                'sort': '-api'})
+        oils = resp.json_body
+
+        assert int(resp.headers['X-Total-Count']) == len(oils)
+        assert [o['api'] for o in oils] == sorted([o['api'] for o in oils],
+                                                  reverse=True)
+
+        for o in oils:
+            assert 20 <= o['api'] <= 40
+            assert any([c.startswith('Crude') for c in o['categories']])
+
+    def test_get_oil_paged(self):
+        all_oils = self.testapp.get('/oil',
+                                    params={'sort': 'name'}).json_body
+
+        resp = self.testapp.get('/oil', params={'sort': 'name',
+                                                'limit': 5,
+                                                'offset': 5})
+
+        assert int(resp.headers['X-Total-Count']) == len(all_oils)
+        assert resp.json_body == all_oils[5:10]
+
+    def test_get_oil_bad_params(self):
+        self.testapp.get('/oil', params={'limit': 'ten'}, status=400)
+        self.testapp.get('/oil', params={'sort': 'bogus'}, status=400)
+
+    def test_get_oil_ndjson(self):
+        oils = self.testapp.get('/oil').json_body
+
+        for params, headers in (({'stream': '1'}, {}),
+                                ({}, {'Accept': 'application/x-ndjson'})):
+            resp = self.testapp.get('/oil', params=params, headers=headers)
+
+            assert resp.content_type == 'application/x-ndjson'
+            assert [json.loads(l) for l in resp.text.splitlines()] == oils
+
+    def test_get_oil_ndjson_gzipped(self):
+        oils = self.testapp.get('/oil', params={'limit': 10}).json_body
+
+        # WebTest decodes the gzipped content for us
+        resp = self.testapp.get('/oil', params={'stream': '1', 'limit': 10},
+                                headers={'Accept-Encoding': 'gzip'})
+        assert [json.loads(l) for l in resp.text.splitlines()] == oils
+
+        raw = (Request.blank('/oil?stream=1&limit=10',
+                             headers={'Accept-Encoding': 'gzip'})
+               .get_response(self.testapp.app))
+        assert raw.content_encoding == 'gzip'
+        assert raw.etag.endswith('-gzip')
+
+        # a q of 0 refuses gzip
+        raw = (Request.blank('/oil?stream=1&limit=10',
+                             headers={'Accept-Encoding': 'gzip;q=0'})
+               .get_response(self.testapp.app))
+        assert raw.content_encoding is None
+        assert [json.loads(l) for l in raw.body.splitlines()] == oils
+
+    def test_get_oil_precompressed(self):
+        oils = self.testapp.get('/oil').json_body
+        snapshot = oil_list_snapshot.get(get_session())
+
+        # WebTest would decode the content, so we go around it.  The
+        # stored encoding is sent as it is.
+        resp = (Request.blank('/oil', headers={'Accept-Encoding': 'gzip'})
+                .get_response(self.testapp.app))
+
+        assert resp.content_encoding == 'gzip'
+        assert resp.body == snapshot.encoded['gzip']
+        assert json.loads(zlib.decompress(resp.body,
+                                          16 + zlib.MAX_WBITS)) == oils
+
+        resp = self.testapp.get('/oil',
+                                headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in resp.headers
+        assert resp.body == snapshot.body
+
+    def test_choose_encoding(self):
+        for header, encoding in (('gzip, deflate', 'gzip'),
+                                 ('br;q=0.5, gzip', 'gzip'),
+                                 ('gzip, br', 'br'),
+                                 ('*', 'br'),
+                                 ('gzip;q=0, deflate', None),
+                                 ('', None)):
+            request = Request.blank('/', headers={'Accept-Encoding': header})
+
+            assert choose_encoding(request, ('gzip', 'br')) == encoding
+
+    def test_get_oil_detail_gzipped(self):
+        oil = self.testapp.get('/oil/AD00009').json_body
+
+        resp = (Request.blank('/oil/AD00009',
+                              headers={'Accept-Encoding': 'gzip'})
+                .get_response(self.testapp.app))
+
+        assert resp.content_encoding == 'gzip'
+        assert 'Accept-Encoding' in resp.vary
+        assert json.loads(zlib.decompress(resp.body,
+                                          16 + zlib.MAX_WBITS)) == oil
+
+    def test_gzip_chunks(self):
+        chunks = list(ndjson_chunks([{'a': i} for i in range(100)],
+                                    chunk_size=8))
+        gzipped = list(gzip_chunks(chunks))
+
+        assert len(gzipped) > 1
+        assert (zlib.decompress(b''.join(gzipped), 16 + zlib.MAX_WBITS) ==
+                b''.join(chunks))
+
+        # the configured level is used by default
+        configure_compression(level=1)
+        try:
+            assert gzipped != list(gzip_chunks(chunks))
+            assert (b''.join(gzip_chunks(chunks)) ==
+                    b''.join(gzip_chunks(chunks, 1)))
+        finally:
+            configure_compression(level=6)
+
+    def test_get_oil_batch(self):
+        ids = ['AD00010', 'AD00009', 'bogus']
+
+        resp = self.testapp.get('/oil', params={'ids': ','.join(ids)})
+        oils = resp.json_body
+
+        assert [o['adios_oil_id'] for o in oils] == ids[:2]
+        assert resp.headers['X-Missing-Oil-Ids'] == 'bogus'
+
+        for o in oils:
+            single = self.testapp.get('/oil/{0}'.format(o['adios_oil_id']))
+            assert o == single.json_body
+
+    def test_post_oil_batch(self):
+        ids = ['AD00009', 'AD00010']
+
+        resp = self.testapp.post_json('/oil/batch', {'ids': ids})
+        assert [o['adios_oil_id'] for o in resp.json_body] == ids
+
+        self.testapp.post_json('/oil/batch', {'ids': 'AD00009'}, status=400)
+        self.testapp.post_json('/oil/bogus', {'ids': ids}, status=404)
+
+    def test_get_oil_fields(self):
+        fields = ['adios_oil_id', 'api', 'name']
+        full = dict([(o['adios_oil_id'], o)
+                     for o in self.testapp.get('/oil').json_body])
+
+        oils = self.testapp.get('/oil', params={'fields': 'name,api,'
+                                                          'adios_oil_id'})
+        assert len(oils.json_body) == len(full)
+
+        for o in oils.json_body:
+            assert sorted(o.keys()) == fields
+            assert o['name'] == full[o['adios_oil_id']]['name']
+
+        page = self.testapp.get('/oil', params={'fields': 'name',
+                                                'sort': 'name',
+                                                'limit': 5}).json_body
+        assert len(page) == 5
+        assert all([list(o.keys()) == ['name'] for o in page])
+
+        self.testapp.get('/oil', params={'fields': 'bogus'}, status=400)
+
+    def test_get_oil_fields_skips_computation(self):
+        oil_list_snapshot.invalidate()
+        oil_list_projections.clear()
+        viscosity_stats = get_oil_viscosity.cache.stats()
+
+        oils = self.testapp.get('/oil', params={'fields': 'adios_oil_id,'
+                                                          'name'}).json_body
+        assert len(oils) > 0
+
+        stats = get_oil_viscosity.cache.stats()
+        assert stats['hits'] == viscosity_stats['hits']
+        assert stats['misses'] == viscosity_stats['misses']
+
+    def test_get_oil_valid_id_fields(self):
+        full = self.testapp.get('/oil/AD00009').json_body
+
+        oil = self.testapp.get('/oil/AD00009',
+                               params={'fields': 'name,densities'}).json_body
+        assert oil == {'name': full['name'],
+                       'densities': full['densities']}
+
+        batch = self.testapp.get('/oil', params={'ids': 'AD00009,AD00010',
+                                                 'fields': 'adios_oil_id,'
+                                                           'imported'})
+        keys = [sorted(o.keys()) for o in batch.json_body]
+        assert keys == [['adios_oil_id', 'imported']] * 2
+        assert batch.json_body[0]['imported'] == full['imported']
+
+        self.testapp.get('/oil/AD00009', params={'fields': 'bogus'},
+                         status=400)
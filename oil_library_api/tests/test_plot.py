@@ -0,0 +1,86 @@
+"""
+Functional tests for the viscosity charts
+"""
+import os
+import shutil
+import tempfile
+
+from base import FunctionalTestBase
+
+from oil_library_api.common.db import get_session, get_db_fingerprint
+from oil_library_api.common.plots import plot_cache
+from oil_library_api.scripts.plot_oil_viscosity import plot_oil_viscosities
+
+
+class PlotTests(FunctionalTestBase):
+    def setUp(self):
+        super(PlotTests, self).setUp()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = plot_cache.directory
+        plot_cache.directory = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        plot_cache.directory = self.cache_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_viscosity_png(self):
+        resp = self.testapp.get('/oil/AD00009/viscosity.png')
+
+        assert resp.content_type == 'image/png'
+        assert resp.body.startswith(b'\x89PNG')
+        etag = resp.etag
+
+        fingerprint = get_db_fingerprint(get_session())
+        assert plot_cache.get(fingerprint, 'AD00009', 'png') == resp.body
+
+        # served from the cache
+        plot_cache.put(fingerprint, 'AD00009', 'png', b'cached')
+        resp = self.testapp.get('/oil/AD00009/viscosity.png')
+        assert resp.body == b'cached'
+
+        self.testapp.get('/oil/AD00009/viscosity.png',
+                         headers={'If-None-Match': etag},
+                         status=304)
+
+    def test_old_fingerprints_removed(self):
+        old = 'abcdef0123456789'
+        other = os.path.join(plot_cache.directory, 'not_a_fingerprint')
+
+        plot_cache.put(old, 'AD00009', 'png', b'old')
+        os.makedirs(other)
+
+        self.testapp.get('/oil/AD00009/viscosity.png')
+
+        fingerprint = get_db_fingerprint(get_session())
+        assert (sorted(os.listdir(plot_cache.directory)) ==
+                sorted([fingerprint, 'not_a_fingerprint']))
+
+    def test_get_viscosity_svg(self):
+        resp = self.testapp.get('/oil/AD00009/viscosity.svg')
+
+        assert resp.content_type == 'image/svg+xml'
+        assert b'<svg' in resp.body
+
+    def test_get_viscosity_plot_not_found(self):
+        self.testapp.get('/oil/bogus/viscosity.png', status=404)
+        self.testapp.get('/oil/../viscosity.png', status=404)
+        self.testapp.get('/oil/AD00009/viscosity.gif', status=404)
+
+    def test_plot_oil_viscosities(self):
+        output_dir = os.path.join(self.tmp_dir, 'plots')
+        ids = ['AD00009', 'AD00010', 'AD00011']
+
+        for processes in (1, 2):
+            plot_oil_viscosities({'adios_ids': ','.join(ids),
+                                  'output_dir': output_dir,
+                                  'processes': processes})
+
+            assert (sorted(os.listdir(output_dir)) ==
+                    ['{}.viscosity.png'.format(i) for i in ids])
+
+            shutil.rmtree(output_dir)
+
+        with self.assertRaises(ValueError):
+            plot_oil_viscosities({'adios_ids': 'bogus',
+                                  'output_dir': output_dir})
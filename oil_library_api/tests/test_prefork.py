@@ -0,0 +1,126 @@
+"""
+Tests for the pre-forking server
+"""
+import os
+import json
+import time
+import signal
+import urllib2
+import threading
+
+from base import FunctionalTestBase
+
+from oil_library_api.common.db import use_engine
+from oil_library_api.prefork import start_prefork, stop_prefork
+
+
+def pid_app(environ, start_response):
+    'responds with the pid of the worker, a little later'
+    time.sleep(0.02)
+
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode('ascii')]
+
+
+def worker_pids(url, requests=100, clients=8):
+    '''
+        The pids of the workers that served the requests, made by
+        several clients at once.
+    '''
+    pids = []
+    lock = threading.Lock()
+
+    def client():
+        for _i in range(requests // clients):
+            pid = int(urllib2.urlopen(url, timeout=30).read())
+
+            with lock:
+                pids.append(pid)
+
+    threads = [threading.Thread(target=client) for _i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return set(pids)
+
+
+class PreforkTests(FunctionalTestBase):
+    def test_serve_app(self):
+        process, url = start_prefork(self.testapp.app, workers=2)
+
+        try:
+            oils = json.loads(urllib2.urlopen(url + '/oil').read())
+            assert len(oils) > 0
+
+            ready = urllib2.urlopen(url + '/health/ready')
+            assert ready.getcode() == 200
+        finally:
+            stop_prefork(process)
+
+        assert process.exitcode is not None
+
+    def test_requests_spread_over_workers(self):
+        process, url = start_prefork(pid_app, workers=2, threads=1)
+
+        try:
+            pids = worker_pids(url + '/')
+
+            assert len(pids) == 2
+            assert process.pid not in pids
+        finally:
+            stop_prefork(process)
+
+    def test_restart_killed_worker(self):
+        process, url = start_prefork(pid_app, workers=2, threads=1)
+
+        try:
+            pids = worker_pids(url + '/')
+            killed = pids.pop()
+            os.kill(killed, signal.SIGKILL)
+
+            # the parent replaces the worker after its restart delay
+            new_pids = set()
+            deadline = time.time() + 10
+
+            while time.time() < deadline and not new_pids:
+                new_pids = worker_pids(url + '/', 16) - pids - set([killed])
+
+            assert new_pids
+        finally:
+            stop_prefork(process)
+
+    def test_server_fails_to_start(self):
+        # the server exits before it listens, on the invalid setting
+        with self.assertRaises(RuntimeError):
+            start_prefork(pid_app, workers='many')
+
+
+class PreforkMemoryDBTests(FunctionalTestBase):
+    '''
+        Each worker opens its own connections to the in-memory copy of
+        the library, rather than using the ones of the parent.
+    '''
+    def get_settings(self):
+        settings = super(PreforkMemoryDBTests, self).get_settings()
+        settings['memory_db.enabled'] = 'true'
+        settings['warmup.enabled'] = 'false'
+
+        return settings
+
+    def tearDown(self):
+        use_engine(None)
+
+    def test_serve_details(self):
+        oils = self.testapp.get('/oil').json_body
+        process, url = start_prefork(self.testapp.app, workers=2)
+
+        try:
+            for oil in oils[:20]:
+                detail = json.loads(urllib2.urlopen(
+                    '{}/oil/{}'.format(url, oil['adios_oil_id'])).read())
+
+                assert detail['adios_oil_id'] == oil['adios_oil_id']
+        finally:
+            stop_prefork(process)
@@ -0,0 +1,74 @@
+"""
+Functional tests for the oil properties Web API
+"""
+import numpy as np
+
+from base import FunctionalTestBase
+
+from oil_library_api.common.db import get_session, get_db_fingerprint
+from oil_library_api.views.properties import (default_temps_k,
+                                              oil_properties_cache)
+
+
+class OilPropertiesTests(FunctionalTestBase):
+    def test_get_oil_properties(self):
+        oils = dict([(o['adios_oil_id'], o)
+                     for o in self.testapp.get('/oil').json_body])
+        adios_oil_id = [a for a, o in sorted(oils.items())
+                        if o['viscosity'] is not None][0]
+
+        temps = [273.15 + 38, 280.0, 300.0]
+        resp = self.testapp.get('/oil/{}/properties'.format(adios_oil_id),
+                                params={'temps': ','.join(map(str, temps))})
+        props = resp.json_body
+
+        assert props['adios_oil_id'] == adios_oil_id
+        assert props['temps_k'] == temps
+
+        for k in ('density_kg_m_3', 'kvis_m_2_s', 'dvis_kg_ms'):
+            assert len(props[k]) == len(temps)
+
+        # the same viscosity as the listing
+        assert np.isclose(props['kvis_m_2_s'][0],
+                          oils[adios_oil_id]['viscosity'])
+
+        # viscosity and density go down with temperature
+        assert props['kvis_m_2_s'][1] > props['kvis_m_2_s'][2]
+        assert props['density_kg_m_3'][1] > props['density_kg_m_3'][2]
+
+        assert np.allclose(props['dvis_kg_ms'],
+                           np.array(props['kvis_m_2_s']) *
+                           np.array(props['density_kg_m_3']))
+
+        # only the default temperatures are cached
+        fingerprint = get_db_fingerprint(get_session())
+        found, _value = oil_properties_cache.lookup(adios_oil_id, fingerprint)
+        assert not found
+
+        self.testapp.get('/oil/{}/properties'.format(adios_oil_id),
+                         params={'temps': ','.join(map(str, temps))},
+                         headers={'If-None-Match': resp.etag},
+                         status=304)
+
+    def test_get_oil_properties_default_temps(self):
+        props = self.testapp.get('/oil/AD00010/properties').json_body
+
+        assert props['temps_k'] == list(default_temps_k)
+
+        fingerprint = get_db_fingerprint(get_session())
+        found, value = oil_properties_cache.lookup('AD00010', fingerprint)
+        assert found
+        assert value == props
+
+    def test_get_oil_properties_invalid(self):
+        self.testapp.get('/oil/bogus/properties', status=404)
+
+        # misses aren't cached
+        fingerprint = get_db_fingerprint(get_session())
+        found, _value = oil_properties_cache.lookup('bogus', fingerprint)
+        assert not found
+
+        for temps in ('', 'warm', '300,-1', '300,nan', '300,inf',
+                      ','.join(['300'] * 1001)):
+            self.testapp.get('/oil/AD00010/properties',
+                             params={'temps': temps}, status=400)
@@ -0,0 +1,64 @@
+"""
+Functional tests for the Search Web API
+"""
+from unittest import TestCase
+
+from base import FunctionalTestBase
+
+from oil_library_api.common.search import OilSearchIndex
+
+
+class SearchTests(FunctionalTestBase):
+    def test_get_search(self):
+        oil = self.testapp.get('/oil/{0}'.format('AD00009')).json_body
+
+        resp = self.testapp.get('/search', params={'q': oil['name']})
+        hits = resp.json_body
+
+        assert hits[0]['adios_oil_id'] == 'AD00009'
+        assert [h['score'] for h in hits] == sorted([h['score']
+                                                     for h in hits],
+                                                    reverse=True)
+
+    def test_get_search_bad_params(self):
+        self.testapp.get('/search', status=400)
+        self.testapp.get('/search', params={'q': 'oil', 'limit': 0},
+                         status=400)
+
+
+class SearchIndexTests(TestCase):
+    records = [{'adios_oil_id': 'AD00001', 'name': 'ALASKA NORTH SLOPE',
+                'synonyms': 'ANS', 'location': 'ALASKA',
+                'field_name': 'PRUDHOE BAY'},
+               {'adios_oil_id': 'AD00002', 'name': 'ARABIAN HEAVY',
+                'synonyms': '', 'location': 'SAUDI ARABIA',
+                'field_name': None},
+               {'adios_oil_id': 'AD00003', 'name': 'BUNKER C',
+                'synonyms': 'FUEL OIL 6,ALASKAN BUNKER', 'location': None,
+                'field_name': None}]
+
+    def ids(self, hits):
+        return [r['adios_oil_id'] for _score, r in hits]
+
+    def test_exact_and_synonym(self):
+        index = OilSearchIndex(self.records)
+
+        assert self.ids(index.search('ans')) == ['AD00001']
+        assert self.ids(index.search('fuel oil'))[0] == 'AD00003'
+
+    def test_name_outranks_location(self):
+        index = OilSearchIndex(self.records)
+
+        assert self.ids(index.search('arabian')) == ['AD00002']
+        assert self.ids(index.search('alaska'))[0] == 'AD00001'
+
+    def test_prefix(self):
+        index = OilSearchIndex(self.records)
+
+        assert self.ids(index.search('prud')) == ['AD00001']
+
+    def test_typo(self):
+        index = OilSearchIndex(self.records)
+
+        assert self.ids(index.search('alsaka slpoe'))[0] == 'AD00001'
+        assert self.ids(index.search('bunkr'))[0] == 'AD00003'
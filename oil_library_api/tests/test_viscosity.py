@@ -0,0 +1,63 @@
+"""
+Functional tests for the Viscosity Web API
+"""
+import numpy as np
+
+from base import FunctionalTestBase
+
+from oil_library import _get_db_session
+from oil_library.models import Oil
+from oil_library.oil_props import OilProps
+
+from oil_library_api.views.oil import get_oil_viscosity
+from oil_library_api.common.viscosity import KVisTable, default_k_v2
+
+
+class ViscosityTests(FunctionalTestBase):
+    def test_get_viscosity(self):
+        resp = self.testapp.get('/viscosity', params={'temp_k': 300.0})
+        res = resp.json_body
+
+        assert res['temp_k'] == 300.0
+        assert 'AD00009' in res['viscosity']
+
+    def test_get_viscosity_invalid_temp(self):
+        self.testapp.get('/viscosity', params={'temp_k': 'hot'}, status=400)
+        self.testapp.get('/viscosity', params={'temp_k': -10}, status=400)
+
+    def test_matches_oil_props(self):
+        session = _get_db_session()
+
+        table = KVisTable.from_session(session)
+        kvis = dict(zip(table.adios_oil_ids,
+                        table.kvis_at_temp(273.15 + 38)))
+
+        for oil in session.query(Oil):
+            expected = get_oil_viscosity(oil)
+
+            if expected is None:
+                assert np.isnan(kvis[oil.adios_oil_id])
+            else:
+                assert np.isclose(kvis[oil.adios_oil_id], expected)
+
+    def test_fitted_k_v2(self):
+        session = _get_db_session()
+        table = KVisTable.from_session(session)
+
+        oils = [o for o in session.query(Oil)
+                if o.api >= 0 and
+                len([k for k in o.kvis if k.weathering == 0.0]) >= 2]
+        assert len(oils) > 0
+
+        temps_k = np.array([273.15, 273.15 + 15, 273.15 + 38, 273.15 + 60])
+        kvis = np.array([table.kvis_at_temp(t) for t in temps_k]).T
+
+        for oil in oils:
+            i = table.adios_oil_ids.index(oil.adios_oil_id)
+
+            assert np.allclose(kvis[i], OilProps(oil).kvis_at_temp(temps_k))
+
+        # the fitted constants are not all the OilProps default
+        fitted = [table.k_v2[table.adios_oil_ids.index(o.adios_oil_id)]
+                  for o in oils]
+        assert not np.allclose(fitted, default_k_v2)
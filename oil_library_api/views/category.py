@@ -0,0 +1,37 @@
+""" Cornice services.
+"""
+from cornice import Service
+from pyramid.httpexceptions import HTTPNotFound
+
+from ..common.views import cors_policy
+from ..common.http_cache import conditional_get, make_etag
+from ..common.categories import get_category_tree
+from ..common.db import get_session
+from .oil import oil_list_snapshot
+
+
+category_oils_api = Service(name='category_oils',
+                            path='/category/{path}/oils',
+                            description=('List the oils in a category, '
+                                         'or any of its sub-categories'),
+                            cors_policy=cors_policy)
+
+
+@category_oils_api.get()
+def get_category_oils(request):
+    '''
+        Returns the searchable fields of the oils in the category with
+        the given path, like 'Crude' or 'Crude-Medium'.
+    '''
+    session = get_session()
+    path = request.matchdict['path']
+
+    snapshot = oil_list_snapshot.get(session)
+    conditional_get(request, make_etag(snapshot.version, 'category', path))
+
+    oil_ids = get_category_tree(session).oils_in(path)
+
+    if oil_ids is None:
+        raise HTTPNotFound()
+
+    return snapshot.index.records_for(oil_ids)
@@ -1,11 +1,17 @@
 """ Cornice services.
 """
+from collections import OrderedDict
+
 from cornice import Service
 
 from ..common.views import cors_policy
+from ..common.http_cache import conditional_get
+from ..common.snapshot import SnapshotCache
+from ..common.compression import set_snapshot_body
+from ..common.categories import get_category_tree
+from ..common.db import get_session
 
-from oil_library import _get_db_session
-from oil_library.models import ImportedRecord, Oil, Category
+from oil_library.models import ImportedRecord, Oil
 
 distinct_api = Service(name='distinct', path='/distinct',
                        description=('List the distinct values of the '
@@ -15,22 +21,59 @@ distinct_api = Service(name='distinct', path='/distinct',
 
 @distinct_api.get()
 def get_distinct(request):
-    '''Returns all oils in JSON format'''
-    session = _get_db_session()
+    '''
+        Returns the distinct values of the searchable fields, and the
+        number of oils having each value, in JSON format.
+    '''
+    session = get_session()
+
+    snapshot = distinct_snapshot.get(session)
+    conditional_get(request, snapshot.version)
+
+    return set_snapshot_body(request, snapshot)
 
-    res = []
 
+def count_key(value):
+    '''
+        The counts are keyed by value, and JSON object keys are strings,
+        so the oils without a value are counted under 'null'.
+    '''
+    return 'null' if value is None else value
+
+
+def build_distinct(session):
+    '''
+        Collect the distinct values of all the columns in a single pass
+        over the imported records, counting the oils that have each value.
+    '''
     attrs = ('location',
              'field_name')
-    for a in attrs:
-        values = [r[0] for r in (session.query(getattr(ImportedRecord, a))
-                                 .distinct().all())]
-        res.append(dict(column=a, values=values))
+    counts = dict([(a, OrderedDict()) for a in attrs])
+
+    columns = [getattr(ImportedRecord, a) for a in attrs] + [Oil.id]
+    rows = (session.query(*columns)
+            .select_from(ImportedRecord)
+            .outerjoin('oil'))
 
-    categories = dict([(c.name, [child.name for child in c.children])
-                       for c in (session.query(Category)
-                                 .filter(Category.parent == None))
-                       ])
-    res.append(dict(column='product_type', values=categories))
+    for row in rows:
+        has_oil = row[-1] is not None
+
+        for a, value in zip(attrs, row):
+            counts[a][value] = counts[a].get(value, 0) + has_oil
+
+    res = [dict(column=a,
+                values=list(counts[a].keys()),
+                counts=dict([(count_key(v), n)
+                             for v, n in counts[a].items()]))
+           for a in attrs]
+
+    tree = get_category_tree(session)
+    res.append(dict(column='product_type',
+                    values=tree.product_types(),
+                    counts=dict([(p, len(tree.oils_in(p)))
+                                 for p in tree.paths.values()])))
 
     return res
+
+
+distinct_snapshot = SnapshotCache('distinct', build_distinct)
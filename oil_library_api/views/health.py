@@ -0,0 +1,25 @@
+""" Cornice services.
+"""
+from cornice import Service
+
+from ..warmup import warmup_state
+
+ready_api = Service(name='ready', path='/health/ready',
+                    description=('Report whether the caches and indexes '
+                                 'have been warmed up'))
+
+
+@ready_api.get()
+def get_ready(request):
+    '''
+        Returns the warm-up progress.  The status code is 200 once the
+        server is ready to take traffic, and 503 until then.
+    '''
+    res = warmup_state.report()
+
+    if not warmup_state.ready:
+        request.response.status = 503
+
+    request.response.cache_control = 'no-store'
+
+    return res
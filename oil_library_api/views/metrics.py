@@ -0,0 +1,21 @@
+""" Cornice services.
+"""
+from cornice import Service
+
+from ..common.metrics import metrics
+
+metrics_api = Service(name='metrics', path='/metrics',
+                      description=('Request, query and cache statistics '
+                                   'in the Prometheus text format'))
+
+
+@metrics_api.get()
+def get_metrics(request):
+    response = request.response
+
+    response.content_type = 'text/plain'
+    response.charset = 'utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    response.text = metrics.exposition().decode('utf-8')
+
+    return response
@@ -1,17 +1,27 @@
 """ Cornice services.
 """
-import re
 import logging
 
 from cornice import Service
-from pyramid.httpexceptions import HTTPNotFound
+from pyramid.httpexceptions import HTTPNotFound, HTTPBadRequest
 
+from sqlalchemy.orm import object_session, joinedload, subqueryload
 from sqlalchemy.orm.exc import NoResultFound
 
 from ..common.views import cors_policy, obj_id_from_url
-
-from oil_library import _get_db_session
-from oil_library.models import Oil, ImportedRecord
+from ..common.db import get_session, get_db_fingerprint
+from ..common.http_cache import conditional_get, make_etag
+from ..common.metrics import set_route_view
+from ..common.snapshot import Snapshot, SnapshotCache
+from ..common.compression import set_snapshot_body
+from ..common.cache import get_cache, cache_oil_arg
+from ..common.listing import OilListIndex
+from ..common.categories import get_category_tree
+from ..common.detail import (oil_detail_fields,
+                             load_oil_detail, load_oil_details)
+from ..common.streaming import ndjson_content_type, stream_records
+
+from oil_library.models import Oil
 from oil_library.oil_props import OilProps
 
 oil_api = Service(name='oil', path='/oil*obj_id',
@@ -21,94 +31,408 @@ oil_api = Service(name='oil', path='/oil*obj_id',
 logger = logging.getLogger(__name__)
 
 
-def memoize_oil_arg(func):
-    res = {}
+oil_detail_cache = get_cache('oil detail')
+oil_detail_projections = get_cache('oil detail projections')
+oil_list_projections = get_cache('oil list projections', max_size=32)
+
+max_batch_size = 200
 
-    def memoized_func(oil):
-        if oil.adios_oil_id not in res:
-            logger.info('loading in-memory oil dict.  Key: "{}"'
-                        .format(oil.adios_oil_id))
-            res[oil.adios_oil_id] = func(oil)
+# The handlers of the sub-resources of an oil, like
+# /oil/{adios_oil_id}/viscosity.png, by name.  The oil route matches
+# everything under /oil, so the views of the sub-resources are
+# registered here.
+oil_subresources = {}
 
-        return res[oil.adios_oil_id]
 
-    return memoized_func
+def oil_subresource(name):
+    def register(func):
+        oil_subresources[name] = func
+        return func
+
+    return register
 
 
 @oil_api.get()
 def get_oils(request):
-    session = _get_db_session()
+    session = get_session()
     obj_id = obj_id_from_url(request)
 
     if not obj_id:
+        if 'ids' in request.GET:
+            adios_oil_ids = [i for ids in request.GET.getall('ids')
+                             for i in ids.split(',')]
+            return get_oil_batch(request, session, adios_oil_ids)
+
         # Return all oils in JSON format.  We only return the searchable
-        # columns.
-        return [get_oil_searchable_fields(o) for o in session.query(Oil)]
+        # columns, which are pre-serialized once per database version.
+        set_route_view(request, 'list')
+        list_query = get_list_query(request)
+        fields = get_fields_param(request, list_fields)
+
+        if fields is not None and not list_query:
+            snapshot = get_projected_oil_list(session, fields)
+        else:
+            snapshot = oil_list_snapshot.get(session)
+
+        if wants_ndjson(request):
+            return stream_oil_list(request, snapshot, list_query, fields)
+
+        if list_query:
+            return get_oil_list_page(request, snapshot, list_query, fields)
+
+        conditional_get(request, snapshot.version, vary=list_vary)
+
+        response = set_snapshot_body(request, snapshot)
+
+        if fields is None:
+            response.headers['X-Oil-Library-Version'] = snapshot.version
+
+        return response
     else:
-        try:
-            oil = (session.query(Oil).join(ImportedRecord)
-                   .filter(ImportedRecord.adios_oil_id == obj_id).one())
+        subpath = request.matchdict['obj_id'][1:]
+        if subpath:
+            return get_oil_subresource(request, session, obj_id, subpath)
 
-            return prune_oil_json(oil.tojson())
-        except NoResultFound:
-            raise HTTPNotFound()
+        set_route_view(request, 'detail')
 
+        fields = get_fields_param(request, oil_detail_fields())
 
-@memoize_oil_arg
-def get_oil_searchable_fields(oil):
-    return {'adios_oil_id': oil.imported.adios_oil_id,
-            'name': oil.name,
-            'location': oil.imported.location,
-            'field_name': oil.imported.field_name,
-            'product_type': oil.imported.product_type,
-            'oil_class': oil.imported.oil_class,
-            'api': oil.api,
-            'pour_point': get_pour_point(oil),
-            'viscosity': get_oil_viscosity(oil),
-            'categories': get_category_paths(oil),
-            'categories_str': get_category_paths_str(oil),
-            'synonyms': get_synonyms(oil),
-            'quality_index': oil.quality_index
-            }
+        fingerprint = get_db_fingerprint(session)
+        conditional_get(request, make_etag(fingerprint, obj_id,
+                                           *(fields or ())))
 
+        found, oil_json = lookup_oil_detail(obj_id, fingerprint, fields)
 
-def get_category_paths(oil, sep='-'):
-    return [sep.join([c.name for c in get_category_ancestors(cat)])
-            for cat in oil.categories]
+        if not found:
+            try:
+                oil_json = load_oil_detail(session, obj_id, fields)
+            except NoResultFound:
+                raise HTTPNotFound()
 
+            store_oil_detail(obj_id, fingerprint, fields, oil_json)
 
-def get_category_paths_str(oil, sep='-'):
-    regex = re.compile(r'\b(Crude-|Refined-)\b')
-    cat_str = ','.join(sorted(set(get_category_paths(oil))))
-    return regex.sub("", cat_str)
+        return oil_json
 
 
-def get_synonyms(oil, sep=','):
-    syn_list = [s.name for s in oil.imported.synonyms]
-    return ','.join(syn_list)
+@oil_api.post()
+def post_oils(request):
+    '''
+        POST /oil/batch with a JSON body like {"ids": ["AD00009", ...]}
+        returns the detail records of the oils, like GET /oil?ids=...
+    '''
+    if obj_id_from_url(request) != 'batch':
+        raise HTTPNotFound()
+
+    try:
+        adios_oil_ids = request.json['ids']
+    except (ValueError, KeyError, TypeError):
+        raise HTTPBadRequest('Expected a JSON body like {"ids": [...]}')
+
+    if (not isinstance(adios_oil_ids, list) or
+            not all([isinstance(i, basestring) for i in adios_oil_ids])):
+        raise HTTPBadRequest('The ids must be a list of adios_oil_ids')
+
+    return get_oil_batch(request, get_session(), adios_oil_ids)
+
+
+def get_oil_batch(request, session, adios_oil_ids):
+    '''
+        Returns the detail records of the oils with the given ids, in
+        the order requested.  Oils that are not in the detail cache are
+        loaded together.  The ids of any oils that were not found are
+        listed in the X-Missing-Oil-Ids header.
+    '''
+    set_route_view(request, 'batch')
+
+    adios_oil_ids = unique([i.strip() for i in adios_oil_ids if i.strip()])
+
+    if not adios_oil_ids:
+        raise HTTPBadRequest('No adios_oil_ids were given')
+
+    if len(adios_oil_ids) > max_batch_size:
+        raise HTTPBadRequest('At most {} oils can be requested at once'
+                             .format(max_batch_size))
+
+    fields = get_fields_param(request, oil_detail_fields())
+    fingerprint = get_db_fingerprint(session)
+
+    if request.method == 'GET':
+        conditional_get(request, make_etag(fingerprint, 'batch',
+                                           ','.join(adios_oil_ids),
+                                           *(fields or ())))
+
+    res = {}
+    for a in adios_oil_ids:
+        found, oil_json = lookup_oil_detail(a, fingerprint, fields)
+        if found:
+            res[a] = oil_json
+
+    loaded = load_oil_details(session,
+                              [a for a in adios_oil_ids if a not in res],
+                              fields)
+    for a, oil_json in loaded.items():
+        store_oil_detail(a, fingerprint, fields, oil_json)
+        res[a] = oil_json
+
+    missing = ','.join([a for a in adios_oil_ids if a not in res])
+    if missing:
+        # header values need to be native latin-1 strings
+        missing = missing.encode('latin-1', 'replace')
+        request.response.headers['X-Missing-Oil-Ids'] = missing
+
+    return [res[a] for a in adios_oil_ids if a in res]
+
+
+def get_oil_subresource(request, session, adios_oil_id, subpath):
+    name = '/'.join(subpath)
+
+    if name not in oil_subresources:
+        raise HTTPNotFound()
+
+    set_route_view(request, name)
+
+    return oil_subresources[name](request, session, adios_oil_id, name)
+
+
+def lookup_oil_detail(adios_oil_id, fingerprint, fields=None):
+    '''
+        Returns a (found, value) tuple for the detail record of the oil,
+        or the given fields of it.  Projections are cached separately,
+        and can also be made from a cached full record.
+    '''
+    if fields is None:
+        return oil_detail_cache.lookup(adios_oil_id, fingerprint)
+
+    found, oil_json = oil_detail_projections.lookup((adios_oil_id, fields),
+                                                    fingerprint)
+
+    if not found:
+        found, oil_json = oil_detail_cache.lookup(adios_oil_id, fingerprint)
+
+        if found:
+            oil_json = project(oil_json, fields)
+            oil_detail_projections.store((adios_oil_id, fields),
+                                         fingerprint, oil_json)
+
+    return found, oil_json
+
+
+def store_oil_detail(adios_oil_id, fingerprint, fields, oil_json):
+    if fields is None:
+        oil_detail_cache.store(adios_oil_id, fingerprint, oil_json)
+    else:
+        oil_detail_projections.store((adios_oil_id, fields), fingerprint,
+                                     oil_json)
+
+
+def get_fields_param(request, allowed):
+    '''
+        Parse the fields parameter, a comma separated list of the fields
+        to return, into a sorted tuple.  Returns None if there is none.
+    '''
+    if 'fields' not in request.GET:
+        return None
+
+    fields = set([f.strip() for param in request.GET.getall('fields')
+                  for f in param.split(',') if f.strip()])
+
+    if not fields:
+        raise HTTPBadRequest('No fields were given')
+
+    unknown = fields.difference(allowed)
+    if unknown:
+        raise HTTPBadRequest('Unknown fields: {}'
+                             .format(', '.join(sorted(unknown))))
+
+    return tuple(sorted(fields))
+
+
+def project(record, fields):
+    return dict([(f, record[f]) for f in fields])
+
+
+def unique(values):
+    seen = set()
+    res = []
+
+    for v in values:
+        if v not in seen:
+            seen.add(v)
+            res.append(v)
+
+    return res
 
 
-def get_category_ancestors(category):
+list_ranges = ('api', 'viscosity', 'pour_point')
+list_params = ('q', 'category', 'sort', 'limit', 'offset')
+list_vary = ('Accept', 'Accept-Encoding')
+
+
+def get_list_query(request):
+    '''
+        Parse the filtering, sorting and paging parameters of an oil
+        list request into keyword args for OilListIndex.query().
+        Returns None if there are none.
+    '''
+    params = request.GET
+    res = {}
+
+    if not any([p in params for p in list_params] +
+               [r + s in params
+                for r in list_ranges for s in ('_min', '_max')]):
+        return None
+
+    res['text'] = params.get('q')
+    res['category'] = params.get('category')
+    res['sort'] = params.get('sort')
+
+    for r in list_ranges:
+        low = get_number_param(params, r + '_min', float)
+        high = get_number_param(params, r + '_max', float)
+
+        if low is not None or high is not None:
+            res[r] = (low, high)
+
+    res['limit'] = get_number_param(params, 'limit', int)
+    res['offset'] = get_number_param(params, 'offset', int) or 0
+
+    if res['sort'] and res['sort'].lstrip('-') not in OilListIndex.sortable:
+        raise HTTPBadRequest('Cannot sort on "{}"'.format(res['sort']))
+
+    return res
+
+
+def get_number_param(params, name, number_type):
+    if name not in params:
+        return None
+
+    try:
+        value = number_type(params[name])
+    except ValueError:
+        raise HTTPBadRequest('Invalid {}: "{}"'.format(name, params[name]))
+
+    if number_type is int and value < 0:
+        raise HTTPBadRequest('Invalid {}: "{}"'.format(name, params[name]))
+
+    return value
+
+
+def get_oil_list_page(request, snapshot, list_query, fields=None):
+    conditional_get(request, make_etag(snapshot.version,
+                                       request.query_string),
+                    vary=list_vary)
+
+    total, page = snapshot.index.query(**list_query)
+    request.response.headers['X-Total-Count'] = str(total)
+
+    if fields is not None:
+        page = [project(r, fields) for r in page]
+
+    return page
+
+
+def wants_ndjson(request):
+    return (request.GET.get('stream') in ('1', 'true') or
+            ndjson_content_type in request.headers.get('Accept', ''))
+
+
+def stream_oil_list(request, snapshot, list_query, fields=None):
+    '''
+        Stream the oil list, or the requested page of it, as newline
+        delimited JSON.
+    '''
+    conditional_get(request, make_etag(snapshot.version, 'ndjson',
+                                       request.query_string),
+                    vary=list_vary)
+
+    if list_query:
+        total, records = snapshot.index.query(**list_query)
+    else:
+        total, records = len(snapshot.content), snapshot.content
+
+    request.response.headers['X-Total-Count'] = str(total)
+
+    if fields is not None and list_query:
+        records = [project(r, fields) for r in records]
+
+    return stream_records(request, records)
+
+
+def build_oil_list(session, fields=None):
     '''
-        Here we take a category, which is assumed to be a node
-        in a tree structure, and determine the parents of the category
-        all the way up to the apex.
+        Build the searchable fields of all oils, or just the given ones,
+        eagerly loading the relationships that they are computed from.
     '''
-    cat_list = []
-    cat_list.append(category)
+    imported = joinedload('imported')
+    options = [imported]
+
+    if fields is None or 'synonyms' in fields:
+        options.append(imported.subqueryload('synonyms'))
+    if fields is None or 'viscosity' in fields:
+        options.append(subqueryload('kvis'))
+
+    query = session.query(Oil).options(*options)
+
+    if fields is None:
+        return [get_oil_searchable_fields(o) for o in query]
+    else:
+        return [get_oil_fields(o, fields) for o in query]
+
+
+oil_list_snapshot = SnapshotCache('oil list', build_oil_list,
+                                  indexer=OilListIndex)
+
+
+def get_projected_oil_list(session, fields):
+    '''
+        A snapshot of the given searchable fields of all oils.  If the
+        full oil list is up to date, we project it, otherwise we only
+        compute the given fields.
+    '''
+    fingerprint = get_db_fingerprint(session)
+
+    def build():
+        full = oil_list_snapshot.peek(fingerprint)
+
+        if full is not None:
+            content = [project(r, fields) for r in full.content]
+        else:
+            content = build_oil_list(session, fields)
+
+        return Snapshot(fingerprint, content)
+
+    return oil_list_projections.get_or_compute(fields, fingerprint, build)
 
-    while category.parent is not None:
-        cat_list.append(category.parent)
-        category = category.parent
 
-    cat_list.reverse()
-    return cat_list
+@cache_oil_arg('searchable fields')
+def get_oil_searchable_fields(oil):
+    return get_oil_fields(oil, list_fields)
+
+
+def get_oil_fields(oil, fields):
+    return dict([(f, searchable_fields[f](oil)) for f in fields])
+
+
+def get_category_paths(oil, sep='-'):
+    tree = get_category_tree(object_session(oil))
+    return tree.category_paths(oil.adios_oil_id, sep)
+
+
+def get_category_paths_str(oil, sep='-'):
+    tree = get_category_tree(object_session(oil))
+    return tree.category_paths_str(oil.adios_oil_id, sep)
+
+
+def get_synonyms(oil, sep=','):
+    syn_list = [s.name for s in oil.imported.synonyms]
+    return ','.join(syn_list)
 
 
 def get_pour_point(oil):
     return [oil.pour_point_min_k, oil.pour_point_max_k]
 
 
+@cache_oil_arg('viscosity')
 def get_oil_viscosity(oil):
     if oil.api >= 0 and len(oil.kvis) > 0:
         oil_props = OilProps(oil)
@@ -117,20 +441,23 @@ def get_oil_viscosity(oil):
         return None
 
 
-def prune_oil_json(oil_json):
-    '''
-        The tojson() routine recursively includes a bunch of redundant
-        content that we don't want to return.  So we will prune it.
-    '''
-    for oil_attr_name in ('categories', 'cuts', 'densities', 'kvis',
-                          'sara_fractions', 'sara_densities',
-                          'molecular_weights'):
-        for oil_attr in oil_json[oil_attr_name]:
-            for attr_name in ('imported', 'oils', 'oil', 'oil_id'):
-                if attr_name in oil_attr:
-                    del oil_attr[attr_name]
+def get_imported_field(name):
+    return lambda oil: getattr(oil.imported, name)
+
 
-    del oil_json['imported']['oil']
-    del oil_json['estimated']['oil']
+# How each of the searchable fields of an oil is computed
+searchable_fields = {'adios_oil_id': get_imported_field('adios_oil_id'),
+                     'name': lambda oil: oil.name,
+                     'location': get_imported_field('location'),
+                     'field_name': get_imported_field('field_name'),
+                     'product_type': get_imported_field('product_type'),
+                     'oil_class': get_imported_field('oil_class'),
+                     'api': lambda oil: oil.api,
+                     'pour_point': get_pour_point,
+                     'viscosity': get_oil_viscosity,
+                     'categories': get_category_paths,
+                     'categories_str': get_category_paths_str,
+                     'synonyms': get_synonyms,
+                     'quality_index': lambda oil: oil.quality_index}
 
-    return oil_json
+list_fields = tuple(sorted(searchable_fields))
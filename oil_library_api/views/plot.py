@@ -0,0 +1,49 @@
+""" Cornice services.
+"""
+from pyramid.httpexceptions import HTTPNotFound
+
+from ..common.db import get_db_fingerprint
+from ..common.http_cache import conditional_get, make_etag
+from ..common.plots import (plot_formats, plot_cache, render_lock,
+                            valid_adios_oil_id, unweathered_kvis,
+                            render_viscosity_plot)
+from .oil import oil_subresource
+
+
+@oil_subresource('viscosity.png')
+@oil_subresource('viscosity.svg')
+def get_viscosity_plot(request, session, adios_oil_id, name):
+    '''
+        Returns a chart of the unweathered kinematic viscosities of the
+        oil against temperature, as PNG or SVG.  Charts are rendered
+        once per database, and served from the plot cache after that.
+    '''
+    fmt = name.rsplit('.', 1)[1]
+
+    if not valid_adios_oil_id.match(adios_oil_id):
+        raise HTTPNotFound()
+
+    fingerprint = get_db_fingerprint(session)
+    conditional_get(request, make_etag(fingerprint, adios_oil_id, name))
+
+    content = plot_cache.get(fingerprint, adios_oil_id, fmt)
+
+    if content is None:
+        data = unweathered_kvis(session, [adios_oil_id])
+
+        if adios_oil_id not in data:
+            raise HTTPNotFound()
+
+        oil_name, temps_k, kvis = data[adios_oil_id]
+
+        with render_lock:
+            content = render_viscosity_plot(adios_oil_id, oil_name,
+                                            temps_k, kvis, fmt)
+
+        plot_cache.put(fingerprint, adios_oil_id, fmt, content)
+
+    response = request.response
+    response.content_type = plot_formats[fmt]
+    response.body = content
+
+    return response
@@ -0,0 +1,115 @@
+""" Cornice services.
+"""
+import numpy as np
+
+from pyramid.httpexceptions import HTTPNotFound, HTTPBadRequest
+
+from sqlalchemy.orm import subqueryload
+from sqlalchemy.orm.exc import NoResultFound
+
+from ..common.db import get_db_fingerprint
+from ..common.http_cache import conditional_get, make_etag
+from ..common.cache import get_cache
+from .oil import oil_subresource
+
+from oil_library.models import Oil, ImportedRecord
+from oil_library.oil_props import OilProps
+
+# 0C to 60C, every 5 degrees
+default_temps_k = tuple(273.15 + np.arange(0.0, 61.0, 5.0))
+
+max_temps = 1000
+
+# Only the properties at the default temperatures are cached, by oil,
+# so requests for arbitrary temperatures (or oils) can't crowd the cache
+# with results nobody asks for again.
+oil_properties_cache = get_cache('oil properties', max_size=256)
+
+
+@oil_subresource('properties')
+def get_oil_properties(request, session, adios_oil_id, name):
+    '''
+        Returns the unweathered density (kg/m^3), and kinematic (m^2/s)
+        and dynamic (kg/(m s)) viscosities of the oil at each of the
+        temperatures (K) of the temps parameter, as evaluated by
+        OilProps.  Values that can't be evaluated are null.
+    '''
+    temps_k = get_temps_param(request)
+
+    fingerprint = get_db_fingerprint(session)
+    conditional_get(request, make_etag(fingerprint, adios_oil_id, name,
+                                       *temps_k))
+
+    def compute():
+        try:
+            oil = (session.query(Oil)
+                   .options(subqueryload('densities'), subqueryload('kvis'))
+                   .join(Oil.imported)
+                   .filter(ImportedRecord.adios_oil_id == adios_oil_id)
+                   .one())
+        except NoResultFound:
+            raise HTTPNotFound()
+
+        return oil_properties(oil, temps_k)
+
+    if temps_k == default_temps_k:
+        # an unknown oil raises, so isn't cached
+        return oil_properties_cache.get_or_compute(adios_oil_id, fingerprint,
+                                                   compute)
+    else:
+        return compute()
+
+
+def get_temps_param(request):
+    if 'temps' not in request.GET:
+        return default_temps_k
+
+    try:
+        temps_k = tuple([float(t) for t in request.GET['temps'].split(',')])
+    except ValueError:
+        raise HTTPBadRequest('Invalid temps: "{}"'
+                             .format(request.GET['temps']))
+
+    if not 0 < len(temps_k) <= max_temps:
+        raise HTTPBadRequest('Between 1 and {} temps can be requested'
+                             .format(max_temps))
+
+    if not all([t > 0.0 and not np.isinf(t) for t in temps_k]):
+        raise HTTPBadRequest('Invalid temps: "{}"'
+                             .format(request.GET['temps']))
+
+    return temps_k
+
+
+def oil_properties(oil, temps_k):
+    '''
+        Evaluates the properties of the oil at all the temperatures with
+        a single OilProps call per property.  Like get_oil_viscosity(),
+        we only evaluate the viscosity of oils with a non-negative API
+        and some kvis measurements.
+    '''
+    temps = np.array(temps_k, dtype=np.float64)
+    oil_props = OilProps(oil)
+
+    if oil.densities or oil.api is not None:
+        density = np.asarray(oil_props.density_at_temp(temps),
+                             dtype=np.float64)
+    else:
+        density = np.full(temps.shape, np.nan)
+
+    if oil.api >= 0 and len(oil.kvis) > 0:
+        kvis = np.asarray(oil_props.kvis_at_temp(temps), dtype=np.float64)
+    else:
+        kvis = np.full(temps.shape, np.nan)
+
+    dvis = kvis * density
+
+    return {'adios_oil_id': oil.adios_oil_id,
+            'temps_k': list(temps_k),
+            'density_kg_m_3': nan_to_none(density),
+            'kvis_m_2_s': nan_to_none(kvis),
+            'dvis_kg_ms': nan_to_none(dvis)}
+
+
+def nan_to_none(values):
+    return [None if np.isnan(v) else v for v in values.tolist()]
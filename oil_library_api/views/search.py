@@ -0,0 +1,59 @@
+""" Cornice services.
+"""
+from cornice import Service
+from pyramid.httpexceptions import HTTPBadRequest
+
+from ..common.views import cors_policy
+from ..common.http_cache import conditional_get, make_etag
+from ..common.cache import get_cache
+from ..common.search import OilSearchIndex
+from ..common.db import get_session
+from .oil import oil_list_snapshot
+
+
+search_api = Service(name='search', path='/search',
+                     description=('Search the oils by name, synonym, '
+                                  'location and field name'),
+                     cors_policy=cors_policy)
+
+search_index_cache = get_cache('search index')
+
+max_search_limit = 200
+
+
+@search_api.get()
+def get_search(request):
+    '''
+        Returns the searchable fields of the oils best matching the
+        q parameter, along with their score, best match first.
+    '''
+    session = get_session()
+
+    text = request.GET.get('q', '').strip()
+    if not text:
+        raise HTTPBadRequest('The q parameter is required')
+
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        raise HTTPBadRequest('Invalid limit: "{}"'
+                             .format(request.GET['limit']))
+
+    if not 0 < limit <= max_search_limit:
+        raise HTTPBadRequest('The limit must be between 1 and {}'
+                             .format(max_search_limit))
+
+    snapshot = oil_list_snapshot.get(session)
+    conditional_get(request, make_etag(snapshot.version, 'search',
+                                       text, limit))
+
+    index = get_search_index(snapshot)
+
+    return [dict(r, score=score) for score, r in index.search(text, limit)]
+
+
+def get_search_index(snapshot):
+    return search_index_cache.get_or_compute(
+        snapshot.version, snapshot.fingerprint,
+        lambda: OilSearchIndex(snapshot.content)
+    )
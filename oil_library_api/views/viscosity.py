@@ -0,0 +1,46 @@
+""" Cornice services.
+"""
+import numpy as np
+
+from cornice import Service
+from pyramid.httpexceptions import HTTPBadRequest
+
+from ..common.views import cors_policy
+from ..common.db import get_session, get_db_fingerprint
+from ..common.http_cache import conditional_get, make_etag
+from ..common.viscosity import get_kvis_table
+
+
+viscosity_api = Service(name='viscosity', path='/viscosity',
+                        description=('The kinematic viscosity of all oils '
+                                     'at a temperature'),
+                        cors_policy=cors_policy)
+
+
+@viscosity_api.get()
+def get_viscosity(request):
+    '''
+        Returns the unweathered kinematic viscosity (m^2/s) of all oils
+        at the temperature given by the temp_k parameter (default 38C).
+    '''
+    session = get_session()
+
+    try:
+        temp_k = float(request.GET.get('temp_k', 273.15 + 38))
+    except ValueError:
+        raise HTTPBadRequest('Invalid temp_k: "{}"'
+                             .format(request.GET['temp_k']))
+
+    if not temp_k > 0.0 or np.isinf(temp_k):
+        raise HTTPBadRequest('Invalid temp_k: "{}"'.format(temp_k))
+
+    fingerprint = get_db_fingerprint(session)
+    conditional_get(request, make_etag(fingerprint, 'viscosity', temp_k))
+
+    table = get_kvis_table(session)
+    kvis = table.kvis_at_temp(temp_k)
+
+    return {'temp_k': temp_k,
+            'viscosity': dict([(a, None if np.isnan(v) else float(v))
+                               for a, v in zip(table.adios_oil_ids, kvis)])
+            }
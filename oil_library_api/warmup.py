@@ -0,0 +1,230 @@
+"""
+Warming up the caches and indexes before the server takes traffic.
+
+The first requests after a restart would otherwise pay for the mapper
+configuration, the database connection, and building the oil list
+snapshot (which computes the searchable fields of every oil).
+"""
+import os
+import time
+import logging
+import threading
+
+import transaction
+
+from pyramid.settings import asbool
+
+from oil_library.models import Oil, DBSession
+
+from .common.db import (get_session, get_db_fingerprint, get_db_file,
+                        file_digest)
+from .common.detail import oil_detail_query, oil_detail_json
+from .common.viscosity import get_kvis_table, kvis_tables
+from .common.categories import get_category_tree, category_tree_cache
+from .common.library_snapshot import LibrarySnapshot
+from .views.oil import oil_list_snapshot, oil_detail_cache
+from .views.distinct import distinct_snapshot
+from .views.search import get_search_index
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupState(object):
+    '''
+        The progress of the warm-up, as reported by the readiness
+        endpoint.  The status is one of 'pending', 'running', 'ready'
+        or 'failed'.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, stages=()):
+        with self._lock:
+            self.status = 'pending'
+            self.stages = list(stages)
+            self.completed = []
+            self.current = None
+            self.error = None
+
+    @property
+    def ready(self):
+        return self.status == 'ready'
+
+    @property
+    def in_progress(self):
+        'a warm-up has been started, and has not finished yet'
+        return (self.status == 'running' or
+                (self.status == 'pending' and len(self.stages) > 0))
+
+    def start_stage(self, name):
+        with self._lock:
+            self.status = 'running'
+            self.current = name
+
+    def finish_stage(self, name, elapsed):
+        with self._lock:
+            self.completed.append({'stage': name,
+                                   'seconds': round(elapsed, 3)})
+            self.current = None
+
+    def finish(self, error=None):
+        with self._lock:
+            self.current = None
+            self.error = error
+            self.status = 'failed' if error is not None else 'ready'
+
+    def report(self):
+        with self._lock:
+            total = len(self.stages)
+
+            return {'status': self.status,
+                    'progress': (float(len(self.completed)) / total
+                                 if total else 1.0),
+                    'stages': list(self.stages),
+                    'completed': list(self.completed),
+                    'current': self.current,
+                    'error': self.error}
+
+
+warmup_state = WarmupState()
+
+
+def warm_database(session):
+    session.query(Oil.id).first()
+
+
+def warm_oil_list(session):
+    oil_list_snapshot.get(session)
+
+
+def warm_distinct(session):
+    distinct_snapshot.get(session)
+
+
+def warm_search_index(session):
+    get_search_index(oil_list_snapshot.get(session))
+
+
+def warm_viscosity_table(session):
+    get_kvis_table(session)
+
+
+def warm_categories(session):
+    get_category_tree(session)
+
+
+def warm_oil_details(session):
+    fingerprint = get_db_fingerprint(session)
+
+    for oil in oil_detail_query(session):
+        oil_detail_cache.store(oil.adios_oil_id, fingerprint,
+                               oil_detail_json(oil))
+
+
+def seed_from_snapshot(filename):
+    '''
+        Fills the oil list, distinct, category tree and kvis table caches
+        from a compiled library snapshot.  The snapshot is used if it was
+        compiled from the database we serve, or from a copy of it (with
+        the same content) somewhere else.  Otherwise it is ignored, with
+        a warning.
+    '''
+    start = time.time()
+
+    library = LibrarySnapshot(filename)
+    session = get_session()
+    fingerprint = get_db_fingerprint(session)
+
+    if library.fingerprint != fingerprint:
+        db_file = get_db_file(session)
+
+        if (library.db_digest is None or
+                not db_file or not os.path.exists(db_file) or
+                file_digest(db_file) != library.db_digest):
+            logger.warning('library snapshot {} was not compiled from the '
+                           'database we serve ({}).  Ignoring it.'
+                           .format(filename, db_file))
+            return False
+
+    tree = library.category_tree()
+
+    category_tree_cache.store('categories', fingerprint, tree)
+    oil_list_snapshot.seed(fingerprint, library.oil_list_records(tree))
+    distinct_snapshot.seed(fingerprint, library.payloads['distinct'])
+    kvis_tables.store('unweathered', fingerprint, library.kvis_table())
+
+    logger.info('loaded library snapshot {} in {:.3f}s'
+                .format(filename, time.time() - start))
+
+    return True
+
+
+def warmup_stages(settings):
+    stages = [('database', warm_database),
+              ('categories', warm_categories),
+              ('oil list', warm_oil_list),
+              ('distinct', warm_distinct),
+              ('search index', warm_search_index),
+              ('viscosity table', warm_viscosity_table)]
+
+    if asbool(settings.get('warmup.details', False)):
+        stages.append(('oil details', warm_oil_details))
+
+    return stages
+
+
+def run_warmup(stages):
+    logger.info('warming up...')
+
+    try:
+        with transaction.manager:
+            session = get_session()
+
+            for name, stage in stages:
+                warmup_state.start_stage(name)
+                start = time.time()
+
+                stage(session)
+
+                elapsed = time.time() - start
+                warmup_state.finish_stage(name, elapsed)
+                logger.info('warm-up stage "{}" finished in {:.3f}s'
+                            .format(name, elapsed))
+    except Exception as e:
+        logger.exception('warm-up failed')
+        warmup_state.finish(error=str(e))
+    else:
+        logger.info('warm-up finished')
+        warmup_state.finish()
+    finally:
+        # give the warm-up thread's connection back to the pool
+        DBSession.remove()
+
+
+def start_warmup(settings):
+    '''
+        Warm up according to the settings:
+
+        - warmup.enabled: whether to warm up at all.  If not, we are
+                          ready right away, and the caches are filled
+                          by the first requests.
+        - warmup.background: warm up in a background thread, instead of
+                             before returning the WSGI app.
+        - warmup.details: also load the detail JSON of every oil.
+    '''
+    if not asbool(settings.get('warmup.enabled', False)):
+        warmup_state.reset()
+        warmup_state.finish()
+        return
+
+    stages = warmup_stages(settings)
+    warmup_state.reset([name for name, _s in stages])
+
+    if asbool(settings.get('warmup.background', False)):
+        thread = threading.Thread(target=run_warmup, args=(stages,),
+                                  name='warmup')
+        thread.daemon = True
+        thread.start()
+    else:
+        run_warmup(stages)
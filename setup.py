@@ -63,11 +63,15 @@ setup(name=pkg_name,
       zip_safe=False,
       entry_points=('[paste.app_factory]\n'
                     '  main = oil_library_api:main\n'
+                    '[paste.server_runner]\n'
+                    '  prefork = oil_library_api.prefork:serve\n'
                     '[console_scripts]\n'
                     '  export_oil_library = oil_library_api.scripts.reports:export\n'
                     '  audit_oil_library = oil_library_api.scripts.reports:audit\n'
                     '  audit_oil_cuts = oil_library_api.scripts.reports:audit_cuts\n'
                     '  plot_oil_viscosity = oil_library_api.scripts.plot_oil_viscosity:main\n'
+                    '  compile_oil_library_snapshot = oil_library_api.scripts.compile_snapshot:main\n'
+                    '  benchmark_oil_library_api = oil_library_api.scripts.benchmark:main\n'
                     ),
       paster_plugins=['pyramid'],
       )